@@ -6,6 +6,7 @@ from flask import Flask, request, render_template, redirect, url_for, session, j
 from functools import wraps
 from sqlalchemy import create_engine, text
 from passlib.hash import pbkdf2_sha256
+import os
 
 
 # ----------------------------------------------------
@@ -81,6 +82,62 @@ app.register_blueprint(templates_bp)
 from timebars import timebars_bp
 app.register_blueprint(timebars_bp)
 
+# ----------------------------------------------------
+# 🔁 Blueprint: Bulk Timebar Recalc (API + CLI)
+# ----------------------------------------------------
+from timebar_recalc import timebar_recalc_bp
+app.register_blueprint(timebar_recalc_bp)
+
+# ----------------------------------------------------
+# ⏰ Blueprint: Reminder Scheduler
+# ----------------------------------------------------
+from reminder_scheduler import reminder_scheduler_bp, start_reminder_scheduler
+app.register_blueprint(reminder_scheduler_bp)
+
+if os.getenv("REMINDER_SCHEDULER_ENABLED") == "1":
+    start_reminder_scheduler()
+
+# ----------------------------------------------------
+# 📆 Blueprint: Upcoming Timebar Expiries
+# ----------------------------------------------------
+from expiry_index import expiry_index_bp
+app.register_blueprint(expiry_index_bp)
+
+# ----------------------------------------------------
+# 📦 Blueprint: Bulk Notice Generation
+# ----------------------------------------------------
+from notice_batch import notice_batch_bp
+app.register_blueprint(notice_batch_bp)
+
+# ----------------------------------------------------
+# 🧹 Blueprint: Data-Quality Checks
+# ----------------------------------------------------
+from data_quality import data_quality_bp
+app.register_blueprint(data_quality_bp)
+
+# ----------------------------------------------------
+# 📮 Blueprint: Case Change Outbox (async recalc)
+# ----------------------------------------------------
+from case_outbox import case_outbox_bp, record_case_change, wake_outbox_worker, start_case_outbox_worker
+app.register_blueprint(case_outbox_bp)
+
+# Case saves only write outbox rows, so every process drains by default
+# (READPAST claiming makes several drainers safe; see case_outbox.py)
+if os.getenv("CASE_OUTBOX_WORKER", "1") != "0":
+    start_case_outbox_worker()
+
+# ----------------------------------------------------
+# 🧰 Blueprint: Background Jobs (run by worker.py)
+# ----------------------------------------------------
+from jobs import jobs_bp
+app.register_blueprint(jobs_bp)
+
+# ----------------------------------------------------
+# 🪞 Blueprint: Mailbox Mirror (Graph delta sync CLI)
+# ----------------------------------------------------
+from mailbox_mirror import mailbox_mirror_bp
+app.register_blueprint(mailbox_mirror_bp)
+
 @app.route("/dev/timebars-test")
 @login_required
 def dev_timebars_test():
@@ -833,14 +890,14 @@ def update_case2(case_id):
         with get_db_connection() as conn:
             conn.execute(sql, params)
 
-            # ✅ If VoyageEndDate was updated, recalc timebars which will:
+            # ✅ The outbox worker recalcs timebars if VoyageEndDate changed, which will:
             #    - dismiss the MISSING_VOYAGE_END_DATE todo if now present
             #    - regenerate expiry dates + reminder todos
-            if "VoyageEndDate" in updates:
-                recalc_case_timebars(conn, case_id, org_id=1, voyage_end_col="VoyageEndDate")
+            record_case_change(conn, case_id, updates.keys(), "UPDATE", session.get("username"))
 
             conn.commit()
 
+        wake_outbox_worker()
         return jsonify(success=True), 200
 
     except Exception as err:
@@ -0,0 +1,112 @@
+# ==============================================
+# ⏱ bench_email_matching.py — Email-to-case matching benchmark
+# ==============================================
+# Compares the old matching (per case: ship substring + any of ~35 date
+# variant substrings) with CaseClassifier (one date extraction + one
+# vessel automaton pass per message) on a synthetic corpus of subjects.
+#
+#   python bench_email_matching.py [--cases 200] [--messages 20000] > bench_output.txt
+#
+# Also reports how many matches each side finds that the other doesn't —
+# the classifier picks up date spellings the variant list doesn't have
+# ("Apr 11th 2025", "11-Apr-2025" with a 4-digit year, ...).
+# ==============================================
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from email_matching import CaseClassifier, generate_date_variants, parse_cp_date
+
+VESSEL_WORDS = [
+    "Star", "Ocean", "Atlantic", "Pacific", "Nordic", "Global", "Golden", "Silver",
+    "Bright", "Eagle", "Falcon", "Harmony", "Spirit", "Pioneer", "Voyager", "Horizon",
+    "Aurora", "Coral", "Crystal", "Dolphin", "Emerald", "Fortune", "Glory", "Liberty",
+]
+NOISE = [
+    "Re:", "Fwd:", "laytime calc", "demurrage claim", "SOF attached", "NOR tendered",
+    "hire statement", "bunker survey", "please find", "revised", "final", "invoice",
+]
+DATE_FORMATS = [
+    "%d/%m/%Y", "%d.%m.%y", "%d-%b-%y", "%d %B %Y", "%d%b%y", "%B %d, %Y",
+    "%Y-%m-%d", "%d %b %Y", "%b %d %Y", "%d-%b-%Y",
+]
+
+def make_cases(n, rng):
+    cases = []
+    start = date(2023, 1, 1)
+    for i in range(n):
+        ship = f"{rng.choice(VESSEL_WORDS)} {rng.choice(VESSEL_WORDS)} {rng.randint(1, 99)}"
+        cp = start + timedelta(days=rng.randint(0, 900))
+        cases.append((f"DBLF{1000 + i} - {ship} - {cp:%d%b%y}", ship, cp))
+    return cases
+
+def make_subjects(cases, n, rng):
+    subjects = []
+    for _ in range(n):
+        parts = rng.sample(NOISE, 2)
+        if rng.random() < 0.6:
+            _, ship, cp = rng.choice(cases)
+            d = cp if rng.random() < 0.8 else cp + timedelta(days=rng.randint(1, 30))
+            parts += [ship.upper() if rng.random() < 0.3 else ship, "CP dd", d.strftime(rng.choice(DATE_FORMATS))]
+        else:
+            parts.append((date(2024, 1, 1) + timedelta(days=rng.randint(0, 700))).strftime(rng.choice(DATE_FORMATS)))
+        rng.shuffle(parts)
+        subjects.append(" ".join(parts))
+    return subjects
+
+def variant_matcher(cases):
+    prepared = [
+        (key, ship.lower(), [v.lower() for v in generate_date_variants(f"{cp:%d%b%y}")])
+        for key, ship, cp in cases
+    ]
+
+    def classify(text):
+        combined = text.lower()
+        return [key for key, ship, variants in prepared
+                if ship in combined and any(v in combined for v in variants)]
+    return classify
+
+def timed(fn, subjects):
+    t0 = time.perf_counter()
+    out = [fn(s) for s in subjects]
+    return time.perf_counter() - t0, out
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cases", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = make_cases(args.cases, rng)
+    subjects = make_subjects(cases, args.messages, rng)
+
+    t0 = time.perf_counter()
+    old = variant_matcher(cases)
+    old_build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    clf = CaseClassifier.from_categories(key for key, _, _ in cases)
+    new_build = time.perf_counter() - t0
+    assert all(parse_cp_date(key.split(" - ")[2]) == cp for key, _, cp in cases)
+
+    old_time, old_out = timed(old, subjects)
+    new_time, new_out = timed(clf.classify, subjects)
+
+    old_hits = sum(len(m) for m in old_out)
+    new_hits = sum(len(m) for m in new_out)
+    only_old = sum(len(set(a) - set(b)) for a, b in zip(old_out, new_out))
+    only_new = sum(len(set(b) - set(a)) for a, b in zip(old_out, new_out))
+
+    print(f"cases={args.cases} messages={args.messages} seed={args.seed}")
+    print(f"{'':22}{'build ms':>10}{'scan ms':>10}{'us/msg':>10}{'matches':>10}")
+    print(f"{'variant substrings':22}{old_build * 1e3:10.1f}{old_time * 1e3:10.1f}"
+          f"{old_time / len(subjects) * 1e6:10.1f}{old_hits:10d}")
+    print(f"{'CaseClassifier':22}{new_build * 1e3:10.1f}{new_time * 1e3:10.1f}"
+          f"{new_time / len(subjects) * 1e6:10.1f}{new_hits:10d}")
+    print(f"speed-up x{old_time / new_time:.1f}; only variant: {only_old}, only classifier: {only_new}")
+
+if __name__ == "__main__":
+    main()
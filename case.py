@@ -4,7 +4,8 @@ from sqlalchemy import text
 from utils import get_db_connection, login_required
 from datetime import date, datetime
 from case_documents import delete_case_documents
-from timebars import recalc_case_timebars
+from case_outbox import record_case_change, wake_outbox_worker
+from jobs import enqueue_job, jobs_in_main_db
 
 case_bp = Blueprint("case_bp", __name__)
 
@@ -172,26 +173,50 @@ def delete_case(case_id):
 
             deep_blue_ref = row.DeepBlueRef
 
-            # 2️⃣ Delete blobs (Charterparty folder)
-            try:
-                deleted = delete_case_documents(deep_blue_ref)
-                print(f"🧹 Deleted {deleted} blobs for case {deep_blue_ref}")
-            except Exception as blob_err:
-                print("❌ Blob delete failed:", blob_err)
-                return jsonify(
-                    success=False,
-                    error="Failed to delete case documents"
-                ), 500
-
-            # 3️⃣ Delete SQL row
+            # 2️⃣ Delete SQL row
             conn.execute(
                 text("DELETE FROM dbo.Cases WHERE CaseID = :id"),
                 {"id": case_id}
             )
+            record_case_change(conn, case_id, (), "DELETE", session.get("username"))
+
+            # 3️⃣ Blobs (Charterparty folder) are removed by the job worker;
+            #    the job commits with the DELETE when Jobs is in this DB
+            job_id = None
+            if deep_blue_ref and jobs_in_main_db():
+                job_id = enqueue_job(
+                    "case.delete_documents",
+                    {"DeepBlueRef": deep_blue_ref},
+                    created_by=session.get("username"),
+                    conn=conn
+                )
 
             conn.commit()
 
-        return jsonify(success=True)
+        wake_outbox_worker()
+
+        if deep_blue_ref and job_id is None:
+            try:
+                job_id = enqueue_job(
+                    "case.delete_documents",
+                    {"DeepBlueRef": deep_blue_ref},
+                    created_by=session.get("username")
+                )
+            except Exception as job_err:
+                # No queue: delete inline rather than orphan the blobs
+                print("❌ Could not queue blob delete, deleting inline:", job_err)
+                try:
+                    deleted = delete_case_documents(deep_blue_ref)
+                    print(f"🧹 Deleted {deleted} blobs for case {deep_blue_ref}")
+                except Exception as blob_err:
+                    print("❌ Blob delete failed:", blob_err)
+                    return jsonify(
+                        success=True,
+                        JobID=None,
+                        warning="Case deleted, but its documents could not be removed"
+                    )
+
+        return jsonify(success=True, JobID=job_id)
 
     except Exception as e:
         print(f"❌ Error deleting case {case_id}:", e)
@@ -291,13 +316,11 @@ def update_case(case_id):
         conn = get_db_connection()
         conn.execute(sql, params)
 
-        # ✅ If VoyageEndDate changed, recalc timebars (this will DISMISS the warning todo)
-        if "VoyageEndDate" in updates:
-            print("🟢 VoyageEndDate changed — running recalc_case_timebars")
-            from timebars import recalc_case_timebars
-            recalc_case_timebars(conn, case_id, org_id=1, voyage_end_col="VoyageEndDate")
+        # ✅ Timebar recalc (e.g. VoyageEndDate) runs off the outbox, not in this request
+        record_case_change(conn, case_id, updates.keys(), "UPDATE", session.get("username"))
 
         conn.commit()
+        wake_outbox_worker()
         return jsonify(success=True), 200
 
     except Exception as err:
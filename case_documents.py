@@ -13,6 +13,8 @@ import io
 from azure.storage.blob import BlobServiceClient
 from azure.core.exceptions import ResourceExistsError
 
+from jobs import register_job
+
 # ------------------------------------------------------------
 # ⚙️ Blueprint
 # ------------------------------------------------------------
@@ -91,6 +93,12 @@ def delete_case_documents(deep_blue_ref: str) -> int:
 
     return deleted
 
+@register_job("case.delete_documents")
+def delete_case_documents_job(payload, ctx):
+    deleted = delete_case_documents(payload["DeepBlueRef"])
+    print(f"🧹 Deleted {deleted} blobs for case {payload['DeepBlueRef']}")
+    return {"deleted": deleted}
+
 # ------------------------------------------------------------
 # 📎 Upload Charterparty PDF
 # ------------------------------------------------------------
@@ -0,0 +1,260 @@
+# ==============================================
+# 📮 case_outbox.py — Cases change outbox + background recalc
+# ==============================================
+# Every dbo.Cases write calls record_case_change() in the writer's own
+# transaction, before commit, so the outbox row exists iff the change
+# does. The save request returns straight away; the outbox worker drains
+# pending rows, coalesces several edits to one case into a single entry
+# and runs the set-based timebar recalc for the batch.
+#
+# drain_once() claims a batch, recalcs it and marks it processed on one
+# connection, in one transaction. If that fails it rolls back, and each
+# case is retried in its own transaction, so one bad case can't block the
+# queue. Claiming uses READPAST + UPDLOCK, so the drainers started in
+# every gunicorn worker and in worker.py never double-process a row; an
+# idle drainer costs one small query per poll. Timebar recalcs after a
+# Cases save depend on a drainer running somewhere — keep at least one.
+#
+#   CASE_OUTBOX_WORKER=0                  don't start the worker in this process
+#   flask --app app case-outbox drain     drain once and exit
+#   flask --app app case-outbox run       run the worker in the foreground
+# ==============================================
+import os
+import threading
+import time
+
+import click
+from flask import Blueprint, jsonify
+from sqlalchemy import text, bindparam
+
+from utils import get_db_connection, login_required
+from timebars import commit_and_notify, recalc_cases_timebars
+
+case_outbox_bp = Blueprint("case_outbox_bp", __name__, cli_group="case-outbox")
+
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_POLL_SECONDS = float(os.getenv("CASE_OUTBOX_POLL_SECONDS", "5"))
+OUTBOX_RETENTION_DAYS = 7
+
+# Changes to these columns (or a new case) need a timebar recalc
+RECALC_COLUMNS = {"VoyageEndDate"}
+
+# ---------------- Writing ----------------
+
+def record_case_change(conn, case_id: int, columns=(), operation: str = "UPDATE", changed_by=None):
+    """Add an outbox row in the caller's transaction."""
+    conn.execute(text("""
+        INSERT INTO dbo.CaseChangeOutbox (CaseID, Operation, ChangedColumns, ChangedBy)
+        VALUES (:CaseID, :Operation, :Columns, :ChangedBy)
+    """), {
+        "CaseID": int(case_id),
+        "Operation": operation,
+        "Columns": ",".join(sorted(columns)) or None,
+        "ChangedBy": changed_by,
+    })
+
+# ---------------- Draining ----------------
+
+def coalesce_changes(rows):
+    """{CaseID: {"operations": set, "columns": set}} for a batch of outbox rows."""
+    cases = {}
+    for r in rows:
+        entry = cases.setdefault(r["CaseID"], {"operations": set(), "columns": set()})
+        entry["operations"].add(r["Operation"])
+        if r["ChangedColumns"]:
+            entry["columns"].update(c for c in r["ChangedColumns"].split(",") if c)
+    return cases
+
+def needs_recalc(entry):
+    return bool(entry["operations"] & {"INSERT", "DELETE"} or entry["columns"] & RECALC_COLUMNS)
+
+def _claim(conn, batch_size: int, case_id=None):
+    """Lock the oldest pending rows until commit; rows locked elsewhere are skipped."""
+    sql = """
+        SELECT TOP (:BatchSize) OutboxID, CaseID, Operation, ChangedColumns
+        FROM dbo.CaseChangeOutbox WITH (READPAST, UPDLOCK, ROWLOCK)
+        WHERE ProcessedAt IS NULL
+          AND Attempts < :MaxAttempts
+    """
+    params = {"BatchSize": batch_size, "MaxAttempts": OUTBOX_MAX_ATTEMPTS}
+
+    if case_id is not None:
+        sql += " AND CaseID = :CaseID"
+        params["CaseID"] = case_id
+
+    sql += " ORDER BY OutboxID ASC"
+    return [dict(r._mapping) for r in conn.execute(text(sql), params).fetchall()]
+
+def _mark_processed(conn, outbox_ids):
+    conn.execute(text("""
+        UPDATE dbo.CaseChangeOutbox
+        SET ProcessedAt = SYSUTCDATETIME(), Error = NULL
+        WHERE OutboxID IN :IDs
+    """).bindparams(bindparam("IDs", expanding=True)), {"IDs": list(outbox_ids)})
+
+def _process_case(case_id: int, org_id: int):
+    """Retry path: one case, own transaction; failures are recorded on its rows."""
+    try:
+        with get_db_connection() as conn:
+            rows = _claim(conn, OUTBOX_BATCH_SIZE, case_id)
+            if not rows:
+                return True
+            if needs_recalc(coalesce_changes(rows)[case_id]):
+                recalc_cases_timebars(conn, [case_id], org_id)
+            _mark_processed(conn, [r["OutboxID"] for r in rows])
+            commit_and_notify(conn)
+        return True
+
+    except Exception as e:
+        print(f"❌ Case outbox: recalc failed for case {case_id}:", e)
+        with get_db_connection() as conn:
+            conn.execute(text("""
+                UPDATE dbo.CaseChangeOutbox
+                SET Attempts = Attempts + 1, Error = :Error
+                WHERE CaseID = :CaseID AND ProcessedAt IS NULL
+            """), {"CaseID": case_id, "Error": str(e)[:4000]})
+            conn.commit()
+        return False
+
+def drain_once(batch_size: int = OUTBOX_BATCH_SIZE, org_id: int = 1):
+    """Process one batch. Returns {"rows", "cases", "recalculated", "failed"}."""
+    with get_db_connection() as conn:
+        rows = _claim(conn, batch_size)
+        if not rows:
+            return {"rows": 0, "cases": 0, "recalculated": 0, "failed": 0}
+
+        cases = coalesce_changes(rows)
+        recalc_ids = sorted(cid for cid, entry in cases.items() if needs_recalc(entry))
+
+        try:
+            if recalc_ids:
+                recalc_cases_timebars(conn, recalc_ids, org_id)
+            _mark_processed(conn, [r["OutboxID"] for r in rows])
+            commit_and_notify(conn)
+            return {"rows": len(rows), "cases": len(cases), "recalculated": len(recalc_ids), "failed": 0}
+
+        except Exception as e:
+            print("⚠️ Case outbox batch failed, retrying case by case:", e)
+            conn.rollback()
+
+    failed = sum(0 if _process_case(cid, org_id) else 1 for cid in sorted(cases))
+    return {"rows": len(rows), "cases": len(cases), "recalculated": len(recalc_ids), "failed": failed}
+
+def purge_processed(days: int = OUTBOX_RETENTION_DAYS):
+    with get_db_connection() as conn:
+        n = conn.execute(text("""
+            DELETE FROM dbo.CaseChangeOutbox
+            WHERE ProcessedAt IS NOT NULL
+              AND ProcessedAt < DATEADD(DAY, -:Days, SYSUTCDATETIME())
+        """), {"Days": days}).rowcount
+        conn.commit()
+    return n
+
+# ---------------- Worker ----------------
+
+class CaseOutboxWorker:
+
+    def __init__(self, poll_seconds: float = OUTBOX_POLL_SECONDS, batch_size: int = OUTBOX_BATCH_SIZE):
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._last_purge = 0.0
+        self.stats = {"rows": 0, "recalculated": 0, "failed": 0, "last_error": None}
+
+    def wake(self):
+        self._wake.set()
+
+    def run(self):
+        while not self._stopped:
+            self._wake.clear()
+            try:
+                res = drain_once(self.batch_size)
+                for k in ("rows", "recalculated", "failed"):
+                    self.stats[k] += res[k]
+
+                if time.monotonic() - self._last_purge > 3600:
+                    purge_processed()
+                    self._last_purge = time.monotonic()
+
+                if res["rows"] >= self.batch_size:
+                    continue  # more waiting
+
+            except Exception as e:
+                print("❌ Case outbox worker error:", e)
+                self.stats["last_error"] = str(e)
+
+            self._wake.wait(timeout=self.poll_seconds)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="case-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def start_case_outbox_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = CaseOutboxWorker().start()
+    return _worker
+
+def wake_outbox_worker():
+    """Call after committing a Cases write so this process drains right away."""
+    if _worker is not None:
+        _worker.wake()
+
+# ---------------- Routes ----------------
+
+@case_outbox_bp.route("/api/case-outbox", methods=["GET"])
+@login_required
+def case_outbox_status():
+    with get_db_connection() as conn:
+        row = conn.execute(text("""
+            SELECT
+                SUM(CASE WHEN ProcessedAt IS NULL AND Attempts < :MaxAttempts THEN 1 ELSE 0 END) AS Pending,
+                SUM(CASE WHEN ProcessedAt IS NULL AND Attempts >= :MaxAttempts THEN 1 ELSE 0 END) AS Failed,
+                MIN(CASE WHEN ProcessedAt IS NULL THEN CreatedAt END) AS OldestPending
+            FROM dbo.CaseChangeOutbox
+        """), {"MaxAttempts": OUTBOX_MAX_ATTEMPTS}).fetchone()
+
+    return jsonify({
+        "ok": True,
+        "pending": int(row._mapping["Pending"] or 0),
+        "failed": int(row._mapping["Failed"] or 0),
+        "oldest_pending": row._mapping["OldestPending"],
+        "worker": dict(_worker.stats, running=bool(_worker._thread and _worker._thread.is_alive()))
+                  if _worker else None,
+    })
+
+# ---------------- CLI ----------------
+
+@case_outbox_bp.cli.command("drain")
+@click.option("--batch-size", default=OUTBOX_BATCH_SIZE, show_default=True, type=int)
+def drain_command(batch_size):
+    """Drain every pending outbox row, then exit."""
+    total = 0
+    while True:
+        res = drain_once(batch_size)
+        total += res["rows"]
+        if res["rows"] < batch_size:
+            break
+    click.echo(f"✅ Processed {total} outbox rows")
+
+@case_outbox_bp.cli.command("run")
+def run_command():
+    """Run the outbox worker in the foreground."""
+    worker = start_case_outbox_worker()
+    click.echo("📮 Case outbox worker running")
+    try:
+        worker._thread.join()
+    except KeyboardInterrupt:
+        worker.stop()
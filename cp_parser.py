@@ -2,12 +2,17 @@
 # 📄 Charterparty Parser (Azure Document Intelligence)
 # ============================================================
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, session
+import io
 import os
-import tempfile
+import uuid
 
 from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import ResourceExistsError
+
+from case_documents import get_blob_service
+from jobs import PermanentJobError, enqueue_job, register_job
 
 cp_parser_bp = Blueprint("cp_parser", __name__)
 
@@ -26,11 +31,97 @@ def get_di_client():
         credential=AzureKeyCredential(key)
     )
 
+# ------------------------------------------------------------
+# 🧠 Analyse + extract fields + confidence
+# ------------------------------------------------------------
+def analyze_charterparty(pdf_bytes: bytes, model_id: str):
+    """Run the CP model over a PDF; returns {name: {value, confidence}} or None."""
+    client = get_di_client()
+    poller = client.begin_analyze_document(
+        model_id=model_id,
+        document=io.BytesIO(pdf_bytes)
+    )
+    result = poller.result()
+
+    if not result.documents:
+        return None
+
+    doc = result.documents[0]
+    extracted = {}
+
+    for name, field in doc.fields.items():
+        extracted[name] = {
+            "value": field.value if field.value is not None else field.content,
+            "confidence": round(field.confidence, 2) if field.confidence else None
+        }
+
+    return extracted
+
+# ------------------------------------------------------------
+# ⏳ Background parsing (cp.parse job)
+# ------------------------------------------------------------
+# The upload is staged in blob storage and the job payload carries only
+# its path; the staged PDF is removed once the job no longer needs it.
+STAGING_CONTAINER = "cp-parse-staging"
+
+def stage_pdf(pdf_bytes: bytes, file_name: str) -> str:
+    container_client = get_blob_service().get_container_client(STAGING_CONTAINER)
+    try:
+        container_client.create_container()
+    except ResourceExistsError:
+        pass  # container already exists
+
+    blob_name = f"{uuid.uuid4().hex}/{os.path.basename(file_name or 'charterparty.pdf')}"
+    container_client.get_blob_client(blob_name).upload_blob(
+        pdf_bytes,
+        overwrite=True,
+        content_type="application/pdf"
+    )
+    return blob_name
+
+def remove_staged_pdf(blob_name: str):
+    try:
+        get_blob_service().get_container_client(STAGING_CONTAINER).delete_blob(blob_name)
+    except Exception as e:
+        print(f"⚠️ Could not remove staged CP {blob_name}:", e)
+
+@register_job("cp.parse")
+def parse_charterparty_job(payload, ctx):
+    ctx.progress(f"Analysing {payload.get('fileName')}")
+    try:
+        blob_client = get_blob_service().get_container_client(STAGING_CONTAINER).get_blob_client(payload["blobPath"])
+        extracted = analyze_charterparty(blob_client.download_blob().readall(), payload["modelId"])
+    except Exception:
+        # No retry left to read the staged copy
+        if ctx.last_attempt:
+            remove_staged_pdf(payload["blobPath"])
+        raise
+
+    if extracted is None:
+        # The same PDF gives the same answer; don't retry
+        remove_staged_pdf(payload["blobPath"])
+        raise PermanentJobError("No document data extracted")
+
+    remove_staged_pdf(payload["blobPath"])
+    return {
+        "fields": extracted,
+        "meta": {
+            "deepBlueRef": payload.get("deepBlueRef"),
+            "modelId": payload["modelId"],
+            "fileName": payload.get("fileName")
+        }
+    }
+
 # ------------------------------------------------------------
 # 📎 Parse Charterparty (PDF only)
 # ------------------------------------------------------------
 @cp_parser_bp.route("/api/cp/parse", methods=["POST"])
 def parse_charterparty():
+    """
+    POST /api/cp/parse (multipart: file, DeepBlueRef)
+    ?async=1 queues a cp.parse job and returns 202 {JobID}; the result
+    (fields + meta) is on /api/jobs/<JobID> once it succeeds.
+    """
 
     # ---------------------------------------------
     # 📥 Validate upload
@@ -63,57 +154,44 @@ def parse_charterparty():
     if deep_blue_ref:
         deep_blue_ref = deep_blue_ref.strip()
 
-    tmp_path = None
+    pdf_bytes = file.read()
 
-    try:
-        # ---------------------------------------------
-        # 📄 Save temp file
-        # ---------------------------------------------
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            file.save(tmp.name)
-            tmp_path = tmp.name
-
-        # ---------------------------------------------
-        # ☁️ Send to Azure DI
-        # ---------------------------------------------
-        client = get_di_client()
-
-        with open(tmp_path, "rb") as f:
-            poller = client.begin_analyze_document(
-                model_id=model_id,
-                document=f
-            )
-
-        result = poller.result()
+    # ---------------------------------------------
+    # ⏳ Background: hand off to the job worker
+    # ---------------------------------------------
+    if request.args.get("async") == "1":
+        try:
+            blob_path = stage_pdf(pdf_bytes, file.filename)
+        except Exception as e:
+            return jsonify(success=False, error=f"Blob upload failed: {str(e)}"), 500
+
+        job_id = enqueue_job(
+            "cp.parse",
+            {
+                "blobPath": blob_path,
+                "modelId": model_id,
+                "deepBlueRef": deep_blue_ref,
+                "fileName": file.filename
+            },
+            priority=10,
+            created_by=session.get("username")
+        )
+        return jsonify(success=True, JobID=job_id), 202
 
+    # ---------------------------------------------
+    # ☁️ Send to Azure DI
+    # ---------------------------------------------
+    try:
+        extracted = analyze_charterparty(pdf_bytes, model_id)
     except Exception as e:
         return jsonify(success=False, error=str(e)), 500
 
-    finally:
-        if tmp_path:
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
-
-    # ---------------------------------------------
-    # 🧠 Extract fields + confidence
-    # ---------------------------------------------
-    if not result.documents:
+    if extracted is None:
         return jsonify(
             success=False,
             error="No document data extracted"
         ), 422
 
-    doc = result.documents[0]
-    extracted = {}
-
-    for name, field in doc.fields.items():
-        extracted[name] = {
-            "value": field.value if field.value is not None else field.content,
-            "confidence": round(field.confidence, 2) if field.confidence else None
-        }
-
     # ---------------------------------------------
     # ✅ Response (future-ready)
     # ---------------------------------------------
@@ -125,4 +203,4 @@ def parse_charterparty():
             "modelId": model_id,
             "fileName": file.filename
         }
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,368 @@
+# ==============================================
+# 🧹 data_quality.py — Declarative data-quality checks → CaseTodos
+# ==============================================
+# Each rule is a list of conditions over dbo.Cases columns (all must hold
+# for the case to be flagged). Column rules are compiled into a single
+# SELECT over Cases; document rules are checked against one listing of
+# the case-documents blob container (documents aren't in SQL).
+#
+# Hits are staged in a temp table and applied with one MERGE into
+# dbo.CaseTodos keyed on (CaseID, Type, MetaKey) — DATA_QUALITY / 'DQ:<code>'
+# unless a rule says otherwise; open todos whose rule no longer fires are
+# dismissed. Re-running is idempotent.
+#
+#   POST /api/data-quality/run                    whole portfolio
+#   flask --app app data-quality run [--case-id]  same, from the CLI
+# ==============================================
+import click
+from flask import Blueprint, request, jsonify
+from sqlalchemy import text, bindparam
+
+from utils import get_db_connection, login_required
+from timebars import (
+    insert_rows, invalidate_todo_counts,
+    MISSING_VOYAGE_END_TYPE, MISSING_VOYAGE_END_TITLE,
+)
+
+data_quality_bp = Blueprint("data_quality_bp", __name__, cli_group="data-quality")
+
+DQ_TODO_TYPE = "DATA_QUALITY"
+
+# Conditions:
+#   ("missing", col)        NULL or blank
+#   ("present", col)        not NULL / blank
+#   ("equals", col, value)
+#   ("before", col_a, col_b)  both set and col_a < col_b
+#   ("has_notices",)        case has at least one CaseNotice
+#   ("missing_document", doc_type)   no blob under <doc_type>/<DeepBlueRef>/
+#
+# Optional "type" / "meta_key" keep todos that predate the engine on their
+# original keys.
+DQ_RULES = [
+    {
+        # Shares its todo with timebars.upsert_missing_voyage_end_todos, so
+        # it must fire on exactly the same cases (no VoyageEndDate) or the
+        # two would open and dismiss the todo back and forth.
+        "code": "MISSING_VOYAGE_END_DATE",
+        "title": MISSING_VOYAGE_END_TITLE,
+        "type": MISSING_VOYAGE_END_TYPE,
+        "meta_key": "MISSING_VOYAGE_END_DATE",
+        "when": [("missing", "VoyageEndDate")],
+    },
+    {
+        "code": "MISSING_CP_DATE",
+        "title": "⚠ CP Date is empty",
+        "when": [("missing", "CPDate")],
+    },
+    {
+        "code": "CLAIM_FILED_NO_AMOUNT",
+        "title": "⚠ Claim filed but Claim Filed Amount is empty",
+        "when": [("present", "ClaimFiled"), ("missing", "ClaimFiledAmount")],
+    },
+    {
+        "code": "AGREED_NO_AMOUNT",
+        "title": "⚠ Agreed Date set but Agreed Amount is empty",
+        "when": [("present", "AgreedDate"), ("missing", "AgreedAmount")],
+    },
+    {
+        "code": "AGREED_BEFORE_FILED",
+        "title": "⚠ Agreed Date is earlier than Claim Filed date",
+        "when": [("before", "AgreedDate", "ClaimFiled")],
+    },
+    {
+        "code": "VOYAGE_END_BEFORE_CP",
+        "title": "⚠ Voyage End Date is earlier than CP Date",
+        "when": [("before", "VoyageEndDate", "CPDate")],
+    },
+    {
+        "code": "MISSING_CHARTERPARTY",
+        "title": "⚠ Charterparty not uploaded",
+        "when": [("missing_document", "Charterparty")],
+    },
+    {
+        "code": "MISSING_SOF",
+        "title": "⚠ Statement of Facts not uploaded",
+        "when": [("missing_document", "SOF")],
+    },
+]
+
+# ---------------- Compile ----------------
+
+def _condition_sql(cond, params, n):
+    op = cond[0]
+
+    if op == "missing":
+        return f"(c.[{cond[1]}] IS NULL OR LTRIM(RTRIM(CAST(c.[{cond[1]}] AS NVARCHAR(4000)))) = '')"
+
+    if op == "present":
+        return f"(c.[{cond[1]}] IS NOT NULL AND LTRIM(RTRIM(CAST(c.[{cond[1]}] AS NVARCHAR(4000)))) <> '')"
+
+    if op == "equals":
+        params[f"V{n}"] = cond[2]
+        return f"c.[{cond[1]}] = :V{n}"
+
+    if op == "before":
+        return f"(c.[{cond[1]}] IS NOT NULL AND c.[{cond[2]}] IS NOT NULL AND c.[{cond[1]}] < c.[{cond[2]}])"
+
+    if op == "has_notices":
+        return "EXISTS (SELECT 1 FROM dbo.CaseNotices cn WHERE cn.CaseID = c.CaseID)"
+
+    raise ValueError(f"Unknown data-quality condition: {op}")
+
+def _rule_columns(rule):
+    cols = set()
+    for cond in rule["when"]:
+        if cond[0] in ("missing", "present", "equals"):
+            cols.add(cond[1])
+        elif cond[0] == "before":
+            cols.update(cond[1:3])
+    return cols
+
+def rule_key(rule):
+    """(Type, MetaKey) a rule's todos are stored under."""
+    return rule.get("type", DQ_TODO_TYPE), rule.get("meta_key", f"DQ:{rule['code']}")
+
+def is_document_rule(rule):
+    return any(cond[0] == "missing_document" for cond in rule["when"])
+
+def compile_rules(rules):
+    """
+    One statement that yields (CaseID, DeepBlueRef, RuleCode) per column-rule hit:
+    a CROSS APPLY VALUES row per rule with its condition as a CASE.
+    Document conditions are evaluated in Python and ignored here.
+    """
+    params = {}
+    values = []
+    n = 0
+
+    for i, rule in enumerate(rules):
+        clauses = []
+        for cond in rule["when"]:
+            if cond[0] == "missing_document":
+                continue
+            clauses.append(_condition_sql(cond, params, n))
+            n += 1
+
+        params[f"R{i}"] = rule["code"]
+        values.append(f"(:R{i}, CASE WHEN {' AND '.join(clauses) or '1 = 1'} THEN 1 ELSE 0 END)")
+
+    values_sql = ",\n            ".join(values)
+    sql = f"""
+        SELECT c.CaseID, c.DeepBlueRef, r.RuleCode
+        FROM dbo.Cases c
+        CROSS APPLY (VALUES
+            {values_sql}
+        ) r(RuleCode, Hit)
+        WHERE r.Hit = 1
+    """
+    return sql, params
+
+# ---------------- Documents ----------------
+
+def list_document_types():
+    """{DeepBlueRef: {doc_type, ...}} from one pass over the case-documents container."""
+    from case_documents import get_blob_service
+
+    container = get_blob_service().get_container_client("case-documents")
+
+    present = {}
+    for blob in container.list_blobs():
+        parts = blob.name.split("/")
+        if len(parts) >= 3:
+            present.setdefault(parts[1], set()).add(parts[0])
+    return present
+
+# ---------------- Run ----------------
+
+def run_data_quality(conn, case_ids=None, rules=None):
+    """
+    Evaluate rules for the whole portfolio (or just case_ids) and sync
+    DATA_QUALITY todos. Runs in the caller's transaction.
+    """
+    rules = list(rules or DQ_RULES)
+
+    columns = {
+        r[0] for r in conn.execute(text("""
+            SELECT COLUMN_NAME
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = 'dbo' AND TABLE_NAME = 'Cases'
+        """)).fetchall()
+    }
+
+    skipped = {}
+    for rule in rules:
+        missing_cols = sorted(_rule_columns(rule) - columns)
+        if missing_cols:
+            skipped[rule["code"]] = f"Unknown column(s): {', '.join(missing_cols)}"
+
+    doc_types = None
+    if any(is_document_rule(r) for r in rules if r["code"] not in skipped):
+        try:
+            doc_types = list_document_types()
+        except Exception as e:
+            print("⚠️ Data-quality document rules skipped:", e)
+            for rule in rules:
+                if is_document_rule(rule):
+                    skipped[rule["code"]] = "Document storage unavailable"
+
+    active = [r for r in rules if r["code"] not in skipped]
+    by_code = {r["code"]: r for r in active}
+
+    result = {
+        "ok": True,
+        "rules": [r["code"] for r in active],
+        "skipped_rules": skipped,
+        "opened": 0,
+        "resolved": 0,
+        "open_by_rule": {},
+    }
+    if not active:
+        return result
+
+    # 1️⃣ Evaluate column conditions for every rule in one statement
+    sql, params = compile_rules(active)
+    stmt = text(sql)
+    if case_ids is not None:
+        sql = sql.rstrip() + "\n          AND c.CaseID IN :CaseIDs"
+        stmt = text(sql).bindparams(bindparam("CaseIDs", expanding=True))
+        params["CaseIDs"] = sorted({int(c) for c in case_ids}) or [-1]
+
+    hits = []
+    for r in conn.execute(stmt, params).fetchall():
+        case_id, ref, code = r
+        rule = by_code[code]
+
+        # 2️⃣ Document conditions against the blob listing
+        docs_missing = all(
+            cond[1] not in doc_types.get(ref or "", ())
+            for cond in rule["when"] if cond[0] == "missing_document"
+        ) if is_document_rule(rule) else True
+
+        if docs_missing:
+            todo_type, meta_key = rule_key(rule)
+            hits.append({
+                "CaseID": case_id,
+                "Type": todo_type,
+                "MetaKey": meta_key,
+                "Title": rule["title"],
+                "RuleCode": code,
+            })
+
+    # 3️⃣ Stage hits + evaluated rules
+    conn.execute(text("""
+        DROP TABLE IF EXISTS #dq_hits;
+        DROP TABLE IF EXISTS #dq_rules;
+        CREATE TABLE #dq_hits (
+            CaseID INT NOT NULL,
+            Type NVARCHAR(50) NOT NULL,
+            MetaKey NVARCHAR(200) NOT NULL,
+            Title NVARCHAR(400) NOT NULL,
+            PRIMARY KEY (CaseID, Type, MetaKey)
+        );
+        CREATE TABLE #dq_rules (
+            Type NVARCHAR(50) NOT NULL,
+            MetaKey NVARCHAR(200) NOT NULL,
+            PRIMARY KEY (Type, MetaKey)
+        );
+    """))
+
+    insert_rows(conn, "#dq_hits", ["CaseID", "Type", "MetaKey", "Title"], hits)
+    insert_rows(conn, "#dq_rules", ["Type", "MetaKey"], [
+        dict(zip(("Type", "MetaKey"), rule_key(r))) for r in active
+    ])
+
+    # 4️⃣ Open / retitle todos for current hits
+    actions = conn.execute(text("""
+        MERGE dbo.CaseTodos AS t
+        USING #dq_hits AS h
+            ON t.CaseID = h.CaseID
+           AND t.Type = h.Type
+           AND t.MetaKey = h.MetaKey
+           AND t.Status = 'OPEN'
+        WHEN MATCHED AND t.Title <> h.Title THEN
+            UPDATE SET Title = h.Title, UpdatedAt = SYSUTCDATETIME()
+        WHEN NOT MATCHED BY TARGET THEN
+            INSERT (CaseID, Type, Title, Status, DueDate, MetaKey)
+            VALUES (h.CaseID, h.Type, h.Title, 'OPEN', NULL, h.MetaKey)
+        OUTPUT $action;
+    """)).fetchall()
+    result["opened"] = sum(1 for a in actions if a[0] == "INSERT")
+
+    # 5️⃣ Dismiss open todos whose rule no longer fires (evaluated rules / scope only)
+    resolve_sql = """
+        UPDATE t
+        SET Status = 'DISMISSED', UpdatedAt = SYSUTCDATETIME()
+        FROM dbo.CaseTodos t
+        JOIN #dq_rules r
+            ON r.Type = t.Type
+           AND r.MetaKey = t.MetaKey
+        WHERE t.Status = 'OPEN'
+          AND NOT EXISTS (
+                SELECT 1 FROM #dq_hits h
+                WHERE h.CaseID = t.CaseID AND h.Type = t.Type AND h.MetaKey = t.MetaKey
+          )
+    """
+    resolve_params = {}
+    resolve_stmt = text(resolve_sql)
+    if case_ids is not None:
+        resolve_stmt = text(resolve_sql + " AND t.CaseID IN :CaseIDs").bindparams(
+            bindparam("CaseIDs", expanding=True))
+        resolve_params["CaseIDs"] = params["CaseIDs"]
+    result["resolved"] = conn.execute(resolve_stmt, resolve_params).rowcount
+
+    conn.execute(text("""
+        DROP TABLE IF EXISTS #dq_hits;
+        DROP TABLE IF EXISTS #dq_rules;
+    """))
+
+    for h in hits:
+        code = h["RuleCode"]
+        result["open_by_rule"][code] = result["open_by_rule"].get(code, 0) + 1
+
+    invalidate_todo_counts()
+    return result
+
+# ---------------- Routes ----------------
+
+@data_quality_bp.route("/api/data-quality/rules", methods=["GET"])
+@login_required
+def get_data_quality_rules():
+    return jsonify({
+        "ok": True,
+        "rules": [
+            {"code": r["code"], "title": r["title"], "when": [list(c) for c in r["when"]]}
+            for r in DQ_RULES
+        ],
+    })
+
+@data_quality_bp.route("/api/data-quality/run", methods=["POST"])
+@login_required
+def run_data_quality_checks():
+    """POST /api/data-quality/run  {"CaseIDs": [...]} optional — defaults to every case."""
+    payload = request.get_json(silent=True) or {}
+    case_ids = payload.get("CaseIDs")
+
+    if case_ids is not None and not isinstance(case_ids, list):
+        return jsonify({"ok": False, "error": "CaseIDs must be a list"}), 400
+
+    with get_db_connection() as conn:
+        result = run_data_quality(conn, case_ids)
+        conn.commit()
+
+    return jsonify(result)
+
+# ---------------- CLI ----------------
+
+@data_quality_bp.cli.command("run")
+@click.option("--case-id", "case_ids", multiple=True, type=int, help="Limit to these CaseIDs.")
+def run_data_quality_command(case_ids):
+    """Evaluate data-quality rules and sync DATA_QUALITY todos."""
+    with get_db_connection() as conn:
+        result = run_data_quality(conn, list(case_ids) or None)
+        conn.commit()
+
+    click.echo(f"✅ {result['opened']} opened, {result['resolved']} resolved")
+    for code, count in sorted(result["open_by_rule"].items()):
+        click.echo(f"   {code}: {count}")
+    for code, reason in sorted(result["skipped_rules"].items()):
+        click.echo(f"   ⚠️ {code} skipped — {reason}")
@@ -0,0 +1,108 @@
+# ==============================================
+# 🏷 email_catalog.py — Cached Outlook categories + inbox rules
+# ==============================================
+# The email rules page needs the mailbox's master categories and inbox
+# message rules on every view, and the create routes check both for
+# duplicates. The catalog fetches the two lists concurrently and indexes
+# them once:
+#
+#   categories     sorted by DBLF number (desc), each with rule_exists
+#   by_name        lower(displayName) -> category
+#   by_dblf        DBLF number -> [categories]
+#   rules_by_name  lower(displayName) -> rule
+#
+# Write routes in email_rules call invalidate_email_catalog(); the TTL
+# covers changes made in Outlook directly.
+# ==============================================
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from graph_client import get_graph_client
+
+EMAIL_CATALOG_TTL_SECONDS = int(os.getenv("EMAIL_CATALOG_TTL_SECONDS", "60"))
+
+DBLF_RE = re.compile(r"DBLF(\d+)")
+
+def extract_dblf(name):
+    match = DBLF_RE.search(name or "")
+    return int(match.group(1)) if match else None
+
+def rule_name_for(category_name):
+    return f"Auto-tag {category_name}"
+
+class EmailCatalog:
+
+    def __init__(self, categories, rules):
+        self.rules = rules
+        self.rules_by_name = {(r.get("displayName") or "").lower(): r for r in rules}
+
+        self.categories = sorted(
+            (
+                dict(c, dblf=extract_dblf(c.get("displayName")),
+                     rule_exists=rule_name_for(c.get("displayName", "")).lower() in self.rules_by_name)
+                for c in categories
+            ),
+            key=lambda c: c["dblf"] if c["dblf"] is not None else 999999,
+            reverse=True,
+        )
+        self.by_name = {(c.get("displayName") or "").lower(): c for c in self.categories}
+        self.by_dblf = {}
+        for c in self.categories:
+            if c["dblf"] is not None:
+                self.by_dblf.setdefault(c["dblf"], []).append(c)
+
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls, client=None):
+        client = client or get_graph_client()
+
+        def fetch(path):
+            resp = client.get(client.mailbox_url(path))
+            resp.raise_for_status()
+            return resp.json().get("value", [])
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            categories = pool.submit(fetch, "outlook/masterCategories")
+            rules = pool.submit(fetch, "mailFolders/inbox/messageRules")
+            return cls(categories.result(), rules.result())
+
+    # ---- lookups ----
+
+    def category(self, name):
+        return self.by_name.get((name or "").lower())
+
+    def categories_for_dblf(self, dblf: int):
+        return self.by_dblf.get(dblf, [])
+
+    def rule(self, name):
+        return self.rules_by_name.get((name or "").lower())
+
+    def rule_for_category(self, category_name):
+        return self.rule(rule_name_for(category_name))
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_email_catalog(ttl_seconds: int = EMAIL_CATALOG_TTL_SECONDS):
+    """Current catalog, (re)loaded from Graph when missing or older than the TTL."""
+    global _catalog
+
+    catalog = _catalog
+    if catalog is not None and time.monotonic() - catalog.loaded_at < ttl_seconds:
+        return catalog
+
+    with _catalog_lock:
+        catalog = _catalog
+        if catalog is None or time.monotonic() - catalog.loaded_at >= ttl_seconds:
+            catalog = EmailCatalog.load()
+            _catalog = catalog
+    return catalog
+
+def invalidate_email_catalog(*_):
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
@@ -0,0 +1,261 @@
+# ============================================================
+# 🔎 email_matching.py — Matching emails to cases
+# ============================================================
+# A message belongs to a case when it mentions the vessel name and the
+# CP date.
+#
+#   - dates     extract_dates() finds every date mention in a text with a
+#               few compiled patterns and normalises it to a date, so the
+#               CP-date check is a set lookup instead of ~35 substring
+#               tests per case (generate_date_variants is still used for
+#               Outlook server-side rules, which need literal strings)
+#   - vessels   one Aho-Corasick automaton over every case's vessel name
+#
+# CaseClassifier combines the two: a message is scanned once and every
+# case it matches comes back, however many cases are open. run_rule uses
+# it with a single case; run_all_rules classifies the inbox against every
+# category in one pass. bench_email_matching.py compares it with the old
+# variant-list matching.
+# ============================================================
+import re
+from collections import deque
+from datetime import date, datetime
+
+# ------------------------------------------------------------
+# 📅 DATE VARIANTS GENERATOR
+# ------------------------------------------------------------
+def generate_date_variants(cp_date_str):
+    """Return 40+ permutations including '11 APR'25' style."""
+    cp_date = parse_cp_date(cp_date_str)
+    if cp_date is None:
+        print(f"[WARN] Invalid CP date format: {cp_date_str}")  # Safe for SSE and logs
+        return []
+
+    day = cp_date.day
+    month = cp_date.strftime("%b")
+    month_full = cp_date.strftime("%B")
+    month_upper = cp_date.strftime("%b").upper()
+    year_full = cp_date.strftime("%Y")
+    year_short = cp_date.strftime("%y")
+
+    if 4 <= day <= 20 or 24 <= day <= 30:
+        suffix = "th"
+    else:
+        suffix = ["st", "nd", "rd"][day % 10 - 1]
+    day_ordinal = f"{day}{suffix}"
+
+    variants = [
+        f"{day:02d}/{cp_date.month:02d}/{year_full}",
+        f"{day:02d}/{cp_date.month:02d}/{year_short}",
+        f"{day:02d}.{cp_date.month:02d}.{year_full}",
+        f"{day:02d}.{cp_date.month:02d}.{year_short}",
+        f"{day:02d}-{cp_date.month:02d}-{year_full}",
+        f"{day:02d}-{cp_date.month:02d}-{year_short}",
+        f"{day}/{cp_date.month}/{year_short}",
+        f"{year_full}-{cp_date.month:02d}-{day:02d}",
+        f"{year_full}/{cp_date.month:02d}/{day:02d}",
+        f"{year_full}.{cp_date.month:02d}.{day:02d}",
+        f"{cp_date.month:02d}/{day:02d}/{year_full}",
+        f"{cp_date.month}/{day}/{year_short}",
+        f"{cp_date.month:02d}-{day:02d}-{year_full}",
+        f"{day:02d}-{month}-{year_short}",
+        f"{day:02d}-{month_upper}-{year_full}",
+        f"{day:02d}-{month_upper}-{year_short}",
+        f"{day:02d}-{month}-{year_full}",
+        f"{day:02d} {month_upper}'{year_short}",
+        f"{day} {month} {year_short}",
+        f"{day} {month} {year_full}",
+        f"{day_ordinal} {month} {year_short}",
+        f"{day_ordinal} {month} {year_full}",
+        f"{day}{month}{year_short}",
+        f"{day} {month_full} {year_short}",
+        f"{day} {month_full} {year_full}",
+        f"{day_ordinal} {month_full} {year_short}",
+        f"{day_ordinal} {month_full} {year_full}",
+        f"{month_full} {day}, {year_full}",
+        f"{month} {day}, {year_full}",
+        f"{month} {day:02d}, {year_full}",
+        f"the {day_ordinal} of {month_full} {year_full}",
+        f"{day_ordinal} {month_full}, {year_full}",
+        f"{cp_date.strftime('%A')}, {day} {month_full} {year_full}",
+        f"{cp_date.strftime('%a')}, {day} {month} {year_full}",
+    ]
+    return list(dict.fromkeys(variants))
+
+
+def parse_cp_date(cp_date_str):
+    """'11Apr25' / '11Apr2025' -> date, or None."""
+    for fmt in ("%d%b%y", "%d%b%Y"):
+        try:
+            return datetime.strptime((cp_date_str or "").strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+# ------------------------------------------------------------
+# 🗓 DATE MENTION EXTRACTION
+# ------------------------------------------------------------
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+_MON = r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\.?(?![a-z])"
+_ORD = r"(?:st|nd|rd|th)?"
+
+# One pass over the lowered text. The leading charset lets the regex
+# engine skip positions that can't start a date before trying branches;
+# the whole match is a lookahead so mentions may overlap ("Voyager 1
+# September 27, 2023" must not lose the date to "1 September 27").
+DATE_MENTION_RE = re.compile(
+    r"(?=[0-9adfjmnos])(?=(?:"
+    # 2025-04-11, 2025/04/11, 2025.04.11
+    r"(?<!\d)(?P<iso_y>\d{4})(?P<iso_sep>[-/.])(?P<iso_m>\d{1,2})(?P=iso_sep)(?P<iso_d>\d{1,2})(?!\d)"
+    # 11/04/2025, 11.04.25, 4/11/25 — day-first and month-first both kept
+    r"|(?<![\d/.-])(?P<num_a>\d{1,2})(?P<num_sep>[-/.])(?P<num_b>\d{1,2})(?P=num_sep)(?P<num_y>\d{4}|\d{2})(?!\d)"
+    # 11 Apr 25, 11-APR-2025, 11 APR'25, 11Apr25, 11th April, 2025, the 11th of April 2025
+    r"|(?<![a-z\d])(?P<dm_d>[0-3]?\d)" + _ORD + r"(?:\s+of)?[\s\-./,']*(?P<dm_m>" + _MON + r")[\s\-./,']*(?P<dm_y>\d{4}|\d{2})(?!\d)"
+    # April 11, 2025 / Apr 11th 2025
+    r"|(?<![a-z])(?P<md_m>" + _MON + r")[\s\-./]*(?P<md_d>[0-3]?\d)" + _ORD + r"(?!\d)[\s,]*'?(?P<md_y>\d{4}|\d{2})(?!\d)"
+    r"))"
+)
+
+def _year(value):
+    y = int(value)
+    return y + 2000 if y < 100 else y
+
+def _date(y, m, d):
+    try:
+        return date(y, m, d)
+    except ValueError:
+        return None
+
+def extract_dates(text):
+    """Every date mentioned in `text`, normalised to datetime.date."""
+    if not text:
+        return set()
+    found = set()
+
+    for m in DATE_MENTION_RE.finditer(text.lower()):
+        if m["iso_y"]:
+            found.add(_date(int(m["iso_y"]), int(m["iso_m"]), int(m["iso_d"])))
+        elif m["num_a"]:
+            y, a, b = _year(m["num_y"]), int(m["num_a"]), int(m["num_b"])
+            found.add(_date(y, b, a))  # dd/mm/yy
+            found.add(_date(y, a, b))  # mm/dd/yy
+        elif m["dm_d"]:
+            found.add(_date(_year(m["dm_y"]), MONTHS[m["dm_m"][:3]], int(m["dm_d"])))
+        else:
+            found.add(_date(_year(m["md_y"]), MONTHS[m["md_m"][:3]], int(m["md_d"])))
+
+    found.discard(None)
+    return found
+
+# ------------------------------------------------------------
+# 🤖 AHO-CORASICK AUTOMATON
+# ------------------------------------------------------------
+class PatternAutomaton:
+    """Multi-pattern substring matcher; find_all() returns the ids of every pattern present."""
+
+    def __init__(self, patterns):
+        # patterns: iterable of (pattern_id, text); matching is case-insensitive
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+
+        for pid, pattern in patterns:
+            pattern = (pattern or "").lower()
+            if not pattern:
+                continue
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(pid)
+
+        # Breadth-first failure links; outputs inherit along them
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find_all(self, text):
+        found = set()
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for ch in (text or "").lower():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+# ------------------------------------------------------------
+# 🗂 CASE CLASSIFIER
+# ------------------------------------------------------------
+def parse_category_name(category_name):
+    """'DBLF123 - Ship - 11Apr25' -> (ref, ship, cpdate)."""
+    parts = [p.strip() for p in (category_name or "").split(" - ")]
+    ref = parts[0] if len(parts) > 0 else ""
+    ship = parts[1] if len(parts) > 1 else ""
+    cpdate = parts[2] if len(parts) > 2 else ""
+    return ref, ship, cpdate
+
+class CaseClassifier:
+    """
+    Vessel names in one automaton, CP dates in a {date: cases} index.
+    classify(text) -> keys of the cases whose ship AND CP date appear.
+    """
+
+    def __init__(self, cases):
+        # cases: iterable of (key, ship, cp_date)
+        self.keys = []
+        ships = {}             # lowered ship -> pattern id
+        self._ship_of = []     # case index -> ship pattern id
+        self._cases_by_date = {}
+
+        for key, ship, cp_date in cases:
+            if not ship or not cp_date:
+                continue
+            idx = len(self.keys)
+            self.keys.append(key)
+            self._ship_of.append(ships.setdefault(ship.lower(), len(ships)))
+            self._cases_by_date.setdefault(cp_date, []).append(idx)
+
+        self.automaton = PatternAutomaton((i, t) for t, i in ships.items())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def classify(self, text):
+        candidates = [
+            idx
+            for d in extract_dates(text)
+            for idx in self._cases_by_date.get(d, ())
+        ]
+        if not candidates:
+            return []
+
+        ships = self.automaton.find_all(text)
+        return [self.keys[i] for i in sorted(set(candidates)) if self._ship_of[i] in ships]
+
+    @classmethod
+    def from_categories(cls, category_names):
+        """Cases from Outlook category names; names without a valid CP date are skipped."""
+        cases = []
+        for name in category_names:
+            _, ship, cpdate = parse_category_name(name)
+            cases.append((name, ship, parse_cp_date(cpdate)))
+        return cls(cases)
@@ -2,12 +2,23 @@
 # 📧 Email Rules Blueprint (for Outlook Tagging Automation)
 # ============================================================
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, Response, session
-import os, requests, re, time
-from datetime import datetime
+from flask import Blueprint, render_template, request, redirect, url_for, flash, Response, session, jsonify
+import os, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from functools import wraps
 
+from graph_client import get_graph_client, GRAPH_BATCH_SIZE, MAILBOX
+from email_catalog import get_email_catalog, invalidate_email_catalog
+from email_matching import CaseClassifier, generate_date_variants, parse_category_name, parse_cp_date
+from jobs import enqueue_job, register_job
+from mailbox_mirror import (
+    add_category, category_attachments, category_messages,
+    category_summaries as mirror_category_summaries, ensure_fresh, mirror_enabled,
+)
+
 # ------------------------------------------------------------
 # ⚙️ BLUEPRINT SETUP
 # ------------------------------------------------------------
@@ -38,110 +49,77 @@ def test_env():
         "MAILBOX": mailbox
     }
 
-TENANT_ID = os.getenv("TENANT_ID")
-CLIENT_ID = os.getenv("CLIENT_ID")
-CLIENT_SECRET = os.getenv("CLIENT_SECRET")
-MAILBOX = os.getenv("MAILBOX")
-
 # ------------------------------------------------------------
-# 🔐 AUTHENTICATION (Microsoft Graph)
+# 🔐 AUTHENTICATION + HTTP (Microsoft Graph)
 # ------------------------------------------------------------
-def get_graph_token():
-    """Authenticate using client credentials and return Graph access token."""
-    token_url = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/token"
-    token_data = {
-        "grant_type": "client_credentials",
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "scope": "https://graph.microsoft.com/.default"
+# Token caching, connection pooling and 429 / Retry-After handling live in
+# graph_client; every call below goes through the shared client.
+graph = get_graph_client()
+
+def iter_tag_messages(messages, category_name=None, categories_for=None):
+    """
+    Tag messages in $batch chunks run on a small thread pool (one worker per
+    mailbox slot); yields (message, error or None) as each chunk completes.
+    categories_for(msg) gives a per-message categories list; otherwise every
+    message gets [category_name].
+    """
+    chunks = [messages[i:i + GRAPH_BATCH_SIZE] for i in range(0, len(messages), GRAPH_BATCH_SIZE)]
+    if not chunks:
+        return
+
+    with ThreadPoolExecutor(max_workers=min(graph.concurrency, len(chunks))) as pool:
+        futures = {
+            pool.submit(tag_messages, {
+                m["id"]: categories_for(m) if categories_for else [category_name] for m in chunk
+            }): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                errors = future.result()
+            except Exception as e:
+                errors = {m["id"]: str(e) for m in chunk}
+            for msg in chunk:
+                yield msg, errors[msg["id"]]
+
+def tag_messages(assignments):
+    """PATCH {message_id: [categories]} via $batch; returns {message_id: error or None}."""
+    message_ids = list(assignments)
+    results = graph.batch([
+        {"method": "PATCH", "url": f"/users/{MAILBOX}/messages/{mid}", "body": {"categories": assignments[mid]}}
+        for mid in message_ids
+    ])
+    return {
+        mid: None if 200 <= r["status"] < 300 else f"{r['status']} {((r['body'] or {}).get('error') or {}).get('message', '')}".strip()
+        for mid, r in zip(message_ids, results)
     }
-    resp = requests.post(token_url, data=token_data)
-    resp.raise_for_status()
-    return resp.json()["access_token"]
 
 # ------------------------------------------------------------
-# 📅 DATE VARIANTS GENERATOR
+# ✉️ SEND MAIL (from MAILBOX)
 # ------------------------------------------------------------
-def generate_date_variants(cp_date_str):
-    """Return 40+ permutations including '11 APR'25' style."""
-    try:
-        cp_date = datetime.strptime(cp_date_str.strip(), "%d%b%y")
-    except ValueError:
-        try:
-            cp_date = datetime.strptime(cp_date_str.strip(), "%d%b%Y")
-        except ValueError:
-            print(f"[WARN] Invalid CP date format: {cp_date_str}")  # Safe for SSE and logs
-            return []
-
-    day = cp_date.day
-    month = cp_date.strftime("%b")
-    month_full = cp_date.strftime("%B")
-    month_upper = cp_date.strftime("%b").upper()
-    year_full = cp_date.strftime("%Y")
-    year_short = cp_date.strftime("%y")
-
-    if 4 <= day <= 20 or 24 <= day <= 30:
-        suffix = "th"
-    else:
-        suffix = ["st", "nd", "rd"][day % 10 - 1]
-    day_ordinal = f"{day}{suffix}"
-
-    variants = [
-        f"{day:02d}/{cp_date.month:02d}/{year_full}",
-        f"{day:02d}/{cp_date.month:02d}/{year_short}",
-        f"{day:02d}.{cp_date.month:02d}.{year_full}",
-        f"{day:02d}.{cp_date.month:02d}.{year_short}",
-        f"{day:02d}-{cp_date.month:02d}-{year_full}",
-        f"{day:02d}-{cp_date.month:02d}-{year_short}",
-        f"{day}/{cp_date.month}/{year_short}",
-        f"{year_full}-{cp_date.month:02d}-{day:02d}",
-        f"{year_full}/{cp_date.month:02d}/{day:02d}",
-        f"{year_full}.{cp_date.month:02d}.{day:02d}",
-        f"{cp_date.month:02d}/{day:02d}/{year_full}",
-        f"{cp_date.month}/{day}/{year_short}",
-        f"{cp_date.month:02d}-{day:02d}-{year_full}",
-        f"{day:02d}-{month}-{year_short}",
-        f"{day:02d}-{month_upper}-{year_full}",
-        f"{day:02d}-{month_upper}-{year_short}",
-        f"{day:02d}-{month}-{year_full}",
-        f"{day:02d} {month_upper}'{year_short}",
-        f"{day} {month} {year_short}",
-        f"{day} {month} {year_full}",
-        f"{day_ordinal} {month} {year_short}",
-        f"{day_ordinal} {month} {year_full}",
-        f"{day}{month}{year_short}",
-        f"{day} {month_full} {year_short}",
-        f"{day} {month_full} {year_full}",
-        f"{day_ordinal} {month_full} {year_short}",
-        f"{day_ordinal} {month_full} {year_full}",
-        f"{month_full} {day}, {year_full}",
-        f"{month} {day}, {year_full}",
-        f"{month} {day:02d}, {year_full}",
-        f"the {day_ordinal} of {month_full} {year_full}",
-        f"{day_ordinal} {month_full}, {year_full}",
-        f"{cp_date.strftime('%A')}, {day} {month_full} {year_full}",
-        f"{cp_date.strftime('%a')}, {day} {month} {year_full}",
-    ]
-    return list(dict.fromkeys(variants))
+def send_mail(to, subject, body, content_type="Text"):
+    """Send a plain email from the shared mailbox via Graph."""
+    payload = {
+        "message": {
+            "subject": subject,
+            "body": {"contentType": content_type, "content": body},
+            "toRecipients": [{"emailAddress": {"address": a}} for a in to],
+        },
+        "saveToSentItems": False
+    }
+    resp = graph.post(
+        f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/sendMail",
+        json=payload
+    )
+    resp.raise_for_status()
 
 # ------------------------------------------------------------
 # 📂 CATEGORIES
 # ------------------------------------------------------------
 def get_categories():
-    """Fetch and sort categories by DBLF number."""
-    token = get_graph_token()
-    headers = {"Authorization": f"Bearer {token}"}
-    url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/outlook/masterCategories"
-    resp = requests.get(url, headers=headers)
-    resp.raise_for_status()
-    cats = resp.json().get("value", [])
-
-    def extract_dblf(cat):
-        match = re.search(r"DBLF(\d+)", cat.get("displayName", ""))
-        return int(match.group(1)) if match else 999999
-
-    cats.sort(key=extract_dblf, reverse=True)
-    return cats
+    """Categories sorted by DBLF number (from the cached email catalog)."""
+    return get_email_catalog().categories
 
 # ------------------------------------------------------------
 # 🌍 ROUTES
@@ -149,18 +127,7 @@ def get_categories():
 @email_rules_bp.route("/")
 def index():
     """Display categories and show rule existence."""
-    categories = get_categories()
-    token = get_graph_token()
-    headers = {"Authorization": f"Bearer {token}"}
-
-    rules_url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/mailFolders/inbox/messageRules"
-    rules_resp = requests.get(rules_url, headers=headers)
-    rules_resp.raise_for_status()
-    existing_rules = rules_resp.json().get("value", [])
-
-    rule_names = {r["displayName"].lower() for r in existing_rules if r["displayName"].lower().startswith("auto-tag ")}
-    for cat in categories:
-        cat["rule_exists"] = f"auto-tag {cat['displayName']}".lower() in rule_names
+    categories = get_categories()  # each carries rule_exists
 
     # ✅ Render dedicated page now
     return render_template("email_rules.html", categories=categories)
@@ -177,17 +144,14 @@ def create_category():
     color = request.form["color"].strip()
     category_name = f"{ref} - {ship} - {cpdate}"
 
-    token = get_graph_token()
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    cats = get_categories()
-
-    if any(c["displayName"].lower() == category_name.lower() for c in cats):
+    if get_email_catalog().category(category_name):
         flash(f"✅ Category already exists: {category_name}")
         return redirect(url_for("email_rules.index"))
 
     payload = {"displayName": category_name, "color": color}
     url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/outlook/masterCategories"
-    resp = requests.post(url, headers=headers, json=payload)
+    resp = graph.post(url, json=payload)
+    invalidate_email_catalog()
 
     if resp.status_code == 201:
         flash(f"✅ Created new category: {category_name}")
@@ -201,8 +165,6 @@ def create_category():
 @email_rules_bp.route("/create_rule/<category_name>")
 def create_rule(category_name):
     """Create new Outlook inbox rule that tags matching emails."""
-    token = get_graph_token()
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 
     parts = category_name.split(" - ")
     ref = parts[0].strip() if len(parts) > 0 else "UnknownRef"
@@ -219,8 +181,7 @@ def create_rule(category_name):
     rule_name = f"Auto-tag {ref} - {ship} - {cpdate}"
 
     rules_url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/mailFolders/inbox/messageRules"
-    existing_rules = requests.get(rules_url, headers=headers).json().get("value", [])
-    if any(rule["displayName"].lower() == rule_name.lower() for rule in existing_rules):
+    if get_email_catalog().rule(rule_name):
         flash(f"✅ Rule already exists for '{rule_name}'.")
         return redirect(url_for("email_rules.index"))
 
@@ -238,7 +199,8 @@ def create_rule(category_name):
         "stopProcessingRules": False
     }
 
-    resp = requests.post(rules_url, headers=headers, json=payload)
+    resp = graph.post(rules_url, json=payload)
+    invalidate_email_catalog()
     if resp.status_code == 201:
         flash(f"✅ Rule created for '{category_name}'.")
     else:
@@ -247,18 +209,16 @@ def create_rule(category_name):
 
 @email_rules_bp.route("/update/<cat_id>", methods=["POST"])
 def update_category(cat_id):
-    token = get_graph_token()
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     data = request.form
     payload = {
         "displayName": f"{data['reference']} - {data['ship']} - {data['cpdate']}",
         "color": data['color']
     }
-    resp = requests.patch(
+    resp = graph.patch(
         f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/outlook/masterCategories/{cat_id}",
-        headers=headers,
         json=payload
     )
+    invalidate_email_catalog()
     if resp.status_code == 200:
         flash("✅ Category updated. Please re-run the rule to tag older emails.")
     else:
@@ -271,11 +231,9 @@ def update_category(cat_id):
 @email_rules_bp.route("/delete/<cat_id>")
 def delete_category(cat_id):
     """Delete category and its auto-tag rule."""
-    token = get_graph_token()
-    headers = {"Authorization": f"Bearer {token}"}
 
     cat_url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/outlook/masterCategories/{cat_id}"
-    cat_resp = requests.get(cat_url, headers=headers)
+    cat_resp = graph.get(cat_url)
     if cat_resp.status_code != 200:
         flash(f"⚠️ Could not fetch category: {cat_resp.text}")
         return redirect(url_for("email_rules.index"))
@@ -283,118 +241,324 @@ def delete_category(cat_id):
     category = cat_resp.json()
     category_name = category.get("displayName", "")
 
-    del_resp = requests.delete(cat_url, headers=headers)
+    catalog = get_email_catalog()
+    del_resp = graph.delete(cat_url)
+    invalidate_email_catalog()
     if del_resp.status_code == 204:
         flash(f"🗑 Deleted category '{category_name}'.")
     else:
         flash(f"⚠️ Failed to delete category: {del_resp.text}")
         return redirect(url_for("email_rules.index"))
 
-    expected_rule_name = f"auto-tag {category_name}".lower()
-    rules_url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/mailFolders/inbox/messageRules"
-    rules_resp = requests.get(rules_url, headers=headers)
-    if rules_resp.status_code == 200:
-        for rule in rules_resp.json().get("value", []):
-            if rule["displayName"].lower() == expected_rule_name:
-                rule_id = rule["id"]
-                requests.delete(f"{rules_url}/{rule_id}", headers=headers)
-                flash(f"🧹 Deleted matching rule '{rule['displayName']}'.")
-                break
+    rule = catalog.rule_for_category(category_name)
+    if rule:
+        rules_url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/mailFolders/inbox/messageRules"
+        graph.delete(f"{rules_url}/{rule['id']}")
+        flash(f"🧹 Deleted matching rule '{rule['displayName']}'.")
     return redirect(url_for("email_rules.index"))
 
 # ------------------------------------------------------------
 # 📨 RUN RULE RETROACTIVELY (SSE STREAM + DATE FILTER)
 # ------------------------------------------------------------
+IGNORE_KEYWORDS = ["[report]", "[summary]", "[digest]", "automated notification"]
+
+def is_ignored(subject):
+    subject = (subject or "").lower()
+    return any(ignore in subject for ignore in IGNORE_KEYWORDS)
+
+def iter_inbox_pages(days, select="id,subject,bodyPreview"):
+    """
+    Yield (messages, None) per page of inbox messages received in the last
+    `days` days — date window filtered server-side, 999 per page — or
+    (None, error text) once if Graph fails.
+
+    Graph can't combine $search with $filter on messages, so ship / date
+    matching stays client-side over the filtered window.
+    """
+    start_date = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    next_link = (
+        f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/mailFolders/inbox/messages"
+        f"?$filter=receivedDateTime ge {start_date}"
+        f"&$orderby=receivedDateTime desc"
+        f"&$select={select}"
+        f"&$top=999"
+    )
+
+    while next_link:
+        resp = graph.get(next_link)
+        if resp.status_code != 200:
+            yield None, resp.text
+            return
+
+        data = resp.json()
+        next_link = data.get("@odata.nextLink")
+        yield data.get("value", []), None
+
+def iter_run_rule(category_name, days=90):
+    """Yield progress lines while tagging matching inbox messages with the category."""
+    yield f"Starting rule for {category_name} (last {days} days)"
+
+    # Parse name parts
+    _, ship, cpdate = parse_category_name(category_name)
+
+    # ✅ Parse the CP date safely (no flash)
+    cp_date = parse_cp_date(cpdate)
+    if cp_date is None:
+        yield f"⚠️ Invalid CP date format ({cpdate})."
+        return
+
+    yield f"Searching inbox messages (last {days} days) for '{ship}' + {cp_date:%d %b %Y}..."
+
+    classifier = CaseClassifier([(category_name, ship, cp_date)])
+    filtered_messages = []
+    scanned = 0
+
+    for page, error in iter_inbox_pages(days):
+        if error:
+            yield f"⚠️ Error fetching messages: {error}"
+            break
+
+        for msg in page:
+            scanned += 1
+            subject = msg.get("subject", "") or ""
+
+            if is_ignored(subject):
+                yield f"Skipping '{subject}' (ignored keyword)"
+                continue
+
+            if classifier.classify(subject + " " + (msg.get("bodyPreview", "") or "")):
+                filtered_messages.append(msg)
+                yield f"Match found in '{subject}'"
+
+        yield f"Scanned {scanned} messages so far..."
+
+    if not scanned:
+        yield "⚠️ No messages retrieved."
+        return
+
+    yield f"✅ Found {len(filtered_messages)} matching messages (ship + date)."
+
+    # Tag concurrently ($batch chunks of 20, bounded by the mailbox limits)
+    tagged = []
+    for msg, error in iter_tag_messages(filtered_messages, category_name):
+        if error:
+            yield f"⚠️ Failed to tag '{msg.get('subject', '')}': {error}"
+        else:
+            tagged.append(msg["id"])
+            yield f"Tagged {len(tagged)}/{len(filtered_messages)} — {msg.get('subject', '')}"
+
+    if mirror_enabled():
+        add_category(tagged, category_name)
+    invalidate_category_summaries([category_name])
+    invalidate_attachment_indexes([category_name])
+
+    yield f"✅ Completed — {len(tagged)} messages updated."
+
+@register_job("email.run_rule")
+def run_rule_job(payload, ctx):
+    """Background version of run_rule; progress lines go to the job record."""
+    last = None
+    for line in iter_run_rule(payload["category_name"], int(payload.get("days", 90))):
+        ctx.progress(line)
+        last = line
+    return {"category_name": payload["category_name"], "summary": last}
+
 @email_rules_bp.route("/run_rule/<category_name>")
 def run_rule(category_name):
     """Apply the Outlook category retroactively to matching messages via SSE."""
-    from datetime import datetime, timedelta
-
     days = int(request.args.get("days", 90))  # ✅ read days from ?days= param
 
     def generate():
-        token = get_graph_token()
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-
-        yield f"data: Starting rule for {category_name} (last {days} days)\n\n"
-        time.sleep(0.5)
-
-        # Parse name parts
-        parts = category_name.split(" - ")
-        ship = parts[1].strip() if len(parts) > 1 else ""
-        cpdate = parts[2].strip() if len(parts) > 2 else ""
-
-        # ✅ Generate date variants safely (no flash)
-        date_variants = generate_date_variants(cpdate)
-        if not date_variants:
-            yield f"data: ⚠️ Invalid CP date format ({cpdate}).\n\n"
-            yield "data: DONE\n\n"
-            return
+        for line in iter_run_rule(category_name, days):
+            yield f"data: {line}\n\n"
+        yield "data: DONE\n\n"
 
-        yield f"data: Searching inbox messages (last {days} days) for '{ship}' + date variants...\n\n"
+    return Response(generate(), mimetype="text/event-stream")
 
-        start_date = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%SZ")
-        # --- Fetch messages manually (paginated, up to 500 total) ---
-        base_url = (
-            f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/mailFolders/inbox/messages"
-            f"?$top=50&$select=id,subject,bodyPreview"
-        )
-        next_link = base_url
-        all_messages = []
-        max_total = 500
-
-        while next_link and len(all_messages) < max_total:
-            resp = requests.get(next_link, headers=headers)
-            if resp.status_code != 200:
-                yield f"data: ⚠️ Error fetching messages: {resp.text}\n\n"
-                break
-
-            data = resp.json()
-            batch = data.get("value", [])
-            all_messages.extend(batch)
-            next_link = data.get("@odata.nextLink")
-            yield f"data: Retrieved {len(all_messages)} messages so far...\n\n"
-            time.sleep(0.2)
-
-        if not all_messages:
-            yield f"data: ⚠️ No messages retrieved.\n\n"
-            yield "data: DONE\n\n"
-            return
+@email_rules_bp.route("/run_rule/<category_name>/enqueue", methods=["POST"])
+def enqueue_run_rule(category_name):
+    """Queue run_rule for the job worker; poll /api/jobs/<JobID> for progress."""
+    days = int(request.args.get("days", 90))
+    job_id = enqueue_job(
+        "email.run_rule",
+        {"category_name": category_name, "days": days},
+        created_by=session.get("username"),
+    )
+    return jsonify({"ok": True, "JobID": job_id}), 202
 
-        IGNORE_KEYWORDS = ["[report]", "[summary]", "[digest]", "automated notification"]
-        filtered_messages = []
+# ------------------------------------------------------------
+# 🗂 RUN ALL RULES (ONE PASS, EVERY CATEGORY)
+# ------------------------------------------------------------
+def iter_run_all_rules(days=90):
+    """
+    Scan the inbox window once and add every matching category to each
+    message (existing categories are kept). One classifier over all
+    categories, so the scan cost doesn't grow with the number of cases.
+    """
+    categories = [c["displayName"] for c in get_categories()]
+    classifier = CaseClassifier.from_categories(categories)
+    yield f"Starting all rules: {len(classifier)} categories (last {days} days)"
+
+    if not len(classifier):
+        yield "⚠️ No categories with a vessel + valid CP date."
+        return
+
+    assignments = {}  # message id -> (msg, categories after tagging)
+    scanned = 0
+
+    for page, error in iter_inbox_pages(days, "id,subject,bodyPreview,categories"):
+        if error:
+            yield f"⚠️ Error fetching messages: {error}"
+            break
 
-        for msg in all_messages:
+        for msg in page:
+            scanned += 1
             subject = msg.get("subject", "") or ""
-            preview = msg.get("bodyPreview", "") or ""
-            combined = (subject + " " + preview).lower()
-
-            if any(ignore in subject.lower() for ignore in IGNORE_KEYWORDS):
-                yield f"data: Skipping '{subject}' (ignored keyword)\n\n"
+            if is_ignored(subject):
                 continue
 
-            if ship.lower() in combined and any(d.lower() in combined for d in date_variants):
-                filtered_messages.append(msg)
-                yield f"data: Match found in '{subject}'\n\n"
+            existing = msg.get("categories") or []
+            new = [c for c in classifier.classify(subject + " " + (msg.get("bodyPreview", "") or ""))
+                   if c not in existing]
+            if new:
+                assignments[msg["id"]] = (msg, existing + new)
+                yield f"Match found in '{subject}': {', '.join(new)}"
 
-        yield f"data: ✅ Found {len(filtered_messages)} matching messages (ship + date).\n\n"
+        yield f"Scanned {scanned} messages so far..."
 
-        for idx, msg in enumerate(filtered_messages, start=1):
-            msg_id = msg["id"]
-            patch_url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages/{msg_id}"
-            patch_data = {"Categories": [category_name]}
-            requests.patch(patch_url, headers=headers, json=patch_data)
-            yield f"data: Tagged {idx}/{len(filtered_messages)} — {msg.get('subject', '')}\n\n"
-            time.sleep(0.05)
+    yield f"✅ Found {len(assignments)} messages to tag."
+
+    tagged = 0
+    by_category = {}
+    for msg, error in iter_tag_messages([m for m, _ in assignments.values()],
+                                        categories_for=lambda m: assignments[m["id"]][1]):
+        if error:
+            yield f"⚠️ Failed to tag '{msg.get('subject', '')}': {error}"
+            continue
+        tagged += 1
+        for category in assignments[msg["id"]][1]:
+            by_category.setdefault(category, []).append(msg["id"])
+        yield f"Tagged {tagged}/{len(assignments)} — {msg.get('subject', '')}"
+
+    if mirror_enabled():
+        for category, ids in by_category.items():
+            add_category(ids, category)
+    invalidate_category_summaries(list(by_category))
+    invalidate_attachment_indexes(list(by_category))
+
+    yield f"✅ Completed — {tagged} messages updated."
+
+@register_job("email.run_all_rules")
+def run_all_rules_job(payload, ctx):
+    last = None
+    for line in iter_run_all_rules(int(payload.get("days", 90))):
+        ctx.progress(line)
+        last = line
+    return {"summary": last}
+
+@email_rules_bp.route("/run_all_rules")
+def run_all_rules():
+    """Tag the inbox against every category in one pass via SSE."""
+    days = int(request.args.get("days", 90))
 
-        yield f"data: ✅ Completed — {len(filtered_messages)} messages updated.\n\n"
+    def generate():
+        for line in iter_run_all_rules(days):
+            yield f"data: {line}\n\n"
         yield "data: DONE\n\n"
 
     return Response(generate(), mimetype="text/event-stream")
 
+@email_rules_bp.route("/run_all_rules/enqueue", methods=["POST"])
+def enqueue_run_all_rules():
+    days = int(request.args.get("days", 90))
+    job_id = enqueue_job("email.run_all_rules", {"days": days}, created_by=session.get("username"))
+    return jsonify({"ok": True, "JobID": job_id}), 202
+
 # ============================================================
 # 📊 API: CATEGORY SUMMARY (EMAIL + ATTACHMENT COUNTS)
 # ============================================================
+# Live (no mirror) summaries are cached; run_rule / run_all_rules drop the
+# entries for the categories they tag.
+SUMMARY_TTL_SECONDS = int(os.getenv("EMAIL_SUMMARY_TTL_SECONDS", "300"))
+MAX_SUMMARY_CATEGORIES = 500
+
+_summary_cache = {}  # category -> (loaded_at, summary)
+_summary_lock = threading.Lock()
+
+def odata_str(value):
+    return (value or "").replace("'", "''")
+
+def live_category_summary(category):
+    """Email count via $count; attachments via one expanded listing of messages that have any."""
+    cat_filter = f"categories/any(c:c eq '{odata_str(category)}')"
+    headers = {"ConsistencyLevel": "eventual"}
+
+    resp = graph.get(
+        f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages"
+        f"?$filter={cat_filter}&$count=true&$top=1&$select=id",
+        headers=headers
+    )
+    resp.raise_for_status()
+    email_count = int(resp.json().get("@odata.count", 0))
+
+    attachment_count = 0
+    if email_count:
+        for page in graph.iter_pages(
+            f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages"
+            f"?$filter=hasAttachments eq true and {cat_filter}"
+            f"&$select=id&$expand=attachments($select=id)&$top=100",
+            headers=headers
+        ):
+            # Same rule as the attachment list: file attachments only
+            attachment_count += sum(
+                1 for m in page for a in m.get("attachments") or []
+                if "@odata.type" not in a or "fileAttachment" in a["@odata.type"]
+            )
+
+    return {"email_count": email_count, "attachment_count": attachment_count}
+
+def category_summaries(categories):
+    """{category: summary}; mirror when available, else cached live lookups run concurrently."""
+    categories = list(dict.fromkeys(c for c in categories if c))
+    if not categories:
+        return {}
+
+    if ensure_fresh():
+        return mirror_category_summaries(categories)
+
+    now = time.monotonic()
+    out, missing = {}, []
+    with _summary_lock:
+        for c in categories:
+            hit = _summary_cache.get(c)
+            if hit and now - hit[0] < SUMMARY_TTL_SECONDS:
+                out[c] = hit[1]
+            else:
+                missing.append(c)
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(graph.concurrency, len(missing))) as pool:
+            futures = {pool.submit(live_category_summary, c): c for c in missing}
+            for future in as_completed(futures):
+                c = futures[future]
+                try:
+                    out[c] = future.result()
+                except Exception as e:
+                    print(f"Graph error summarising '{c}':", e)
+                    out[c] = {"email_count": None, "attachment_count": None, "error": str(e)}
+                    continue
+                with _summary_lock:
+                    _summary_cache[c] = (time.monotonic(), out[c])
+
+    return {c: out[c] for c in categories}
+
+def invalidate_category_summaries(categories=None):
+    with _summary_lock:
+        if categories is None:
+            _summary_cache.clear()
+        for c in categories or ():
+            _summary_cache.pop(c, None)
+
 @email_rules_bp.route("/api/summary")
 def api_summary():
     """Return number of emails + attachments for a category."""
@@ -402,34 +566,27 @@ def api_summary():
     if not category:
         return {"email_count": 0, "attachment_count": 0}
 
-    token = get_graph_token()
-    headers = {"Authorization": f"Bearer {token}"}
+    return category_summaries([category])[category]
 
-    # Count emails with this category
-    mail_url = (
-        f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages"
-        f"?$filter=categories/any(c:c eq '{category}')"
-        f"&$select=id"
-        f"&$top=999"
-    )
-    mail_resp = requests.get(mail_url, headers=headers)
-    email_items = mail_resp.json().get("value", [])
-    email_count = len(email_items)
+@email_rules_bp.route("/api/summaries", methods=["GET", "POST"])
+def api_summaries():
+    """
+    Email + attachment counts for many categories at once.
+    GET ?category=A&category=B, POST {"categories": [...]}; none = every category.
+    """
+    if request.method == "POST":
+        categories = (request.get_json(silent=True) or {}).get("categories") or []
+    else:
+        categories = request.args.getlist("category")
 
-    # Count attachments
-    attachment_count = 0
-    for msg in email_items:
-        mid = msg["id"]
-        att_url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages/{mid}/attachments?$select=id"
-        a = requests.get(att_url, headers=headers)
-        attachments = a.json().get("value", [])
-        attachment_count += len(attachments)
+    categories = [str(c).strip() for c in categories if str(c).strip()]
+    if not categories:
+        categories = [c["displayName"] for c in get_categories()]
 
-    return {
-        "email_count": email_count,
-        "attachment_count": attachment_count,
-    }
+    if len(categories) > MAX_SUMMARY_CATEGORIES:
+        return jsonify({"ok": False, "error": f"At most {MAX_SUMMARY_CATEGORIES} categories"}), 400
 
+    return jsonify({"ok": True, "summaries": category_summaries(categories)})
 
 # ============================================================
 # 📧 API: EMAIL LIST FOR CATEGORY (with pagination)
@@ -442,8 +599,20 @@ def api_emails():
     page_size = 20
     skip = (page - 1) * page_size
 
-    token = get_graph_token()
-    headers = {"Authorization": f"Bearer {token}"}
+    if ensure_fresh():
+        rows = category_messages(category, skip, page_size + 1)
+        return {
+            "items": [
+                {
+                    "subject": r["Subject"] or "(no subject)",
+                    "from": r["FromName"] or "",
+                    "received": r["ReceivedDateTime"] or "",
+                    "web_link": r["WebLink"] or "#"
+                }
+                for r in rows[:page_size]
+            ],
+            "next_page": page + 1 if len(rows) > page_size else None
+        }
 
     url = (
         f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages"
@@ -453,7 +622,7 @@ def api_emails():
         f"&$top={page_size}&$skip={skip}"
     )
 
-    resp = requests.get(url, headers=headers)
+    resp = graph.get(url)
     if resp.status_code != 200:
         print("Graph error:", resp.text)
         return {"items": [], "next_page": None}
@@ -484,75 +653,156 @@ def api_emails():
 
 
 # ============================================================
-# 📎 API: ATTACHMENTS FOR CATEGORY (paginated)
+# 📎 ATTACHMENT INDEX (live, per category)
 # ============================================================
-@email_rules_bp.route("/api/attachments")
-def api_attachments():
-    """Return all attachments belonging to emails with a category."""
-    category = request.args.get("category", "").strip()
-    page = int(request.args.get("page", 1))
-    page_size = 20
-    skip = (page - 1) * page_size
-
-    token = get_graph_token()
-    headers = {"Authorization": f"Bearer {token}"}
-
-    # Fetch ALL emails tagged with this category (paged)
-    mail_items = []
-    base_url = (
-        f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages"
-        f"?$filter=categories/any(c:c eq '{category}')"
-        f"&$select=id,from,webLink"
-        f"&$orderby=receivedDateTime desc"
-        f"&$top=50"
-    )
-    next_link = base_url
-
-    while next_link:
-        resp = requests.get(next_link, headers=headers)
-        if resp.status_code != 200:
-            print("Graph error:", resp.text)
-            break
-
-        data = resp.json()
-        mail_items.extend(data.get("value", []))
-        next_link = data.get("@odata.nextLink")
-
-    attachments = []
-
-    for msg in mail_items:
+# Without the mirror, a category's file attachments are listed once (one
+# expanded listing of its messages that have attachments, newest first)
+# and kept in memory. Every ATTACHMENT_INDEX_REFRESH_SECONDS the index
+# only asks for messages received since its newest one; it is rebuilt
+# from scratch after ATTACHMENT_INDEX_TTL_SECONDS (picks up tags added or
+# removed on older mail in Outlook) and dropped when run_rule /
+# run_all_rules tag the category. Pages are then plain list slices.
+ATTACHMENT_INDEX_REFRESH_SECONDS = int(os.getenv("ATTACHMENT_INDEX_REFRESH_SECONDS", "60"))
+ATTACHMENT_INDEX_TTL_SECONDS = int(os.getenv("ATTACHMENT_INDEX_TTL_SECONDS", "1800"))
+MAX_ATTACHMENT_INDEXES = 100
+
+_attachment_indexes = OrderedDict()  # category -> AttachmentIndex, least recently used first
+_attachment_indexes_lock = threading.Lock()
+
+class AttachmentIndex:
+
+    def __init__(self, category):
+        self.category = category
+        self.items = []          # attachment dicts as served, newest message first
+        self.message_ids = set()
+        self.newest = None       # receivedDateTime of the newest indexed message
+        self.built_at = None
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    def _listing(self, since=None):
+        """Messages in the category with attachments (expanded), newest first."""
+        received = f"receivedDateTime ge {since}" if since else "receivedDateTime ge 1900-01-01T00:00:00Z"
+        messages = []
+        for page in graph.iter_pages(
+            f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages"
+            f"?$filter={received} and hasAttachments eq true"
+            f" and categories/any(c:c eq '{odata_str(self.category)}')"
+            f"&$select=id,from,webLink,receivedDateTime"
+            f"&$expand=attachments($select=id,name,size,contentType)"
+            f"&$orderby=receivedDateTime desc"
+            f"&$top=100"
+        ):
+            messages.extend(page)
+        return messages
+
+    @staticmethod
+    def _items_for(msg):
         sender = (
             msg.get("from", {})
                .get("emailAddress", {})
                .get("address", "")
         )
-        mid = msg["id"]
-        att_url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages/{mid}/attachments?$select=name,size,contentType,id"
-        att_resp = requests.get(att_url, headers=headers)
-
-        # Safe: skip on error
-        if att_resp.status_code != 200:
-            print(f"[WARN] Failed to fetch attachments for message {mid}: {att_resp.text}")
-            continue
-
-        for a in att_resp.json().get("value", []):
+        items = []
+        for a in msg.get("attachments") or []:
             # Only treat file attachments, ignore "itemAttachment"
             if "@odata.type" in a and "fileAttachment" not in a["@odata.type"]:
                 continue
-
-            attachments.append({
+            items.append({
                 "file_name": a.get("name", "Attachment"),
                 "size_human": f"{round(a.get('size', 0)/1024,1)} KB",
                 "from": sender,
                 "web_link": msg.get("webLink", "#"),
-                "download_url": f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages/{mid}/attachments/{a['id']}/$value"
+                "download_url": f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages/{msg['id']}/attachments/{a['id']}/$value"
             })
+        return items
+
+    def _add(self, messages):
+        """Prepend messages not indexed yet (they are newer than everything held)."""
+        new_items = []
+        for msg in messages:
+            if msg["id"] in self.message_ids:
+                continue
+            self.message_ids.add(msg["id"])
+            new_items.extend(self._items_for(msg))
+            if not self.newest or (msg.get("receivedDateTime") or "") > self.newest:
+                self.newest = msg.get("receivedDateTime")
+        if new_items:
+            self.items = new_items + self.items
+
+    def ensure_current(self):
+        """Build, rebuild or incrementally refresh as the timers require; single-flight per category."""
+        with self.lock:
+            now = time.monotonic()
+            if self.built_at is None or now - self.built_at >= ATTACHMENT_INDEX_TTL_SECONDS:
+                self.items, self.message_ids, self.newest = [], set(), None
+                self._add(self._listing())
+                self.built_at = self.refreshed_at = now
+            elif now - self.refreshed_at >= ATTACHMENT_INDEX_REFRESH_SECONDS:
+                self._add(self._listing(since=self.newest))
+                self.refreshed_at = now
+
+    def page(self, skip, size):
+        items = self.items
+        return items[skip:skip + size], len(items) > skip + size
+
+def get_attachment_index(category):
+    with _attachment_indexes_lock:
+        index = _attachment_indexes.get(category)
+        if index is None:
+            index = _attachment_indexes[category] = AttachmentIndex(category)
+            while len(_attachment_indexes) > MAX_ATTACHMENT_INDEXES:
+                _attachment_indexes.popitem(last=False)
+        else:
+            _attachment_indexes.move_to_end(category)
+    index.ensure_current()
+    return index
+
+def invalidate_attachment_indexes(categories=None):
+    with _attachment_indexes_lock:
+        if categories is None:
+            _attachment_indexes.clear()
+        for c in categories or ():
+            _attachment_indexes.pop(c, None)
+
+# ============================================================
+# 📎 API: ATTACHMENTS FOR CATEGORY (paginated)
+# ============================================================
+@email_rules_bp.route("/api/attachments")
+def api_attachments():
+    """Return one page of the file attachments on emails with a category."""
+    category = request.args.get("category", "").strip()
+    page = int(request.args.get("page", 1))
+    page_size = 20
+    skip = (page - 1) * page_size
+
+    if ensure_fresh():
+        rows = category_attachments(category, skip, page_size + 1)
+        return {
+            "items": [
+                {
+                    "file_name": r["Name"] or "Attachment",
+                    "size_human": f"{round((r['Size'] or 0)/1024,1)} KB",
+                    "from": r["FromAddress"] or "",
+                    "web_link": r["WebLink"] or "#",
+                    "download_url": f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages/{r['MessageID']}/attachments/{r['AttachmentID']}/$value"
+                }
+                for r in rows[:page_size]
+            ],
+            "next_page": page + 1 if len(rows) > page_size else None
+        }
+
+    if not category:
+        return {"items": [], "next_page": None}
 
-    # Paginate attachments
-    paged = attachments[skip : skip + page_size]
-    next_page = page + 1 if len(attachments) > skip + page_size else None
+    try:
+        index = get_attachment_index(category)
+    except Exception as e:
+        print("Graph error:", e)
+        return {"items": [], "next_page": None}
 
+    paged, more = index.page(skip, page_size)
     return {
         "items": paged,
-        "next_page": next_page
+        "next_page": page + 1 if more else None
     }
\ No newline at end of file
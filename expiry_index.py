@@ -0,0 +1,246 @@
+# ==============================================
+# 📆 expiry_index.py — Portfolio-wide upcoming timebar expiries
+# ==============================================
+# Backed by the indexed view dbo.vTimebarExpiries (sql/004), which SQL
+# Server maintains on every CaseNotices / Cases / NoticeTypes write.
+#
+# Each process also keeps a sorted in-memory mirror so range queries and
+# pagination are a bisect instead of a round trip. Recalc marks touched
+# cases dirty (via register_recalc_listener); dirty cases are re-read
+# from the view on the next request, and the whole mirror is reloaded
+# every EXPIRY_INDEX_TTL_SECONDS to pick up writes from other workers.
+# ==============================================
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, date
+
+from flask import Blueprint, request, jsonify
+from sqlalchemy import text, bindparam
+
+from utils import get_db_connection, login_required
+from timebars import register_recalc_listener, parse_date
+
+expiry_index_bp = Blueprint("expiry_index_bp", __name__)
+
+EXPIRY_INDEX_TTL_SECONDS = int(os.getenv("EXPIRY_INDEX_TTL_SECONDS", "300"))
+MAX_PAGE_SIZE = 500
+
+VIEW_COLUMNS = """
+    CaseNoticeID, CaseID, NoticeTypeID, OrgID, NoticeTypeName,
+    ExpiryDate, DeepBlueRef, VesselName, CharterersName
+"""
+
+# ---------------- Mirror ----------------
+
+class ExpiryIndex:
+
+    def __init__(self, ttl_seconds: int = EXPIRY_INDEX_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._keys = []         # sorted [(ExpiryDate, CaseNoticeID)]
+        self._rows = {}         # CaseNoticeID -> row dict
+        self._by_case = {}      # CaseID -> {CaseNoticeID}
+        self._dirty = set()     # CaseIDs to re-read
+        self._loaded_at = None
+        self._lock = threading.RLock()
+
+    # ---- maintenance ----
+
+    def load(self):
+        with get_db_connection() as conn:
+            rows = conn.execute(text(f"""
+                SELECT {VIEW_COLUMNS}
+                FROM dbo.vTimebarExpiries WITH (NOEXPAND)
+            """)).fetchall()
+
+        with self._lock:
+            self._rows = {}
+            self._by_case = {}
+            for r in rows:
+                self._put(dict(r._mapping))
+            self._keys = sorted((row["ExpiryDate"], nid) for nid, row in self._rows.items())
+            self._dirty.clear()
+            self._loaded_at = datetime.utcnow()
+
+    def _put(self, row):
+        row["ExpiryDate"] = parse_date(row["ExpiryDate"])
+        self._rows[row["CaseNoticeID"]] = row
+        self._by_case.setdefault(row["CaseID"], set()).add(row["CaseNoticeID"])
+
+    def _remove(self, case_notice_id):
+        row = self._rows.pop(case_notice_id, None)
+        if not row:
+            return
+        key = (row["ExpiryDate"], case_notice_id)
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+        ids = self._by_case.get(row["CaseID"])
+        if ids:
+            ids.discard(case_notice_id)
+
+    def mark_dirty(self, case_ids):
+        with self._lock:
+            self._dirty.update(case_ids)
+
+    def on_recalc(self, result):
+        self.mark_dirty(result.get("changed_cases") or [])
+
+    def _refresh_dirty(self):
+        with self._lock:
+            dirty = sorted(self._dirty)
+            self._dirty.clear()
+
+        if not dirty:
+            return
+
+        with get_db_connection() as conn:
+            rows = conn.execute(text(f"""
+                SELECT {VIEW_COLUMNS}
+                FROM dbo.vTimebarExpiries WITH (NOEXPAND)
+                WHERE CaseID IN :CaseIDs
+            """).bindparams(bindparam("CaseIDs", expanding=True)), {"CaseIDs": dirty}).fetchall()
+
+        with self._lock:
+            for case_id in dirty:
+                for nid in list(self._by_case.pop(case_id, ())):
+                    self._remove(nid)
+
+            for r in rows:
+                row = dict(r._mapping)
+                self._remove(row["CaseNoticeID"])
+                self._put(row)
+                key = (row["ExpiryDate"], row["CaseNoticeID"])
+                self._keys.insert(bisect_left(self._keys, key), key)
+
+    def ensure_fresh(self):
+        stale = (
+            self._loaded_at is None
+            or (datetime.utcnow() - self._loaded_at).total_seconds() > self.ttl_seconds
+        )
+        if stale:
+            self.load()
+        else:
+            self._refresh_dirty()
+
+    # ---- queries ----
+
+    def query(self, start, end, org_id=None, notice_type_id=None, after=None, limit=50):
+        """
+        Rows with start <= ExpiryDate <= end, ordered by (ExpiryDate, CaseNoticeID).
+        `after` is the (ExpiryDate, CaseNoticeID) key of the previous page's last row.
+        """
+        with self._lock:
+            lo = bisect_left(self._keys, (start, -1))
+            hi = bisect_right(self._keys, (end, float("inf")))
+            if after:
+                lo = max(lo, bisect_right(self._keys, after))
+
+            filtered = org_id is not None or notice_type_id is not None
+            items = []
+            i = lo
+            while i < hi and len(items) <= limit:
+                row = self._rows[self._keys[i][1]]
+                i += 1
+                if org_id is not None and row["OrgID"] != org_id:
+                    continue
+                if notice_type_id is not None and row["NoticeTypeID"] != notice_type_id:
+                    continue
+                items.append(dict(row))
+
+            total = None if filtered else hi - bisect_left(self._keys, (start, -1))
+
+        has_more = len(items) > limit
+        return items[:limit], has_more, total
+
+_index = ExpiryIndex()
+register_recalc_listener(_index.on_recalc)
+
+def get_expiry_index():
+    return _index
+
+# ---------------- DB fallback ----------------
+
+def query_expiries_db(conn, start, end, org_id=None, notice_type_id=None, after=None, limit=50):
+    sql = f"""
+        SELECT TOP (:Limit) {VIEW_COLUMNS}
+        FROM dbo.vTimebarExpiries WITH (NOEXPAND)
+        WHERE ExpiryDate BETWEEN :Start AND :End
+    """
+    params = {"Limit": limit + 1, "Start": start, "End": end}
+
+    if after:
+        sql += """
+          AND (ExpiryDate > :AfterDate
+               OR (ExpiryDate = :AfterDate AND CaseNoticeID > :AfterID))
+        """
+        params["AfterDate"], params["AfterID"] = after
+
+    if org_id is not None:
+        sql += " AND OrgID = :OrgID"
+        params["OrgID"] = org_id
+
+    if notice_type_id is not None:
+        sql += " AND NoticeTypeID = :NoticeTypeID"
+        params["NoticeTypeID"] = notice_type_id
+
+    sql += " ORDER BY ExpiryDate ASC, CaseNoticeID ASC"
+
+    rows = [dict(r._mapping) for r in conn.execute(text(sql), params).fetchall()]
+    for row in rows:
+        row["ExpiryDate"] = parse_date(row["ExpiryDate"])
+    return rows[:limit], len(rows) > limit, None
+
+# ---------------- Routes ----------------
+
+def _encode_cursor(row):
+    return f"{row['ExpiryDate'].isoformat()}:{row['CaseNoticeID']}"
+
+def _decode_cursor(cursor):
+    d, nid = cursor.split(":", 1)
+    return parse_date(d), int(nid)
+
+@expiry_index_bp.route("/api/timebars/expiries", methods=["GET"])
+@login_required
+def get_upcoming_expiries():
+    """
+    GET /api/timebars/expiries?days=30
+        [&from=YYYY-MM-DD&to=YYYY-MM-DD][&org_id=][&notice_type_id=][&limit=][&cursor=]
+    """
+    try:
+        start = parse_date(request.args.get("from")) or date.today()
+        end = parse_date(request.args.get("to")) or start + timedelta(days=int(request.args.get("days", 30)))
+        after = _decode_cursor(request.args["cursor"]) if request.args.get("cursor") else None
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid from / to / days / cursor"}), 400
+
+    limit = max(1, min(MAX_PAGE_SIZE, request.args.get("limit", 50, type=int)))
+    org_id = request.args.get("org_id", type=int)
+    notice_type_id = request.args.get("notice_type_id", type=int)
+
+    source = "memory"
+    try:
+        _index.ensure_fresh()
+        items, has_more, total = _index.query(start, end, org_id, notice_type_id, after, limit)
+    except Exception as e:
+        print("⚠️ Expiry index mirror unavailable, querying view:", e)
+        source = "db"
+        with get_db_connection() as conn:
+            items, has_more, total = query_expiries_db(conn, start, end, org_id, notice_type_id, after, limit)
+
+    next_cursor = _encode_cursor(items[-1]) if has_more and items else None
+
+    today = date.today()
+    for row in items:
+        row["DaysLeft"] = (row["ExpiryDate"] - today).days
+        row["ExpiryDate"] = row["ExpiryDate"].isoformat()
+
+    return jsonify({
+        "ok": True,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "items": items,
+        "next_cursor": next_cursor,
+        "total": total,
+        "source": source,
+    })
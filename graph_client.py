@@ -0,0 +1,346 @@
+# ============================================================
+# 🌐 graph_client.py — Shared Microsoft Graph HTTP client
+# ============================================================
+# One pooled requests.Session for every Graph call, so TLS connections
+# are kept alive between requests (and across the messages of a run_rule)
+# instead of being opened per call.
+#
+#   - auth        cached client-credentials token (single-flight refresh,
+#                 optional GRAPH_TOKEN_CACHE_FILE shared by workers); a 401
+#                 drops the token and retries once
+#   - timeouts    GRAPH_CONNECT_TIMEOUT / GRAPH_READ_TIMEOUT seconds
+#   - retries     429 / 502 / 503 / 504 and connection errors are retried up
+#                 to GRAPH_MAX_RETRIES times, waiting Retry-After when Graph
+#                 sends it, otherwise exponential backoff with jitter
+#
+# Calls return the requests.Response, so callers keep their own status
+# handling. batch() fans many small calls (attachment lists, tagging
+# PATCHes) into /$batch requests of 20. A per-mailbox token bucket and a
+# 4-slot semaphore keep concurrent callers inside Outlook's throttling
+# limits.
+# ============================================================
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TENANT_ID = os.getenv("TENANT_ID")
+CLIENT_ID = os.getenv("CLIENT_ID")
+CLIENT_SECRET = os.getenv("CLIENT_SECRET")
+MAILBOX = os.getenv("MAILBOX")
+
+GRAPH_BASE_URL = os.getenv("GRAPH_BASE_URL", "https://graph.microsoft.com/v1.0")  # override for a local stand-in
+GRAPH_CONNECT_TIMEOUT = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "5"))
+GRAPH_READ_TIMEOUT = float(os.getenv("GRAPH_READ_TIMEOUT", "60"))
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "5"))
+GRAPH_POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE", "16"))
+GRAPH_BACKOFF_BASE = 0.5
+GRAPH_BACKOFF_MAX = 30.0
+
+RETRY_STATUSES = {429, 502, 503, 504}
+GRAPH_BATCH_SIZE = 20  # Graph's $batch limit
+
+# Outlook throttles per mailbox: 4 concurrent requests, 10,000 per 10 min.
+# $batch sub-requests count individually against the rate.
+GRAPH_MAILBOX_CONCURRENCY = int(os.getenv("GRAPH_MAILBOX_CONCURRENCY", "4"))
+GRAPH_MAILBOX_RATE = float(os.getenv("GRAPH_MAILBOX_RATE", "15"))  # requests / second
+
+# ------------------------------------------------------------
+# 🔐 AUTHENTICATION (client credentials)
+# ------------------------------------------------------------
+# Client-credentials tokens last ~1h. They are cached in memory until
+# TOKEN_REFRESH_MARGIN seconds before expiry and refreshed by one thread
+# at a time (the others wait on the lock, then reuse its token).
+# GRAPH_TOKEN_CACHE_FILE=/path shares the token between gunicorn workers.
+TOKEN_REFRESH_MARGIN = 300
+GRAPH_TOKEN_CACHE_FILE = os.getenv("GRAPH_TOKEN_CACHE_FILE")
+
+_token = {"access_token": None, "expires_at": 0.0}
+_token_lock = threading.Lock()
+
+def _token_valid(entry):
+    return bool(entry.get("access_token")) and entry.get("expires_at", 0) - TOKEN_REFRESH_MARGIN > time.time()
+
+def _read_token_file():
+    if not GRAPH_TOKEN_CACHE_FILE:
+        return None
+    try:
+        with open(GRAPH_TOKEN_CACHE_FILE) as f:
+            entry = json.load(f)
+        return entry if entry.get("client_id") == CLIENT_ID else None
+    except (OSError, ValueError):
+        return None
+
+def _write_token_file(entry):
+    if not GRAPH_TOKEN_CACHE_FILE:
+        return
+    tmp = f"{GRAPH_TOKEN_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({**entry, "client_id": CLIENT_ID}, f)
+        os.replace(tmp, GRAPH_TOKEN_CACHE_FILE)
+    except OSError as e:
+        print("⚠️ Could not write Graph token cache:", e)
+
+def _fetch_graph_token():
+    """Authenticate using client credentials; returns {access_token, expires_at}."""
+    token_url = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/token"
+    token_data = {
+        "grant_type": "client_credentials",
+        "client_id": CLIENT_ID,
+        "client_secret": CLIENT_SECRET,
+        "scope": "https://graph.microsoft.com/.default"
+    }
+    resp = requests.post(token_url, data=token_data, timeout=(GRAPH_CONNECT_TIMEOUT, GRAPH_READ_TIMEOUT))
+    resp.raise_for_status()
+    data = resp.json()
+    return {
+        "access_token": data["access_token"],
+        "expires_at": time.time() + int(data.get("expires_in", 3599)),
+    }
+
+def get_graph_token(force_refresh=False):
+    """Return a Graph access token, fetching a new one only near expiry."""
+    entry = _token
+    if not force_refresh and _token_valid(entry):
+        return entry["access_token"]
+
+    with _token_lock:
+        # Another thread may have refreshed while we waited
+        if not force_refresh and _token_valid(_token):
+            return _token["access_token"]
+
+        shared = None if force_refresh else _read_token_file()
+        if shared and _token_valid(shared):
+            fresh = shared
+        else:
+            fresh = _fetch_graph_token()
+            _write_token_file(fresh)
+
+        _token.update(access_token=fresh["access_token"], expires_at=fresh["expires_at"])
+        return _token["access_token"]
+
+def invalidate_graph_token(rejected=None):
+    """
+    Drop a token Graph rejected (e.g. with a 401) from memory and from the
+    shared cache file, so the next get_graph_token() fetches a new one.
+    With `rejected`, a token another thread or worker already replaced is
+    left alone; without it, the cached token is dropped regardless.
+    """
+    with _token_lock:
+        if rejected is None or _token.get("access_token") == rejected:
+            _token.update(access_token=None, expires_at=0.0)
+
+        shared = _read_token_file()
+        if shared and (rejected is None or shared.get("access_token") == rejected):
+            try:
+                os.remove(GRAPH_TOKEN_CACHE_FILE)
+            except OSError:
+                pass
+
+# ------------------------------------------------------------
+# 🚦 RATE LIMITING
+# ------------------------------------------------------------
+class RateLimiter:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cost: float = 1):
+        cost = min(cost, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                wait = (cost - self.tokens) / self.rate
+            time.sleep(wait)
+
+# ------------------------------------------------------------
+# 🌐 CLIENT
+# ------------------------------------------------------------
+class GraphClient:
+
+    def __init__(self, mailbox=MAILBOX, connect_timeout=GRAPH_CONNECT_TIMEOUT,
+                 read_timeout=GRAPH_READ_TIMEOUT, max_retries=GRAPH_MAX_RETRIES,
+                 pool_size=GRAPH_POOL_SIZE, concurrency=GRAPH_MAILBOX_CONCURRENCY,
+                 rate=GRAPH_MAILBOX_RATE):
+        self.mailbox = mailbox
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.concurrency = concurrency
+
+        # Shared by every thread using this client, so parallel callers
+        # (tagger pool, concurrent requests) stay inside the mailbox limits
+        self.limiter = RateLimiter(rate, burst=max(rate, GRAPH_BATCH_SIZE))
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+    # ---- urls ----
+
+    def url(self, path: str):
+        """Absolute URLs (e.g. @odata.nextLink) pass through; paths get the v1.0 base."""
+        if path.startswith("http"):
+            return path
+        return f"{GRAPH_BASE_URL}/{path.lstrip('/')}"
+
+    def mailbox_url(self, path: str):
+        return self.url(f"users/{self.mailbox}/{path.lstrip('/')}")
+
+    # ---- requests ----
+
+    def _retry_delay(self, resp, attempt: int):
+        if resp is not None:
+            retry_after = resp.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(GRAPH_BACKOFF_MAX, float(retry_after))
+                except ValueError:
+                    pass
+        return min(GRAPH_BACKOFF_MAX, GRAPH_BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+    def request(self, method: str, path: str, headers=None, cost: int = 1, **kwargs):
+        url = self.url(path)
+        kwargs.setdefault("timeout", self.timeout)
+        refreshed = False
+        attempt = 0
+
+        while True:
+            token = get_graph_token()
+            hdrs = {"Authorization": f"Bearer {token}"}
+            if headers:
+                hdrs.update(headers)
+
+            resp = None
+            self.limiter.acquire(cost)
+            try:
+                with self._slots:
+                    resp = self.session.request(method, url, headers=hdrs, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                print(f"⚠️ Graph {method} {url} failed ({e}); retrying")
+            else:
+                if resp.status_code == 401 and not refreshed:
+                    invalidate_graph_token(token)
+                    refreshed = True
+                    continue
+
+                if resp.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return resp
+
+            time.sleep(self._retry_delay(resp, attempt))
+            attempt += 1
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def iter_pages(self, path, **kwargs):
+        """Yield the `value` list of each page, following @odata.nextLink."""
+        next_link = path
+        while next_link:
+            resp = self.get(next_link, **kwargs)
+            resp.raise_for_status()
+            data = resp.json()
+            yield data.get("value", [])
+            next_link = data.get("@odata.nextLink")
+            kwargs.pop("params", None)  # nextLink already carries the query
+
+    # ---- $batch ----
+
+    def batch(self, items):
+        """
+        Send sub-requests through /$batch, GRAPH_BATCH_SIZE per call.
+
+        items: [{"method": "GET", "url": "/users/.../messages/{id}/attachments", "body": {...}}]
+               (url relative to v1.0, as $batch requires)
+        Returns one {"status", "headers", "body"} per item, in order. Throttled
+        items are re-sent after their Retry-After; a failed batch call marks its
+        items with status 0 and the error in body.
+        """
+        results = [None] * len(items)
+        pending = list(range(len(items)))
+        attempt = 0
+
+        while pending:
+            throttled, wait = [], 0.0
+
+            for start in range(0, len(pending), GRAPH_BATCH_SIZE):
+                chunk = pending[start:start + GRAPH_BATCH_SIZE]
+                payload = {"requests": []}
+                for i in chunk:
+                    item = items[i]
+                    sub = {"id": str(i), "method": item.get("method", "GET"), "url": item["url"]}
+                    if item.get("body") is not None:
+                        sub["body"] = item["body"]
+                        sub["headers"] = {"Content-Type": "application/json"}
+                    payload["requests"].append(sub)
+
+                try:
+                    resp = self.post("$batch", json=payload, cost=len(chunk))
+                    resp.raise_for_status()
+                    responses = resp.json().get("responses", [])
+                except (requests.RequestException, ValueError) as e:
+                    for i in chunk:
+                        results[i] = {"status": 0, "headers": {}, "body": {"error": {"message": str(e)}}}
+                    continue
+
+                for r in responses:
+                    i = int(r["id"])
+                    status = int(r.get("status", 0))
+                    headers = r.get("headers") or {}
+                    if status in RETRY_STATUSES and attempt < self.max_retries:
+                        throttled.append(i)
+                        try:
+                            wait = max(wait, float(headers.get("Retry-After", 0)))
+                        except ValueError:
+                            pass
+                    results[i] = {"status": status, "headers": headers, "body": r.get("body")}
+
+            if not throttled:
+                break
+            time.sleep(min(GRAPH_BACKOFF_MAX, wait) or self._retry_delay(None, attempt))
+            pending = sorted(throttled)
+            attempt += 1
+
+        return results
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_graph_client():
+    """Process-wide GraphClient (one connection pool per worker)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GraphClient()
+    return _client
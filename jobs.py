@@ -0,0 +1,474 @@
+# ==============================================
+# 🧰 jobs.py — DB-backed background job queue
+# ==============================================
+# Long-running work (Outlook tagging, CP parsing, blob clean-up) is
+# enqueued as a row in Jobs and run by `python worker.py` instead of on
+# a gunicorn request thread. The browser polls /api/jobs/<id>.
+#
+#   - priorities   higher Priority is claimed first
+#   - leases       a claimed job is owned until LeaseExpiresAt; the worker
+#                  heartbeats while it runs, and an expired lease (crashed
+#                  worker) makes the job claimable again
+#   - retries      failures are re-queued with exponential backoff + jitter
+#                  until MaxAttempts, then marked FAILED; a handler raises
+#                  PermanentJobError to fail at once, and a job whose lease
+#                  expires on its last attempt is failed, not re-claimed
+#
+# Storage is the main database (dbo.Jobs, sql/008) unless JOBS_DB_URL is
+# set, e.g. JOBS_DB_URL=sqlite:///jobs.db for local development — the
+# SQLite table is created on first use.
+# ==============================================
+import json
+import os
+import random
+import socket
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, request, jsonify, session
+from sqlalchemy import create_engine, text
+
+from utils import engine as main_engine, login_required
+
+jobs_bp = Blueprint("jobs_bp", __name__, cli_group="jobs")
+
+JOBS_DB_URL = os.getenv("JOBS_DB_URL")
+LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+BACKOFF_BASE_SECONDS = 15
+BACKOFF_MAX_SECONDS = 1800
+
+JOB_STATUSES = ("QUEUED", "RUNNING", "SUCCEEDED", "FAILED", "CANCELLED")
+
+# ---------------- Storage ----------------
+
+_engine = None
+_schema_ready = False
+_engine_lock = threading.Lock()
+
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS Jobs (
+        JobID           INTEGER PRIMARY KEY AUTOINCREMENT,
+        Kind            TEXT NOT NULL,
+        Payload         TEXT NULL,
+        Priority        INTEGER NOT NULL DEFAULT 0,
+        Status          TEXT NOT NULL DEFAULT 'QUEUED',
+        Attempts        INTEGER NOT NULL DEFAULT 0,
+        MaxAttempts     INTEGER NOT NULL DEFAULT 3,
+        RunAfter        TIMESTAMP NOT NULL,
+        LeaseOwner      TEXT NULL,
+        LeaseExpiresAt  TIMESTAMP NULL,
+        Progress        TEXT NULL,
+        Result          TEXT NULL,
+        Error           TEXT NULL,
+        CreatedBy       TEXT NULL,
+        CreatedAt       TIMESTAMP NOT NULL,
+        StartedAt       TIMESTAMP NULL,
+        FinishedAt      TIMESTAMP NULL,
+        UpdatedAt       TIMESTAMP NOT NULL
+    )
+"""
+
+def get_jobs_engine():
+    global _engine, _schema_ready
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(JOBS_DB_URL, pool_pre_ping=True) if JOBS_DB_URL else main_engine
+
+        if not _schema_ready and _engine.dialect.name == "sqlite":
+            with _engine.begin() as conn:
+                conn.execute(text(SQLITE_SCHEMA))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS IX_Jobs_Claim ON Jobs (Status, Priority, RunAfter)"
+                ))
+        _schema_ready = True
+    return _engine
+
+def _is_sqlite():
+    return get_jobs_engine().dialect.name == "sqlite"
+
+def jobs_in_main_db():
+    """True when Jobs lives in the main database, so enqueue_job(conn=...) can join its transaction."""
+    return get_jobs_engine() is main_engine
+
+def _table():
+    return "Jobs" if _is_sqlite() else "dbo.Jobs"
+
+def _now():
+    return datetime.utcnow()
+
+def _row(r):
+    if r is None:
+        return None
+    job = dict(r._mapping)
+    for key in ("Payload", "Result"):
+        if job.get(key):
+            try:
+                job[key] = json.loads(job[key])
+            except ValueError:
+                pass
+    return job
+
+# ---------------- Handlers ----------------
+
+JOB_HANDLERS = {}
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying cannot help; the job is marked FAILED at once."""
+
+def register_job(kind: str):
+    """Register fn(payload, ctx) -> JSON-able result for a job kind."""
+    def decorator(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+class JobContext:
+    """
+    Handed to handlers: progress() records a status line and renews the
+    lease; last_attempt tells a handler that a failure now is final (e.g.
+    to clean up what it staged for retries).
+    """
+
+    def __init__(self, job_id: int, owner: str, attempts: int = 1, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.job_id = job_id
+        self.owner = owner
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+
+    @property
+    def last_attempt(self):
+        return self.attempts >= self.max_attempts
+
+    def progress(self, message: str):
+        with get_jobs_engine().begin() as conn:
+            conn.execute(text(f"""
+                UPDATE {_table()}
+                SET Progress = :Progress,
+                    LeaseExpiresAt = :LeaseExpiresAt,
+                    UpdatedAt = :Now
+                WHERE JobID = :JobID AND LeaseOwner = :Owner
+            """), {
+                "Progress": str(message)[:4000],
+                "LeaseExpiresAt": _now() + timedelta(seconds=LEASE_SECONDS),
+                "Now": _now(),
+                "JobID": self.job_id,
+                "Owner": self.owner,
+            })
+
+    def heartbeat(self):
+        with get_jobs_engine().begin() as conn:
+            conn.execute(text(f"""
+                UPDATE {_table()}
+                SET LeaseExpiresAt = :LeaseExpiresAt
+                WHERE JobID = :JobID AND LeaseOwner = :Owner
+            """), {
+                "LeaseExpiresAt": _now() + timedelta(seconds=LEASE_SECONDS),
+                "JobID": self.job_id,
+                "Owner": self.owner,
+            })
+
+# ---------------- Queue API ----------------
+
+def enqueue_job(kind: str, payload=None, priority: int = 0, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                run_after=None, created_by=None, conn=None):
+    """
+    Queue a job and return its JobID.
+    conn: insert on this main-database connection, inside the caller's
+    transaction (only when jobs_in_main_db()); otherwise the job is
+    committed on its own.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    now = _now()
+    returning = "RETURNING JobID" if _is_sqlite() else ""
+    output = "" if _is_sqlite() else "OUTPUT INSERTED.JobID"
+
+    if conn is not None and not jobs_in_main_db():
+        raise ValueError("enqueue_job(conn=...) needs Jobs in the main database (JOBS_DB_URL is set)")
+
+    insert = text(f"""
+            INSERT INTO {_table()}
+                (Kind, Payload, Priority, Status, Attempts, MaxAttempts,
+                 RunAfter, CreatedBy, CreatedAt, UpdatedAt)
+            {output}
+            VALUES
+                (:Kind, :Payload, :Priority, 'QUEUED', 0, :MaxAttempts,
+                 :RunAfter, :CreatedBy, :Now, :Now)
+            {returning}
+        """)
+    params = {
+        "Kind": kind,
+        "Payload": json.dumps(payload or {}, default=str),
+        "Priority": int(priority),
+        "MaxAttempts": int(max_attempts),
+        "RunAfter": run_after or now,
+        "CreatedBy": created_by,
+        "Now": now,
+    }
+
+    if conn is not None:
+        return int(conn.execute(insert, params).fetchone()[0])
+
+    with get_jobs_engine().begin() as jobs_conn:
+        return int(jobs_conn.execute(insert, params).fetchone()[0])
+
+def get_job(job_id: int):
+    with get_jobs_engine().connect() as conn:
+        return _row(conn.execute(text(f"""
+            SELECT JobID, Kind, Priority, Status, Attempts, MaxAttempts, RunAfter,
+                   LeaseOwner, LeaseExpiresAt, Progress, Result, Error,
+                   CreatedBy, CreatedAt, StartedAt, FinishedAt, UpdatedAt
+            FROM {_table()}
+            WHERE JobID = :JobID
+        """), {"JobID": job_id}).fetchone())
+
+def claim_job(owner: str, kinds=None):
+    """
+    Lease the next runnable job (QUEUED and due, or RUNNING with an expired
+    lease and attempts left). Expired leases with no attempts left — the
+    job keeps killing its worker — are marked FAILED first.
+    """
+    now = _now()
+    params = {
+        "Owner": owner,
+        "Now": now,
+        "LeaseExpiresAt": now + timedelta(seconds=LEASE_SECONDS),
+    }
+
+    kind_sql = ""
+    if kinds:
+        names = [f":K{i}" for i in range(len(kinds))]
+        kind_sql = f"AND Kind IN ({', '.join(names)})"
+        params.update({f"K{i}": k for i, k in enumerate(kinds)})
+
+    runnable = f"""
+        ((Status = 'QUEUED' AND RunAfter <= :Now)
+         OR (Status = 'RUNNING' AND LeaseExpiresAt < :Now AND Attempts < MaxAttempts))
+        {kind_sql}
+    """
+    exhausted_sql = f"""
+        UPDATE {_table()}
+        SET Status = 'FAILED',
+            Error = :Error,
+            LeaseOwner = NULL,
+            LeaseExpiresAt = NULL,
+            FinishedAt = :Now,
+            UpdatedAt = :Now
+        WHERE Status = 'RUNNING' AND LeaseExpiresAt < :Now AND Attempts >= MaxAttempts
+        {kind_sql}
+    """
+    set_sql = """
+        Status = 'RUNNING',
+        LeaseOwner = :Owner,
+        LeaseExpiresAt = :LeaseExpiresAt,
+        Attempts = Attempts + 1,
+        StartedAt = COALESCE(StartedAt, :Now),
+        UpdatedAt = :Now
+    """
+
+    if _is_sqlite():
+        sql = f"""
+            UPDATE Jobs
+            SET {set_sql}
+            WHERE JobID = (
+                SELECT JobID FROM Jobs
+                WHERE {runnable}
+                ORDER BY Priority DESC, RunAfter ASC, JobID ASC
+                LIMIT 1
+            )
+            RETURNING JobID, Kind, Payload, Attempts, MaxAttempts
+        """
+    else:
+        sql = f"""
+            WITH next_job AS (
+                SELECT TOP (1) *
+                FROM dbo.Jobs WITH (READPAST, UPDLOCK, ROWLOCK)
+                WHERE {runnable}
+                ORDER BY Priority DESC, RunAfter ASC, JobID ASC
+            )
+            UPDATE next_job
+            SET {set_sql}
+            OUTPUT inserted.JobID, inserted.Kind, inserted.Payload,
+                   inserted.Attempts, inserted.MaxAttempts;
+        """
+
+    with get_jobs_engine().begin() as conn:
+        conn.execute(text(exhausted_sql), {
+            **params, "Error": "Lease expired on the final attempt (worker lost)"
+        })
+        return _row(conn.execute(text(sql), params).fetchone())
+
+def backoff_seconds(attempts: int):
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+def _finish(job_id: int, owner: str, **fields):
+    sets = ", ".join(f"{k} = :{k}" for k in fields)
+    with get_jobs_engine().begin() as conn:
+        conn.execute(text(f"""
+            UPDATE {_table()}
+            SET {sets}, LeaseOwner = NULL, LeaseExpiresAt = NULL, UpdatedAt = :Now
+            WHERE JobID = :JobID AND LeaseOwner = :Owner
+        """), {**fields, "Now": _now(), "JobID": job_id, "Owner": owner})
+
+def complete_job(job_id: int, owner: str, result=None):
+    _finish(job_id, owner, Status="SUCCEEDED", Result=json.dumps(result, default=str),
+            Error=None, FinishedAt=_now())
+
+def fail_job(job_id: int, owner: str, attempts: int, max_attempts: int, error: str):
+    if attempts < max_attempts:
+        _finish(job_id, owner, Status="QUEUED", Error=error[:4000],
+                RunAfter=_now() + timedelta(seconds=backoff_seconds(attempts)))
+    else:
+        _finish(job_id, owner, Status="FAILED", Error=error[:4000], FinishedAt=_now())
+
+def cancel_job(job_id: int):
+    with get_jobs_engine().begin() as conn:
+        return conn.execute(text(f"""
+            UPDATE {_table()}
+            SET Status = 'CANCELLED', FinishedAt = :Now, UpdatedAt = :Now
+            WHERE JobID = :JobID AND Status = 'QUEUED'
+        """), {"Now": _now(), "JobID": job_id}).rowcount > 0
+
+# ---------------- Worker ----------------
+
+def run_job(job, owner: str):
+    ctx = JobContext(job["JobID"], owner, job["Attempts"], job["MaxAttempts"])
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(LEASE_SECONDS / 3):
+            try:
+                ctx.heartbeat()
+            except Exception as e:
+                print(f"⚠️ Job {job['JobID']} heartbeat failed:", e)
+
+    hb = threading.Thread(target=beat, name=f"job-{job['JobID']}-heartbeat", daemon=True)
+    hb.start()
+
+    try:
+        handler = JOB_HANDLERS.get(job["Kind"])
+        if handler is None:
+            raise RuntimeError(f"No handler registered for {job['Kind']}")
+
+        result = handler(job["Payload"] or {}, ctx)
+        complete_job(job["JobID"], owner, result)
+        return True
+
+    except PermanentJobError as e:
+        print(f"❌ Job {job['JobID']} ({job['Kind']}) failed permanently:", e)
+        fail_job(job["JobID"], owner, job["MaxAttempts"], job["MaxAttempts"], f"{type(e).__name__}: {e}")
+        return False
+
+    except Exception as e:
+        print(f"❌ Job {job['JobID']} ({job['Kind']}) failed:", e)
+        fail_job(job["JobID"], owner, job["Attempts"], job["MaxAttempts"], f"{type(e).__name__}: {e}")
+        return False
+
+    finally:
+        stop.set()
+
+def worker_loop(kinds=None, poll_seconds: float = 2.0, stop_event=None, once: bool = False):
+    """Claim and run jobs until stop_event is set (or the queue is empty, if once=True)."""
+    owner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    stop_event = stop_event or threading.Event()
+
+    while not stop_event.is_set():
+        try:
+            job = claim_job(owner, kinds)
+        except Exception as e:
+            print("❌ Job claim failed:", e)
+            job = None
+
+        if job:
+            run_job(job, owner)
+            continue
+
+        if once:
+            return
+        stop_event.wait(poll_seconds)
+
+def run_workers(concurrency: int = 1, kinds=None, poll_seconds: float = 2.0):
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(target=worker_loop, args=(kinds, poll_seconds, stop_event),
+                         name=f"job-worker-{i}", daemon=True)
+        for i in range(max(1, concurrency))
+    ]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(timeout=1)
+    except KeyboardInterrupt:
+        stop_event.set()
+
+# ---------------- Routes ----------------
+
+@jobs_bp.route("/api/jobs/<int:job_id>", methods=["GET"])
+@login_required
+def get_job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"ok": False, "error": "Job not found"}), 404
+    return jsonify({"ok": True, "job": job})
+
+@jobs_bp.route("/api/jobs", methods=["GET"])
+@login_required
+def list_jobs():
+    """GET /api/jobs?status=&kind=&mine=1&limit=50 — newest first."""
+    limit = max(1, min(200, request.args.get("limit", 50, type=int)))
+    where, params = [], {"Limit": limit}
+
+    status = (request.args.get("status") or "").upper()
+    if status:
+        where.append("Status = :Status")
+        params["Status"] = status
+
+    if request.args.get("kind"):
+        where.append("Kind = :Kind")
+        params["Kind"] = request.args["kind"]
+
+    if request.args.get("mine") == "1":
+        where.append("CreatedBy = :CreatedBy")
+        params["CreatedBy"] = session.get("username")
+
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    top, limit_sql = ("", "LIMIT :Limit") if _is_sqlite() else ("TOP (:Limit)", "")
+
+    with get_jobs_engine().connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT {top} JobID, Kind, Priority, Status, Attempts, MaxAttempts,
+                   Progress, Error, CreatedBy, CreatedAt, StartedAt, FinishedAt
+            FROM {_table()}
+            {where_sql}
+            ORDER BY JobID DESC
+            {limit_sql}
+        """), params).fetchall()
+
+    return jsonify({"ok": True, "jobs": [dict(r._mapping) for r in rows]})
+
+@jobs_bp.route("/api/jobs/<int:job_id>/cancel", methods=["POST"])
+@login_required
+def cancel_job_route(job_id):
+    if not cancel_job(job_id):
+        return jsonify({"ok": False, "error": "Only queued jobs can be cancelled"}), 409
+    return jsonify({"ok": True})
+
+# ---------------- CLI ----------------
+
+@jobs_bp.cli.command("work")
+@click.option("--concurrency", default=1, show_default=True, type=int)
+@click.option("--kind", "kinds", multiple=True, help="Only run these job kinds.")
+@click.option("--once", is_flag=True, help="Exit when the queue is empty.")
+def work_command(concurrency, kinds, once):
+    """Run queued jobs."""
+    click.echo(f"🧰 Job worker — {', '.join(kinds) or 'all kinds'} × {concurrency}")
+    if once:
+        worker_loop(list(kinds) or None, once=True)
+    else:
+        run_workers(concurrency, list(kinds) or None)
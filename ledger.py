@@ -1,10 +1,12 @@
 # ==============================================
 # 📘 ledger.py — Ledger Blueprint for Deep Blue Portal
 # ==============================================
-from flask import Blueprint, render_template, jsonify, request
+from flask import Blueprint, render_template, jsonify, request, session
 from sqlalchemy import text
 from sqlalchemy import inspect
 
+from case_outbox import record_case_change, wake_outbox_worker
+
 # Create the Blueprint
 ledger_bp = Blueprint('ledger_bp', __name__)
 
@@ -109,8 +111,11 @@ def update_ledger_item(case_id):
 
             with get_db_connection() as conn:
                 conn.execute(sql, data)
+                record_case_change(conn, case_id, update_fields, "UPDATE", session.get("username"))
                 conn.commit()
 
+            wake_outbox_worker()
+
             print(f"✅ Updated CaseID {case_id}")
             return jsonify({"success": True}), 200
 
@@ -132,8 +137,11 @@ def delete_ledger_item(case_id):
         try:
             with get_db_connection() as conn:
                 conn.execute(text("DELETE FROM dbo.Cases WHERE CaseID = :case_id"), {"case_id": case_id})
+                record_case_change(conn, case_id, (), "DELETE", session.get("username"))
                 conn.commit()
 
+            wake_outbox_worker()
+
             print(f"🗑 Deleted CaseID {case_id}")
             return jsonify({"success": True}), 200
 
@@ -181,7 +189,7 @@ def add_ledger_item():
 
             columns = ", ".join(data.keys())
             values = ", ".join([f":{k}" for k in data.keys()])
-            sql = text(f"INSERT INTO dbo.Cases ({columns}) VALUES ({values})")
+            sql = text(f"INSERT INTO dbo.Cases ({columns}) OUTPUT INSERTED.CaseID VALUES ({values})")
 
             with get_db_connection() as conn:
 
@@ -203,9 +211,12 @@ def add_ledger_item():
                 # --------------------------------------------------
                 # ➕ Insert new case
                 # --------------------------------------------------
-                conn.execute(sql, data)
+                new_id = conn.execute(sql, data).scalar()
+                record_case_change(conn, new_id, data.keys(), "INSERT", session.get("username"))
                 conn.commit()
 
+            wake_outbox_worker()
+
             print(f"✅ Added new ledger item {data.get('DeepBlueRef', '')}")
             return jsonify({"success": True}), 200
 
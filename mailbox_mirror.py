@@ -0,0 +1,631 @@
+# ============================================================
+# 🪞 mailbox_mirror.py — Local mirror of mailbox message metadata
+# ============================================================
+# The email pages (category summary, message list, attachment list) read
+# from a local SQLite copy of the mailbox instead of hitting Graph on every
+# request. The mirror holds message metadata only:
+#
+#   MirrorMessages      id, folder, subject, from, received, preview, link
+#   MirrorCategories    (message, category) — one row per tag
+#   MirrorAttachments   name / size / content type per message
+#   MirrorFolders       the folders being mirrored (id + display name)
+#   MirrorSyncState     Graph deltaLink per folder
+#   MirrorSyncLease     which process is syncing, and when the last sync ran
+#
+# Graph only offers message delta per folder, so by default every mail
+# folder (child folders included) is mirrored, matching the live
+# /messages queries the pages fall back to; folders that disappear are
+# dropped at the next sync. It is kept current with Graph delta queries:
+# the first sync pages the whole folder (optionally limited to MAILBOX_MIRROR_DAYS), later syncs
+# send the stored deltaLink and only receive changes — new messages,
+# re-categorised messages and deletions. Attachment lists aren't part of
+# delta, so they are fetched through $batch for new messages only.
+#
+# Reads never sync inline: a stale mirror starts a background sync and the
+# request is served from the last mirrored state. Every gunicorn worker
+# shares the SQLite file, so a sync (background, job or CLI) first claims
+# the MirrorSyncLease row — one sync at a time across processes, kept
+# alive by a heartbeat and taken over once it expires.
+#
+#   MAILBOX_MIRROR=0                       serve the email pages live from Graph
+#   MAILBOX_MIRROR_DB=path                 SQLite file (default mailbox_mirror.db)
+#   MAILBOX_MIRROR_FOLDERS=*               every folder; or a list of folder names
+#                                          (inbox,sentitems) — the pages then
+#                                          only see mail in those folders
+#   MAILBOX_MIRROR_MAX_AGE=60              seconds before a read triggers a delta sync
+#   MAILBOX_MIRROR_LEASE=300               seconds a sync lease lasts without a heartbeat
+#   flask --app app mailbox-mirror sync [--reset]
+# ============================================================
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint
+from sqlalchemy import create_engine, event, text, bindparam
+
+from graph_client import get_graph_client, MAILBOX
+from jobs import register_job
+
+mailbox_mirror_bp = Blueprint("mailbox_mirror_bp", __name__, cli_group="mailbox-mirror")
+
+MIRROR_ENABLED = os.getenv("MAILBOX_MIRROR", "1") != "0"
+MIRROR_DB = os.getenv("MAILBOX_MIRROR_DB", "mailbox_mirror.db")
+MIRROR_FOLDERS = [f.strip() for f in os.getenv("MAILBOX_MIRROR_FOLDERS", "*").split(",") if f.strip()]
+MIRROR_DAYS = int(os.getenv("MAILBOX_MIRROR_DAYS", "0"))  # 0 = whole folder
+MIRROR_MAX_AGE_SECONDS = float(os.getenv("MAILBOX_MIRROR_MAX_AGE", "60"))
+DELTA_PAGE_SIZE = 200
+ATTACHMENT_BATCH = 200  # messages per attachment backfill round (one commit each)
+SYNC_LEASE_SECONDS = float(os.getenv("MAILBOX_MIRROR_LEASE", "300"))
+
+MESSAGE_SELECT = "id,subject,from,receivedDateTime,categories,bodyPreview,webLink,hasAttachments"
+
+# ---------------- Storage ----------------
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS MirrorMessages (
+        MessageID         TEXT PRIMARY KEY,
+        Folder            TEXT NOT NULL,
+        Subject           TEXT NULL,
+        FromName          TEXT NULL,
+        FromAddress       TEXT NULL,
+        ReceivedDateTime  TEXT NULL,
+        BodyPreview       TEXT NULL,
+        WebLink           TEXT NULL,
+        HasAttachments    INTEGER NOT NULL DEFAULT 0,
+        AttachmentsSynced INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS IX_MirrorMessages_Received ON MirrorMessages (ReceivedDateTime DESC)",
+    """
+    CREATE TABLE IF NOT EXISTS MirrorCategories (
+        MessageID  TEXT NOT NULL,
+        Category   TEXT NOT NULL,
+        PRIMARY KEY (MessageID, Category)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS IX_MirrorCategories_Category ON MirrorCategories (Category, MessageID)",
+    """
+    CREATE TABLE IF NOT EXISTS MirrorAttachments (
+        MessageID     TEXT NOT NULL,
+        AttachmentID  TEXT NOT NULL,
+        Name          TEXT NULL,
+        Size          INTEGER NULL,
+        ContentType   TEXT NULL,
+        IsFile        INTEGER NOT NULL DEFAULT 1,
+        PRIMARY KEY (MessageID, AttachmentID)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS MirrorFolders (
+        Folder       TEXT PRIMARY KEY,
+        Mailbox      TEXT NOT NULL,
+        DisplayName  TEXT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS MirrorSyncState (
+        Folder      TEXT PRIMARY KEY,
+        Mailbox     TEXT NOT NULL,
+        DeltaLink   TEXT NULL,
+        LastSyncAt  REAL NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS MirrorSyncLease (
+        Name       TEXT PRIMARY KEY,
+        Owner      TEXT NULL,
+        ExpiresAt  REAL NOT NULL DEFAULT 0,
+        LastRunAt  REAL NOT NULL DEFAULT 0
+    )
+    """,
+    "INSERT OR IGNORE INTO MirrorSyncLease (Name) VALUES ('sync')",
+]
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_mirror_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            engine = create_engine(
+                f"sqlite:///{MIRROR_DB}",
+                connect_args={"check_same_thread": False, "timeout": 30},
+            )
+
+            @event.listens_for(engine, "connect")
+            def _pragmas(dbapi_conn, _):
+                cur = dbapi_conn.cursor()
+                cur.execute("PRAGMA journal_mode=WAL")
+                cur.execute("PRAGMA synchronous=NORMAL")
+                cur.close()
+
+            with engine.begin() as conn:
+                for ddl in SCHEMA:
+                    conn.execute(text(ddl))
+            _engine = engine
+    return _engine
+
+# ---------------- Applying delta pages ----------------
+
+def _message_row(msg, folder):
+    sender = (msg.get("from") or {}).get("emailAddress") or {}
+    return {
+        "MessageID": msg["id"],
+        "Folder": folder,
+        "Subject": msg.get("subject"),
+        "FromName": sender.get("name"),
+        "FromAddress": sender.get("address"),
+        "ReceivedDateTime": msg.get("receivedDateTime"),
+        "BodyPreview": msg.get("bodyPreview"),
+        "WebLink": msg.get("webLink"),
+        "HasAttachments": 1 if msg.get("hasAttachments") else 0,
+    }
+
+def _delete_messages(conn, message_ids, folder=None):
+    """Drop messages (and their categories / attachments); with `folder`, only rows still in it."""
+    message_ids = list(message_ids)
+    if folder is not None and message_ids:
+        # A move shows up as @removed in the old folder and new in the
+        # other; don't let the removal delete the moved copy.
+        message_ids = [r[0] for r in conn.execute(
+            text("SELECT MessageID FROM MirrorMessages WHERE Folder = :Folder AND MessageID IN :IDs")
+                .bindparams(bindparam("IDs", expanding=True)),
+            {"Folder": folder, "IDs": message_ids},
+        ).fetchall()]
+    if not message_ids:
+        return
+    for table in ("MirrorCategories", "MirrorAttachments", "MirrorMessages"):
+        conn.execute(
+            text(f"DELETE FROM {table} WHERE MessageID IN :IDs").bindparams(bindparam("IDs", expanding=True)),
+            {"IDs": message_ids},
+        )
+
+def apply_delta_page(conn, folder, items):
+    """Upsert / delete one page of delta items. Returns (upserted, removed)."""
+    removed = [m["id"] for m in items if "@removed" in m]
+    changed = [m for m in items if "@removed" not in m]
+
+    _delete_messages(conn, removed, folder)
+
+    if changed:
+        conn.execute(text("""
+            INSERT INTO MirrorMessages
+                (MessageID, Folder, Subject, FromName, FromAddress, ReceivedDateTime,
+                 BodyPreview, WebLink, HasAttachments, AttachmentsSynced)
+            VALUES
+                (:MessageID, :Folder, :Subject, :FromName, :FromAddress, :ReceivedDateTime,
+                 :BodyPreview, :WebLink, :HasAttachments, 0)
+            ON CONFLICT (MessageID) DO UPDATE SET
+                Folder = excluded.Folder,
+                Subject = excluded.Subject,
+                FromName = excluded.FromName,
+                FromAddress = excluded.FromAddress,
+                ReceivedDateTime = excluded.ReceivedDateTime,
+                BodyPreview = excluded.BodyPreview,
+                WebLink = excluded.WebLink,
+                HasAttachments = excluded.HasAttachments
+        """), [_message_row(m, folder) for m in changed])
+
+        # Delta items carry the full categories list: replace ours
+        conn.execute(
+            text("DELETE FROM MirrorCategories WHERE MessageID IN :IDs").bindparams(bindparam("IDs", expanding=True)),
+            {"IDs": [m["id"] for m in changed]},
+        )
+        cats = [
+            {"MessageID": m["id"], "Category": c}
+            for m in changed
+            for c in dict.fromkeys(m.get("categories") or [])
+        ]
+        if cats:
+            conn.execute(text("""
+                INSERT INTO MirrorCategories (MessageID, Category) VALUES (:MessageID, :Category)
+            """), cats)
+
+    return len(changed), len(removed)
+
+def sync_attachments(client=None, limit: int = ATTACHMENT_BATCH, skip=()):
+    """
+    Fetch attachment lists for up to `limit` messages that have attachments
+    but none mirrored yet (ids in `skip` excluded), and commit them. The
+    Graph calls run outside the write transaction. Returns (done, failed).
+    """
+    client = client or get_graph_client()
+    engine = get_mirror_engine()
+    skip = list(skip)
+    with engine.connect() as conn:
+        ids = [r[0] for r in conn.execute(text(f"""
+            SELECT MessageID FROM MirrorMessages
+            WHERE HasAttachments = 1 AND AttachmentsSynced = 0
+            {"AND MessageID NOT IN :Skip" if skip else ""}
+            LIMIT :Limit
+        """).bindparams(*([bindparam("Skip", expanding=True)] if skip else [])),
+            {"Limit": limit, **({"Skip": skip} if skip else {})}).fetchall()]
+    if not ids:
+        return [], []
+
+    results = client.batch([
+        {"method": "GET", "url": f"/users/{client.mailbox}/messages/{mid}/attachments?$select=id,name,size,contentType"}
+        for mid in ids
+    ])
+
+    rows, done, failed = [], [], []
+    for mid, r in zip(ids, results):
+        if r["status"] == 404:
+            done.append(mid)  # message gone; next delta removes it
+            continue
+        if r["status"] != 200:
+            print(f"[WARN] Mirror: attachments for {mid} failed: {r['status']}")
+            failed.append(mid)
+            continue
+        done.append(mid)
+        for a in (r["body"] or {}).get("value", []):
+            rows.append({
+                "MessageID": mid,
+                "AttachmentID": a["id"],
+                "Name": a.get("name"),
+                "Size": a.get("size"),
+                "ContentType": a.get("contentType"),
+                "IsFile": 0 if "@odata.type" in a and "fileAttachment" not in a["@odata.type"] else 1,
+            })
+
+    if not done:
+        return done, failed
+
+    with engine.begin() as conn:
+        conn.execute(
+            text("DELETE FROM MirrorAttachments WHERE MessageID IN :IDs").bindparams(bindparam("IDs", expanding=True)),
+            {"IDs": done},
+        )
+        if rows:
+            conn.execute(text("""
+                INSERT INTO MirrorAttachments (MessageID, AttachmentID, Name, Size, ContentType, IsFile)
+                VALUES (:MessageID, :AttachmentID, :Name, :Size, :ContentType, :IsFile)
+            """), rows)
+        conn.execute(
+            text("UPDATE MirrorMessages SET AttachmentsSynced = 1 WHERE MessageID IN :IDs")
+                .bindparams(bindparam("IDs", expanding=True)),
+            {"IDs": done},
+        )
+    return done, failed
+
+# ---------------- Sync ----------------
+
+def list_folders(client=None):
+    """{folder: display name} to mirror — every mail folder (recursively) unless MAILBOX_MIRROR_FOLDERS lists names."""
+    client = client or get_graph_client()
+    if MIRROR_FOLDERS != ["*"]:
+        return {f: f for f in MIRROR_FOLDERS}
+
+    folders = {}
+    pending = [client.mailbox_url("mailFolders?$select=id,displayName,childFolderCount&$top=100")]
+    while pending:
+        for page in client.iter_pages(pending.pop()):
+            for f in page:
+                folders[f["id"]] = f.get("displayName")
+                if f.get("childFolderCount"):
+                    pending.append(client.mailbox_url(
+                        f"mailFolders/{f['id']}/childFolders?$select=id,displayName,childFolderCount&$top=100"
+                    ))
+    return folders
+
+def _record_folders(client, folders):
+    """Store the mirrored folder set; forget folders (and their messages) no longer in it."""
+    with get_mirror_engine().begin() as conn:
+        known = [r[0] for r in conn.execute(text("SELECT Folder FROM MirrorFolders")).fetchall()]
+        gone = [f for f in known if f not in folders]
+        for folder in gone:
+            ids = [r[0] for r in conn.execute(
+                text("SELECT MessageID FROM MirrorMessages WHERE Folder = :Folder"), {"Folder": folder}
+            ).fetchall()]
+            _delete_messages(conn, ids)
+            conn.execute(text("DELETE FROM MirrorSyncState WHERE Folder = :Folder"), {"Folder": folder})
+            conn.execute(text("DELETE FROM MirrorFolders WHERE Folder = :Folder"), {"Folder": folder})
+
+        conn.execute(text("""
+            INSERT INTO MirrorFolders (Folder, Mailbox, DisplayName)
+            VALUES (:Folder, :Mailbox, :DisplayName)
+            ON CONFLICT (Folder) DO UPDATE SET
+                Mailbox = excluded.Mailbox,
+                DisplayName = excluded.DisplayName
+        """), [
+            {"Folder": f, "Mailbox": client.mailbox, "DisplayName": name}
+            for f, name in folders.items()
+        ])
+
+def _initial_delta_url(client, folder):
+    url = client.mailbox_url(f"mailFolders/{folder}/messages/delta?$select={MESSAGE_SELECT}")
+    if MIRROR_DAYS:
+        since = (datetime.utcnow() - timedelta(days=MIRROR_DAYS)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        url += f"&$filter=receivedDateTime ge {since}"
+    return url
+
+def sync_folder(folder, client=None, reset: bool = False):
+    """Run one delta round for a folder. Returns {"upserted", "removed", "initial"}."""
+    client = client or get_graph_client()
+    engine = get_mirror_engine()
+
+    with engine.connect() as conn:
+        state = conn.execute(text("""
+            SELECT DeltaLink, Mailbox FROM MirrorSyncState WHERE Folder = :Folder
+        """), {"Folder": folder}).fetchone()
+
+    initial = reset or state is None or not state.DeltaLink or state.Mailbox != client.mailbox
+    if initial:
+        with engine.begin() as conn:
+            ids = [r[0] for r in conn.execute(
+                text("SELECT MessageID FROM MirrorMessages WHERE Folder = :Folder"), {"Folder": folder}
+            ).fetchall()]
+            _delete_messages(conn, ids)
+        url = _initial_delta_url(client, folder)
+    else:
+        url = state.DeltaLink
+
+    headers = {"Prefer": f"odata.maxpagesize={DELTA_PAGE_SIZE}"}
+    upserted = removed = 0
+
+    while url:
+        resp = client.get(url, headers=headers)
+        if resp.status_code == 410 and not initial:
+            # Delta token expired / sync reset: start over
+            print(f"⚠️ Mirror: delta for {folder} reset by Graph, resyncing")
+            return sync_folder(folder, client, reset=True)
+        resp.raise_for_status()
+        data = resp.json()
+
+        with engine.begin() as conn:
+            u, r = apply_delta_page(conn, folder, data.get("value", []))
+            upserted += u
+            removed += r
+
+            delta_link = data.get("@odata.deltaLink")
+            if delta_link:
+                conn.execute(text("""
+                    INSERT INTO MirrorSyncState (Folder, Mailbox, DeltaLink, LastSyncAt)
+                    VALUES (:Folder, :Mailbox, :DeltaLink, :Now)
+                    ON CONFLICT (Folder) DO UPDATE SET
+                        Mailbox = excluded.Mailbox,
+                        DeltaLink = excluded.DeltaLink,
+                        LastSyncAt = excluded.LastSyncAt
+                """), {"Folder": folder, "Mailbox": client.mailbox, "DeltaLink": delta_link, "Now": time.time()})
+
+        url = data.get("@odata.nextLink")
+
+    return {"upserted": upserted, "removed": removed, "initial": initial}
+
+def sync_mirror(client=None, reset: bool = False):
+    """
+    Delta-sync every mirrored folder, then fill in missing attachment lists.
+    Doesn't take the sync lease; go through run_sync() unless you hold it.
+    """
+    client = client or get_graph_client()
+    folders = list_folders(client)
+    if folders:
+        _record_folders(client, folders)
+    stats = {name or folder: sync_folder(folder, client, reset) for folder, name in folders.items()}
+
+    # One commit per round; messages that failed are retried on the next sync
+    attachments, failed = 0, []
+    while True:
+        done, round_failed = sync_attachments(client, skip=failed)
+        attachments += len(done)
+        failed += round_failed
+        if not done and not round_failed:
+            break
+
+    return {"folders": stats, "attachments": attachments}
+
+# ---------------- Sync lease ----------------
+
+def _claim_lease(owner, max_age: float):
+    """Take the sync lease if it is free (or expired) and the last sync started over `max_age` seconds ago."""
+    now = time.time()
+    with get_mirror_engine().begin() as conn:
+        res = conn.execute(text("""
+            UPDATE MirrorSyncLease
+            SET Owner = :Owner, ExpiresAt = :Expires, LastRunAt = :Now
+            WHERE Name = 'sync'
+              AND (Owner IS NULL OR ExpiresAt < :Now)
+              AND LastRunAt <= :Now - :MaxAge
+        """), {"Owner": owner, "Expires": now + SYNC_LEASE_SECONDS, "Now": now, "MaxAge": max_age})
+    return res.rowcount == 1
+
+def _renew_lease(owner):
+    with get_mirror_engine().begin() as conn:
+        conn.execute(text("""
+            UPDATE MirrorSyncLease SET ExpiresAt = :Expires
+            WHERE Name = 'sync' AND Owner = :Owner
+        """), {"Owner": owner, "Expires": time.time() + SYNC_LEASE_SECONDS})
+
+def _release_lease(owner):
+    with get_mirror_engine().begin() as conn:
+        conn.execute(text("""
+            UPDATE MirrorSyncLease SET Owner = NULL, ExpiresAt = 0
+            WHERE Name = 'sync' AND Owner = :Owner
+        """), {"Owner": owner})
+
+def run_sync(client=None, reset: bool = False, max_age: float = 0):
+    """
+    sync_mirror() under the cross-process sync lease. Returns None without
+    syncing when another process holds the lease, or when a sync started
+    less than `max_age` seconds ago.
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    if not _claim_lease(owner, max_age):
+        return None
+
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(SYNC_LEASE_SECONDS / 3):
+            try:
+                _renew_lease(owner)
+            except Exception as e:
+                print("⚠️ Mailbox mirror lease heartbeat failed:", e)
+
+    hb = threading.Thread(target=beat, name="mailbox-mirror-heartbeat", daemon=True)
+    hb.start()
+    try:
+        return sync_mirror(client, reset)
+    finally:
+        stop.set()
+        hb.join()
+        _release_lease(owner)
+
+_sync_lock = threading.Lock()
+_last_check = 0.0
+_ready = False
+
+def mirror_enabled():
+    return MIRROR_ENABLED and bool(MAILBOX)
+
+def mirror_ready():
+    """True once every mirrored folder has completed a full sync for this mailbox."""
+    global _ready
+    if not _ready:
+        with get_mirror_engine().connect() as conn:
+            rows = conn.execute(text("""
+                SELECT f.Folder, s.DeltaLink
+                FROM MirrorFolders f
+                LEFT JOIN MirrorSyncState s
+                    ON s.Folder = f.Folder
+                   AND s.Mailbox = f.Mailbox
+                WHERE f.Mailbox = :Mailbox
+            """), {"Mailbox": MAILBOX}).fetchall()
+        _ready = bool(rows) and all(r.DeltaLink for r in rows)
+    return _ready
+
+def _sync_in_background(max_age: float = 0):
+    if not _sync_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            run_sync(max_age=max_age)
+        except Exception as e:
+            print("❌ Mailbox mirror sync failed:", e)
+        finally:
+            _sync_lock.release()
+
+    threading.Thread(target=run, name="mailbox-mirror-sync", daemon=True).start()
+
+def ensure_fresh(max_age: float = MIRROR_MAX_AGE_SECONDS):
+    """
+    Returns True when the mirror can serve reads. Until the first full sync
+    has finished it starts one in the background and returns False (callers
+    go to Graph). Afterwards a stale mirror gets a background delta round
+    and the request reads the last mirrored state; the sync lease keeps it
+    to one sync per `max_age` across all processes.
+    """
+    global _last_check
+    if not mirror_enabled():
+        return False
+
+    if not mirror_ready():
+        _sync_in_background()
+        return False
+
+    if time.monotonic() - _last_check >= max_age:
+        _last_check = time.monotonic()
+        _sync_in_background(max_age)
+    return True
+
+# ---------------- Local writes ----------------
+
+def add_category(message_ids, category):
+    """Reflect a tagging PATCH right away (the next delta confirms it)."""
+    rows = [{"MessageID": mid, "Category": category} for mid in message_ids]
+    if not rows:
+        return
+    with get_mirror_engine().begin() as conn:
+        conn.execute(text("""
+            INSERT OR IGNORE INTO MirrorCategories (MessageID, Category)
+            SELECT :MessageID, :Category
+            WHERE EXISTS (SELECT 1 FROM MirrorMessages WHERE MessageID = :MessageID)
+        """), rows)
+
+# ---------------- Queries ----------------
+
+def category_summaries(categories):
+    """{category: {"email_count", "attachment_count"}} in one grouped query."""
+    categories = list(dict.fromkeys(categories))
+    out = {c: {"email_count": 0, "attachment_count": 0} for c in categories}
+    if not categories:
+        return out
+
+    with get_mirror_engine().connect() as conn:
+        rows = conn.execute(text("""
+            SELECT
+                mc.Category,
+                COUNT(DISTINCT mc.MessageID) AS EmailCount,
+                COUNT(ma.AttachmentID) AS AttachmentCount
+            FROM MirrorCategories mc
+            LEFT JOIN MirrorAttachments ma
+                ON ma.MessageID = mc.MessageID
+               AND ma.IsFile = 1
+            WHERE mc.Category IN :Categories
+            GROUP BY mc.Category
+        """).bindparams(bindparam("Categories", expanding=True)), {"Categories": categories}).fetchall()
+
+    for r in rows:
+        out[r.Category] = {"email_count": int(r.EmailCount or 0), "attachment_count": int(r.AttachmentCount or 0)}
+    return out
+
+def category_summary(category):
+    return category_summaries([category])[category]
+
+def category_messages(category, offset: int, limit: int):
+    with get_mirror_engine().connect() as conn:
+        rows = conn.execute(text("""
+            SELECT m.MessageID, m.Subject, m.FromName, m.FromAddress,
+                   m.ReceivedDateTime, m.WebLink
+            FROM MirrorCategories mc
+            JOIN MirrorMessages m
+                ON m.MessageID = mc.MessageID
+            WHERE mc.Category = :Category
+            ORDER BY m.ReceivedDateTime DESC, m.MessageID
+            LIMIT :Limit OFFSET :Offset
+        """), {"Category": category, "Limit": limit, "Offset": offset}).fetchall()
+    return [dict(r._mapping) for r in rows]
+
+def category_attachments(category, offset: int, limit: int):
+    with get_mirror_engine().connect() as conn:
+        rows = conn.execute(text("""
+            SELECT m.MessageID, m.FromAddress, m.WebLink,
+                   ma.AttachmentID, ma.Name, ma.Size, ma.ContentType
+            FROM MirrorCategories mc
+            JOIN MirrorMessages m
+                ON m.MessageID = mc.MessageID
+            JOIN MirrorAttachments ma
+                ON ma.MessageID = mc.MessageID
+               AND ma.IsFile = 1
+            WHERE mc.Category = :Category
+            ORDER BY m.ReceivedDateTime DESC, m.MessageID, ma.AttachmentID
+            LIMIT :Limit OFFSET :Offset
+        """), {"Category": category, "Limit": limit, "Offset": offset}).fetchall()
+    return [dict(r._mapping) for r in rows]
+
+# ---------------- Jobs / CLI ----------------
+
+@register_job("email.mirror_sync")
+def mirror_sync_job(payload, ctx):
+    res = run_sync(reset=bool(payload.get("reset")))
+    return res if res is not None else {"skipped": "another mirror sync is running"}
+
+@mailbox_mirror_bp.cli.command("sync")
+@click.option("--reset", is_flag=True, help="Drop the delta tokens and re-read every folder.")
+def sync_command(reset):
+    """Delta-sync the local mailbox mirror."""
+    res = run_sync(reset=reset)
+    if res is None:
+        click.echo("⏳ Another process is syncing the mirror; try again when it finishes.")
+        return
+    for folder, s in res["folders"].items():
+        click.echo(f"📁 {folder}: {s['upserted']} upserted, {s['removed']} removed"
+                   f"{' (full sync)' if s['initial'] else ''}")
+    click.echo(f"📎 {res['attachments']} attachment lists fetched")
@@ -0,0 +1,252 @@
+# ==============================================
+# 📦 notice_batch.py — Bulk notice generation for due todos
+# ==============================================
+# Same output as /api/timebars/todos/<id>/generate, for every todo that
+# matches a filter (due window, charterer, notice type). Todos are read
+# in keyset pages with their case + notice type joined in, templates are
+# compiled at their current dbo.Templates Version (looked up once per
+# template per request), and the response is streamed:
+#
+#   format=zip     (default) one .eml / .txt per notice + _skipped.txt
+#   format=ndjson  one JSON object per line
+#
+# Nothing is buffered beyond the current page / ZIP entry.
+# ==============================================
+import json
+import re
+import zipfile
+from datetime import datetime
+from email.message import EmailMessage
+from email.policy import SMTP
+
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from sqlalchemy import text
+
+from utils import get_db_connection, login_required
+from timebars import build_notice_context, parse_date
+from template_engine import load_compiled
+
+notice_batch_bp = Blueprint("notice_batch_bp", __name__)
+
+PAGE_SIZE = 1000
+
+# ---------------- Loading ----------------
+
+def iter_notice_todos(conn, filters, page_size: int = PAGE_SIZE):
+    """Yield pages of todo rows (with case / notice type), ordered by TodoID."""
+    sql = """
+        SELECT TOP (:PageSize)
+            t.TodoID,
+            t.CaseID,
+            t.Title,
+            t.DueDate,
+            COALESCE(t.TemplateID, nt.TemplateID) AS TemplateID,
+            cn.CaseNoticeID,
+            cn.ExpiryDate,
+            nt.NoticeTypeID,
+            nt.Name AS NoticeTypeName,
+            c.VesselName,
+            c.CharterersName AS ChartererName,
+            c.VoyageEndDate,
+            c.DeepBlueRef
+        FROM dbo.CaseTodos t
+        LEFT JOIN dbo.CaseNotices cn
+            ON cn.CaseNoticeID = t.RelatedEntityID
+           AND t.RelatedEntityType = 'CaseNotice'
+        LEFT JOIN dbo.NoticeTypes nt
+            ON nt.NoticeTypeID = cn.NoticeTypeID
+        LEFT JOIN dbo.Cases c
+            ON c.CaseID = t.CaseID
+        WHERE t.Status = :Status
+          AND t.Type = :Type
+          AND t.TodoID > :After
+    """
+    params = {
+        "PageSize": page_size,
+        "Status": filters["status"],
+        "Type": filters["type"],
+    }
+
+    if filters.get("due_from"):
+        sql += " AND t.DueDate >= :DueFrom"
+        params["DueFrom"] = filters["due_from"]
+
+    if filters.get("due_to"):
+        sql += " AND t.DueDate <= :DueTo"
+        params["DueTo"] = filters["due_to"]
+
+    if filters.get("charterer"):
+        sql += " AND c.CharterersName = :Charterer"
+        params["Charterer"] = filters["charterer"]
+
+    if filters.get("notice_type_id"):
+        sql += " AND cn.NoticeTypeID = :NoticeTypeID"
+        params["NoticeTypeID"] = filters["notice_type_id"]
+
+    sql += " ORDER BY t.TodoID ASC"
+
+    after = 0
+    while True:
+        rows = conn.execute(text(sql), {**params, "After": after}).fetchall()
+        if not rows:
+            return
+        yield [dict(r._mapping) for r in rows]
+        if len(rows) < page_size:
+            return
+        after = rows[-1]._mapping["TodoID"]
+
+def render_notices(conn, filters, org_id: int):
+    """
+    Yield (row, subject, body, error) per matching todo. A todo that can't
+    be rendered (missing or broken template) comes back with its error
+    instead of ending the stream.
+    """
+    today = datetime.utcnow().date()
+    compiled = {}  # TemplateID -> CompiledTemplate | error string, for this request
+
+    for page in iter_notice_todos(conn, filters):
+        for r in page:
+            if not r["TemplateID"]:
+                yield r, None, None, "No template linked"
+                continue
+
+            if r["TemplateID"] not in compiled:
+                try:
+                    compiled[r["TemplateID"]] = load_compiled(conn, r["TemplateID"], org_id) or "Template not found"
+                except Exception as e:
+                    compiled[r["TemplateID"]] = f"Template failed to compile: {e}"
+            tpl = compiled[r["TemplateID"]]
+            if isinstance(tpl, str):
+                yield r, None, None, tpl
+                continue
+
+            try:
+                subject, body = tpl.render(build_notice_context(r, today=today))
+            except Exception as e:
+                yield r, None, None, f"Render failed: {e}"
+                continue
+            yield r, subject, body, None
+
+# ---------------- Output ----------------
+
+class _StreamBuffer:
+    """Write-only, unseekable sink for ZipFile; drained after every entry."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def _safe_name(value):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", str(value or "")).strip("_") or "notice"
+
+def notice_filename(row, ext):
+    ref = row.get("DeepBlueRef") or f"Case{row['CaseID']}"
+    return f"{_safe_name(ref)}_{_safe_name(row.get('NoticeTypeName'))}_{row['TodoID']}.{ext}"
+
+def as_eml(subject, body):
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["X-Unsent"] = "1"  # Outlook opens it as a draft
+    msg.set_content(body)
+    return msg.as_bytes(policy=SMTP)
+
+def stream_zip(notices, file_type="eml"):
+    buf = _StreamBuffer()
+    skipped = []
+
+    with zipfile.ZipFile(buf, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for row, subject, body, error in notices:
+            if not error:
+                try:
+                    if file_type == "eml":
+                        data = as_eml(subject, body)
+                    else:
+                        data = f"Subject: {subject}\n\n{body}".encode("utf-8")
+                except Exception as e:
+                    # e.g. a rendered subject containing CR / LF
+                    error = f"Could not build {file_type}: {e}"
+
+            if error:
+                skipped.append(f"{row['TodoID']}\t{row.get('DeepBlueRef') or row['CaseID']}\t{error}")
+                continue
+
+            zf.writestr(notice_filename(row, file_type), data)
+            yield buf.drain()
+
+        if skipped:
+            zf.writestr("_skipped.txt", "TodoID\tCase\tReason\n" + "\n".join(skipped) + "\n")
+
+    yield buf.drain()
+
+def stream_ndjson(notices):
+    for row, subject, body, error in notices:
+        item = {
+            "TodoID": row["TodoID"],
+            "CaseID": row["CaseID"],
+            "CaseRef": row.get("DeepBlueRef"),
+            "NoticeTypeName": row.get("NoticeTypeName"),
+            "DueDate": parse_date(row["DueDate"]).isoformat() if row.get("DueDate") else None,
+        }
+        if error:
+            item.update({"ok": False, "error": error})
+        else:
+            item.update({"ok": True, "subject": subject, "body": body})
+        yield json.dumps(item, default=str) + "\n"
+
+# ---------------- Routes ----------------
+
+@notice_batch_bp.route("/api/timebars/notices/generate", methods=["GET"])
+@login_required
+def generate_notices_bulk():
+    """
+    GET /api/timebars/notices/generate?due_from=&due_to=&charterer=&notice_type_id=
+        [&status=OPEN][&type=TIMEBAR_REMINDER][&format=zip|ndjson][&file_type=eml|txt]
+    """
+    org_id = 1  # TODO: replace with session org later
+
+    try:
+        filters = {
+            "due_from": parse_date(request.args.get("due_from")),
+            "due_to": parse_date(request.args.get("due_to")),
+            "charterer": (request.args.get("charterer") or "").strip() or None,
+            "notice_type_id": request.args.get("notice_type_id", type=int),
+            "status": (request.args.get("status") or "OPEN").upper(),
+            "type": request.args.get("type") or "TIMEBAR_REMINDER",
+        }
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid due_from / due_to"}), 400
+
+    fmt = (request.args.get("format") or "zip").lower()
+    file_type = (request.args.get("file_type") or "eml").lower()
+
+    if fmt not in ("zip", "ndjson") or file_type not in ("eml", "txt"):
+        return jsonify({"ok": False, "error": "format must be zip|ndjson, file_type eml|txt"}), 400
+
+    def generate():
+        with get_db_connection() as conn:
+            notices = render_notices(conn, filters, org_id)
+            if fmt == "ndjson":
+                yield from stream_ndjson(notices)
+            else:
+                yield from stream_zip(notices, file_type)
+
+    if fmt == "ndjson":
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    filename = f"notices_{datetime.utcnow():%Y%m%d_%H%M%S}.zip"
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
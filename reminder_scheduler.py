@@ -0,0 +1,347 @@
+# ==============================================
+# ⏰ reminder_scheduler.py — Fire TIMEBAR_REMINDER todos when due
+# ==============================================
+# Open, un-notified reminders are held in a min-heap keyed by due time.
+# The scheduler thread sleeps on a condition until the earliest item is
+# due (or a change is pushed in) — no polling of dbo.CaseTodos.
+#
+# Changes arrive from recalc via timebars.register_recalc_listener. Heap
+# entries are never removed in place: the current due time per TodoID
+# lives in a dict and stale heap entries are dropped when popped.
+#
+# Firing claims rows with an UPDATE ... WHERE NotifiedAt IS NULL, so
+# several gunicorn workers (or a restart) never fire the same reminder
+# twice, and anything dismissed / done since it was queued is skipped.
+#
+# Reminders more than REMINDER_MAX_OVERDUE_DAYS past due are never fired,
+# so enabling the scheduler doesn't send the whole historic backlog at
+# once; they stay open todos on the case.
+#
+#   REMINDER_SCHEDULER_ENABLED=1   start inside the web app
+#   REMINDER_ACTION=log|email_digest
+#   REMINDER_MAX_OVERDUE_DAYS=7    past-due cutoff (empty = fire everything)
+#   flask --app app reminders run  run standalone
+# ==============================================
+import heapq
+import os
+import threading
+from datetime import datetime, time as dtime
+
+import click
+from flask import Blueprint, jsonify
+from sqlalchemy import text, bindparam
+
+from utils import get_db_connection, login_required
+from timebars import register_recalc_listener, chunked
+
+reminder_scheduler_bp = Blueprint("reminder_scheduler_bp", __name__, cli_group="reminders")
+
+LOAD_PAGE_SIZE = 5000
+FIRE_BATCH_SIZE = 500
+
+# ---------------- Actions ----------------
+
+REMINDER_ACTIONS = {}
+
+def register_reminder_action(name: str):
+    def decorator(fn):
+        REMINDER_ACTIONS[name] = fn
+        return fn
+    return decorator
+
+@register_reminder_action("log")
+def log_action(reminders):
+    for r in reminders:
+        print(f"⏰ Reminder due — Case {r['CaseID']} · {r['Title']} (due {r['DueDate']})")
+
+@register_reminder_action("email_digest")
+def email_digest_action(reminders):
+    """Send one digest email (via Graph, from MAILBOX) per firing batch."""
+    to = os.getenv("REMINDER_DIGEST_TO")
+    if not to or not reminders:
+        return log_action(reminders)
+
+    from email_rules import send_mail
+
+    by_case = {}
+    for r in reminders:
+        by_case.setdefault(r["CaseID"], []).append(r)
+
+    lines = []
+    for case_id, items in sorted(by_case.items()):
+        ref = items[0].get("DeepBlueRef") or f"Case {case_id}"
+        lines.append(f"{ref} — {items[0].get('VesselName') or ''}")
+        for r in items:
+            lines.append(f"  • {r['Title']} (due {r['DueDate']})")
+        lines.append("")
+
+    send_mail(
+        to=[a.strip() for a in to.split(",") if a.strip()],
+        subject=f"Timebar reminders due — {len(reminders)} item(s)",
+        body="\n".join(lines),
+    )
+
+# ---------------- Scheduler ----------------
+
+class ReminderScheduler:
+
+    def __init__(self, action=None, due_hour_utc: int = 0, resync_seconds: int = 3600,
+                 max_overdue_days: int = None):
+        self.action = action or REMINDER_ACTIONS["log"]
+        self.due_hour_utc = due_hour_utc
+        self.resync_seconds = resync_seconds
+        self.max_overdue_days = max_overdue_days
+
+        self._heap = []          # (due_at, TodoID)
+        self._due = {}           # TodoID -> due_at (authoritative)
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._last_sync = None
+
+    # ---- loading / changes ----
+
+    def _due_at(self, due_date):
+        if isinstance(due_date, datetime):
+            due_date = due_date.date()
+        return datetime.combine(due_date, dtime(hour=self.due_hour_utc))
+
+    def _cutoff_sql(self, alias=""):
+        """WHERE fragment skipping reminders past the overdue cutoff ('' without one)."""
+        if self.max_overdue_days is None:
+            return ""
+        return f"AND {alias}DueDate >= DATEADD(day, -:MaxOverdueDays, CAST(SYSUTCDATETIME() AS DATE))"
+
+    def load(self):
+        """(Re)build the heap from every open, un-notified reminder within the overdue cutoff."""
+        due = {}
+        after = 0
+
+        with get_db_connection() as conn:
+            while True:
+                rows = conn.execute(text(f"""
+                    SELECT TOP (:PageSize) TodoID, DueDate
+                    FROM dbo.CaseTodos
+                    WHERE Type = 'TIMEBAR_REMINDER'
+                      AND Status = 'OPEN'
+                      AND NotifiedAt IS NULL
+                      AND DueDate IS NOT NULL
+                      {self._cutoff_sql()}
+                      AND TodoID > :After
+                    ORDER BY TodoID ASC
+                """), {"PageSize": LOAD_PAGE_SIZE, "After": after,
+                       "MaxOverdueDays": self.max_overdue_days}).fetchall()
+
+                if not rows:
+                    break
+
+                for todo_id, due_date in rows:
+                    due[todo_id] = self._due_at(due_date)
+                after = rows[-1][0]
+
+        heap = [(d, tid) for tid, d in due.items()]
+        heapq.heapify(heap)
+
+        with self._cond:
+            self._due = due
+            self._heap = heap
+            self._last_sync = datetime.utcnow()
+            self._cond.notify()
+
+        return len(due)
+
+    def apply_changes(self, upserted=(), dismissed=()):
+        with self._cond:
+            for todo_id in dismissed:
+                self._due.pop(todo_id, None)
+
+            for todo_id, due_date in upserted:
+                if due_date is None:
+                    self._due.pop(todo_id, None)
+                    continue
+                due_at = self._due_at(due_date)
+                if self._due.get(todo_id) != due_at:
+                    self._due[todo_id] = due_at
+                    heapq.heappush(self._heap, (due_at, todo_id))
+
+            self._cond.notify()
+
+    def on_recalc(self, result):
+        reminders = result.get("reminders") or {}
+        self.apply_changes(reminders.get("upserted", ()), reminders.get("dismissed", ()))
+
+    # ---- run loop ----
+
+    def _pop_due(self, now):
+        """Pop every live entry due at or before now. Caller holds the lock."""
+        ready = []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, todo_id = heapq.heappop(self._heap)
+            if self._due.get(todo_id) == due_at:
+                del self._due[todo_id]
+                ready.append(todo_id)
+        return ready
+
+    def _next_wait(self, now):
+        """Seconds until the next live entry. Caller holds the lock."""
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)  # stale
+        if not self._heap:
+            return None
+        return max(0.0, (self._heap[0][0] - now).total_seconds())
+
+    def run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+
+                now = datetime.utcnow()
+                ready = self._pop_due(now)
+
+                if not ready:
+                    wait = self._next_wait(now)
+                    until_resync = self.resync_seconds - (now - self._last_sync).total_seconds()
+                    if until_resync <= 0:
+                        wait = 0
+                    elif wait is None or wait > until_resync:
+                        wait = until_resync
+
+                    if wait > 0:
+                        self._cond.wait(timeout=wait)
+                        continue
+
+            if ready:
+                self._fire(ready)
+            else:
+                self._safe_load()
+
+    def _safe_load(self):
+        try:
+            self.load()
+        except Exception as e:
+            print("❌ Reminder scheduler reload failed:", e)
+            with self._cond:
+                self._last_sync = datetime.utcnow()
+
+    def _fire(self, todo_ids):
+        for batch in chunked(todo_ids, FIRE_BATCH_SIZE):
+            try:
+                with get_db_connection() as conn:
+                    rows = conn.execute(text(f"""
+                        UPDATE t
+                        SET NotifiedAt = SYSUTCDATETIME()
+                        OUTPUT inserted.TodoID, inserted.CaseID, inserted.Title,
+                               inserted.DueDate, inserted.TemplateID,
+                               inserted.RelatedEntityID AS CaseNoticeID
+                        FROM dbo.CaseTodos t
+                        WHERE t.TodoID IN :TodoIDs
+                          AND t.Type = 'TIMEBAR_REMINDER'
+                          AND t.Status = 'OPEN'
+                          AND t.NotifiedAt IS NULL
+                          AND t.DueDate <= CAST(SYSUTCDATETIME() AS DATE)
+                          {self._cutoff_sql("t.")}
+                    """).bindparams(bindparam("TodoIDs", expanding=True)),
+                        {"TodoIDs": list(batch), "MaxOverdueDays": self.max_overdue_days}).fetchall()
+
+                    claimed = [dict(r._mapping) for r in rows]
+
+                    if claimed:
+                        cases = conn.execute(text("""
+                            SELECT CaseID, DeepBlueRef, VesselName
+                            FROM dbo.Cases
+                            WHERE CaseID IN :CaseIDs
+                        """).bindparams(bindparam("CaseIDs", expanding=True)),
+                            {"CaseIDs": sorted({r["CaseID"] for r in claimed})}).fetchall()
+                        case_map = {c._mapping["CaseID"]: dict(c._mapping) for c in cases}
+                        for r in claimed:
+                            r.update({k: v for k, v in case_map.get(r["CaseID"], {}).items() if k != "CaseID"})
+
+                    conn.commit()
+
+                if claimed:
+                    try:
+                        self.action(claimed)
+                    except Exception:
+                        self._release([r["TodoID"] for r in claimed])
+                        raise
+
+            except Exception as e:
+                print("❌ Reminder firing failed:", e)
+
+    def _release(self, todo_ids):
+        """Un-claim after a failed action so the next resync picks them up again."""
+        with get_db_connection() as conn:
+            conn.execute(text("""
+                UPDATE dbo.CaseTodos
+                SET NotifiedAt = NULL
+                WHERE TodoID IN :TodoIDs
+            """).bindparams(bindparam("TodoIDs", expanding=True)), {"TodoIDs": list(todo_ids)})
+            conn.commit()
+
+    # ---- lifecycle ----
+
+    def start(self):
+        self._safe_load()
+        register_recalc_listener(self.on_recalc)
+        self._thread = threading.Thread(target=self.run, name="reminder-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def status(self):
+        with self._cond:
+            wait = self._next_wait(datetime.utcnow())
+            return {
+                "pending": len(self._due),
+                "heap_size": len(self._heap),
+                "next_due_in_seconds": wait,
+                "last_sync": self._last_sync.isoformat() if self._last_sync else None,
+                "running": bool(self._thread and self._thread.is_alive()),
+            }
+
+# ---------------- Singleton ----------------
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def start_reminder_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            action_name = os.getenv("REMINDER_ACTION", "log")
+            max_overdue = os.getenv("REMINDER_MAX_OVERDUE_DAYS", "7").strip()
+            _scheduler = ReminderScheduler(
+                action=REMINDER_ACTIONS.get(action_name, log_action),
+                due_hour_utc=int(os.getenv("REMINDER_DUE_HOUR_UTC", "0")),
+                max_overdue_days=int(max_overdue) if max_overdue else None,
+            ).start()
+    return _scheduler
+
+def get_reminder_scheduler():
+    return _scheduler
+
+# ---------------- Routes ----------------
+
+@reminder_scheduler_bp.route("/api/timebars/reminder-scheduler", methods=["GET"])
+@login_required
+def reminder_scheduler_status():
+    if _scheduler is None:
+        return jsonify({"ok": True, "running": False})
+    return jsonify({"ok": True, **_scheduler.status()})
+
+# ---------------- CLI ----------------
+
+@reminder_scheduler_bp.cli.command("run")
+def run_reminders_command():
+    """Run the reminder scheduler in the foreground."""
+    scheduler = start_reminder_scheduler()
+    click.echo(f"⏰ Reminder scheduler running — {scheduler.status()['pending']} pending")
+    try:
+        scheduler._thread.join()
+    except KeyboardInterrupt:
+        scheduler.stop()
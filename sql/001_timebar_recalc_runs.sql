@@ -0,0 +1,35 @@
+-- ==============================================
+-- 🔁 Bulk timebar recalc runs (timebar_recalc.py)
+-- ==============================================
+
+IF OBJECT_ID('dbo.TimebarRecalcRuns', 'U') IS NULL
+BEGIN
+    CREATE TABLE dbo.TimebarRecalcRuns (
+        RunID               INT IDENTITY(1,1) NOT NULL PRIMARY KEY,
+        OrgID               INT NOT NULL,
+        NoticeTypeID        INT NULL,
+        Status              NVARCHAR(20) NOT NULL,   -- PENDING | RUNNING | COMPLETED | FAILED
+        TotalCases          INT NOT NULL DEFAULT 0,
+        ProcessedCases      INT NOT NULL DEFAULT 0,
+        LastCaseID          INT NOT NULL DEFAULT 0,  -- resume checkpoint
+        BatchSize           INT NOT NULL DEFAULT 250,
+        Workers             INT NOT NULL DEFAULT 4,
+        SnapshotsRefreshed  BIT NOT NULL DEFAULT 0,
+        Error               NVARCHAR(4000) NULL,
+        RequestedBy         NVARCHAR(255) NULL,
+        CreatedAt           DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+        StartedAt           DATETIME2 NULL,
+        FinishedAt          DATETIME2 NULL,
+        UpdatedAt           DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+    );
+END
+GO
+
+-- Batched recalc reads notices by case and merges todos on (CaseID, Type, MetaKey)
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_CaseNotices_CaseID' AND object_id = OBJECT_ID('dbo.CaseNotices'))
+    CREATE INDEX IX_CaseNotices_CaseID ON dbo.CaseNotices (CaseID) INCLUDE (NoticeTypeID, IsEnabled);
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_CaseTodos_Case_Type_MetaKey' AND object_id = OBJECT_ID('dbo.CaseTodos'))
+    CREATE INDEX IX_CaseTodos_Case_Type_MetaKey ON dbo.CaseTodos (CaseID, Type, MetaKey) INCLUDE (Status);
+GO
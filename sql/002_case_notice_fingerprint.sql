@@ -0,0 +1,9 @@
+-- ==============================================
+-- 🧮 Incremental recalc: per-notice input fingerprint
+-- ==============================================
+-- SHA-256 (hex) of VoyageEndDate, TimebarDaysSnapshot, ReminderOffsetsSnapshot,
+-- IsEnabled, resolved TemplateID and notice type name. NULL forces a recalc.
+
+IF COL_LENGTH('dbo.CaseNotices', 'InputFingerprint') IS NULL
+    ALTER TABLE dbo.CaseNotices ADD InputFingerprint CHAR(64) NULL;
+GO
@@ -0,0 +1,15 @@
+-- ==============================================
+-- ⏰ Reminder scheduler: fire-once marker on CaseTodos
+-- ==============================================
+
+IF COL_LENGTH('dbo.CaseTodos', 'NotifiedAt') IS NULL
+    ALTER TABLE dbo.CaseTodos ADD NotifiedAt DATETIME2 NULL;
+GO
+
+-- Scheduler (re)load: open, un-notified reminders
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_CaseTodos_PendingReminders' AND object_id = OBJECT_ID('dbo.CaseTodos'))
+    CREATE INDEX IX_CaseTodos_PendingReminders
+        ON dbo.CaseTodos (TodoID)
+        INCLUDE (DueDate)
+        WHERE Type = 'TIMEBAR_REMINDER' AND Status = 'OPEN' AND NotifiedAt IS NULL;
+GO
@@ -0,0 +1,46 @@
+-- ==============================================
+-- 📆 Indexed view: enabled notices with a computed expiry (expiry_index.py)
+-- ==============================================
+-- SQL Server keeps the clustered index in step with every write to the
+-- base tables, so the view never needs an application-side refresh.
+
+IF OBJECT_ID('dbo.vTimebarExpiries', 'V') IS NULL
+    EXEC('
+    CREATE VIEW dbo.vTimebarExpiries
+    WITH SCHEMABINDING
+    AS
+    SELECT
+        cn.CaseNoticeID,
+        cn.CaseID,
+        cn.NoticeTypeID,
+        nt.OrgID,
+        nt.Name AS NoticeTypeName,
+        cn.ExpiryDate,
+        c.DeepBlueRef,
+        c.VesselName,
+        c.CharterersName
+    FROM dbo.CaseNotices cn
+    JOIN dbo.NoticeTypes nt ON nt.NoticeTypeID = cn.NoticeTypeID
+    JOIN dbo.Cases c ON c.CaseID = cn.CaseID
+    WHERE cn.ExpiryDate IS NOT NULL
+      AND cn.IsEnabled = 1
+    ');
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'UX_vTimebarExpiries' AND object_id = OBJECT_ID('dbo.vTimebarExpiries'))
+    CREATE UNIQUE CLUSTERED INDEX UX_vTimebarExpiries
+        ON dbo.vTimebarExpiries (CaseNoticeID);
+GO
+
+-- Range scans + keyset pagination
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_vTimebarExpiries_Expiry' AND object_id = OBJECT_ID('dbo.vTimebarExpiries'))
+    CREATE INDEX IX_vTimebarExpiries_Expiry
+        ON dbo.vTimebarExpiries (ExpiryDate, CaseNoticeID)
+        INCLUDE (CaseID, NoticeTypeID, OrgID);
+GO
+
+-- Dirty-case refresh from recalc
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_vTimebarExpiries_Case' AND object_id = OBJECT_ID('dbo.vTimebarExpiries'))
+    CREATE INDEX IX_vTimebarExpiries_Case
+        ON dbo.vTimebarExpiries (CaseID);
+GO
@@ -0,0 +1,24 @@
+-- ==============================================
+-- 📋 Global todos API: paging + aggregate counts (timebars.get_todos / get_todo_counts)
+-- ==============================================
+
+-- /api/todos?status=&type=&due_from=&due_to= ordered by (DueDate, TodoID)
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_CaseTodos_Status_Due' AND object_id = OBJECT_ID('dbo.CaseTodos'))
+    CREATE INDEX IX_CaseTodos_Status_Due
+        ON dbo.CaseTodos (Status, DueDate, TodoID)
+        INCLUDE (CaseID, Type, Title, RelatedEntityType, RelatedEntityID, TemplateID, MetaKey);
+GO
+
+-- Same with a Type filter, and the per-Type GROUPING SETS counts
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_CaseTodos_Status_Type_Due' AND object_id = OBJECT_ID('dbo.CaseTodos'))
+    CREATE INDEX IX_CaseTodos_Status_Type_Due
+        ON dbo.CaseTodos (Status, Type, DueDate, TodoID)
+        INCLUDE (CaseID);
+GO
+
+-- case_id filter (+ per-case todos panel)
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_CaseTodos_Case_Status_Due' AND object_id = OBJECT_ID('dbo.CaseTodos'))
+    CREATE INDEX IX_CaseTodos_Case_Status_Due
+        ON dbo.CaseTodos (CaseID, Status, DueDate, TodoID)
+        INCLUDE (Type);
+GO
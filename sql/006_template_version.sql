@@ -0,0 +1,9 @@
+-- ==============================================
+-- 🧩 Template version for the compiled-template cache (template_engine.py)
+-- ==============================================
+-- Bumped by templates.update_template / delete_template.
+
+IF COL_LENGTH('dbo.Templates', 'Version') IS NULL
+    ALTER TABLE dbo.Templates ADD Version INT NOT NULL
+        CONSTRAINT DF_Templates_Version DEFAULT 1;
+GO
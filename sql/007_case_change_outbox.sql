@@ -0,0 +1,29 @@
+-- ==============================================
+-- 📮 Case change outbox (case_outbox.py)
+-- ==============================================
+-- Written in the same transaction as every dbo.Cases insert / update /
+-- delete; drained by the outbox worker, which runs the timebar recalc.
+
+IF OBJECT_ID('dbo.CaseChangeOutbox', 'U') IS NULL
+BEGIN
+    CREATE TABLE dbo.CaseChangeOutbox (
+        OutboxID        BIGINT IDENTITY(1,1) PRIMARY KEY,
+        CaseID          INT NOT NULL,
+        Operation       VARCHAR(10) NOT NULL,       -- INSERT / UPDATE / DELETE
+        ChangedColumns  NVARCHAR(MAX) NULL,         -- comma-separated
+        ChangedBy       NVARCHAR(200) NULL,
+        CreatedAt       DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+        Attempts        INT NOT NULL DEFAULT 0,
+        Error           NVARCHAR(4000) NULL,
+        ProcessedAt     DATETIME2 NULL
+    );
+END
+GO
+
+-- Drainer: oldest pending first
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_CaseChangeOutbox_Pending' AND object_id = OBJECT_ID('dbo.CaseChangeOutbox'))
+    CREATE INDEX IX_CaseChangeOutbox_Pending
+        ON dbo.CaseChangeOutbox (OutboxID)
+        INCLUDE (CaseID, Operation, ChangedColumns, Attempts)
+        WHERE ProcessedAt IS NULL;
+GO
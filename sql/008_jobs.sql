@@ -0,0 +1,38 @@
+-- ==============================================
+-- 🧰 Background job queue (jobs.py / worker.py)
+-- ==============================================
+-- One row per queued job. Workers lease rows with READPAST + UPDLOCK;
+-- an expired LeaseExpiresAt makes a RUNNING job claimable again.
+
+IF OBJECT_ID('dbo.Jobs', 'U') IS NULL
+BEGIN
+    CREATE TABLE dbo.Jobs (
+        JobID           BIGINT IDENTITY(1,1) PRIMARY KEY,
+        Kind            VARCHAR(100) NOT NULL,
+        Payload         NVARCHAR(MAX) NULL,         -- JSON
+        Priority        INT NOT NULL DEFAULT 0,     -- higher runs first
+        Status          VARCHAR(20) NOT NULL DEFAULT 'QUEUED',  -- QUEUED / RUNNING / SUCCEEDED / FAILED / CANCELLED
+        Attempts        INT NOT NULL DEFAULT 0,
+        MaxAttempts     INT NOT NULL DEFAULT 3,
+        RunAfter        DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+        LeaseOwner      NVARCHAR(200) NULL,
+        LeaseExpiresAt  DATETIME2 NULL,
+        Progress        NVARCHAR(4000) NULL,
+        Result          NVARCHAR(MAX) NULL,         -- JSON
+        Error           NVARCHAR(4000) NULL,
+        CreatedBy       NVARCHAR(200) NULL,
+        CreatedAt       DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+        StartedAt       DATETIME2 NULL,
+        FinishedAt      DATETIME2 NULL,
+        UpdatedAt       DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+    );
+END
+GO
+
+-- Claim: next due job by priority
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Jobs_Claim' AND object_id = OBJECT_ID('dbo.Jobs'))
+    CREATE INDEX IX_Jobs_Claim
+        ON dbo.Jobs (Status, Priority DESC, RunAfter)
+        INCLUDE (Kind, LeaseExpiresAt)
+        WHERE Status IN ('QUEUED', 'RUNNING');
+GO
@@ -224,13 +224,42 @@ document.addEventListener("click", (e) => {
 
 /* ============================================================
    LOAD SUMMARY
+   One /api/summaries request for every card on the page, fetched
+   on first expand; cards missing from it fall back to /api/summary.
 ============================================================ */
+let summariesPromise = null;
+
+function loadAllSummaries() {
+  if (!summariesPromise) {
+    const categories = [...document.querySelectorAll(".card")]
+      .map(getCategoryNameFromCard)
+      .filter(Boolean);
+
+    summariesPromise = fetch("/email/api/summaries", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ categories }),
+    })
+      .then((res) => (res.ok ? res.json() : {}))
+      .then((data) => data.summaries || {})
+      .catch((err) => {
+        console.error("Summaries error:", err);
+        return {};
+      });
+  }
+  return summariesPromise;
+}
+
 async function loadCategorySummary(card, categoryName) {
   try {
-    const res = await fetch(`/email/api/summary?category=${encodeURIComponent(categoryName)}`);
-    if (!res.ok) return;
+    let data = (await loadAllSummaries())[categoryName];
+
+    if (!data || data.email_count == null) {
+      const res = await fetch(`/email/api/summary?category=${encodeURIComponent(categoryName)}`);
+      if (!res.ok) return;
+      data = await res.json();
+    }
 
-    const data = await res.json();
     card.querySelector(".count-badge[data-count-type='emails']").textContent =
       data.email_count ?? "0";
     card.querySelector(".count-badge[data-count-type='attachments']").textContent =
@@ -0,0 +1,117 @@
+# ==============================================
+# 📚 template_catalog.py — Cached Templates / Assignments / NoticeTypes
+# ==============================================
+# These tables are small and change rarely, but recalc and the notice
+# type screens read them on every request. The catalog loads every active
+# row once (three queries on the caller's connection) and serves lookups
+# from memory. Template bodies for rendering and for the editor are read
+# from dbo.Templates instead (template_engine.load_compiled), since this
+# cache is per process and can lag a save made on another worker:
+#
+#   templates      TemplateID -> row (incl. Subject / Body / Version)
+#   assignments    (OrgID, AssignmentKey) -> TemplateID
+#   notice types   NoticeTypeID -> row with ReminderOffsetsResolved
+#                  (NoticeTypes.ReminderOffsets, else OrgSettings default)
+#
+# Write routes in templates.py call invalidate_catalog(); the TTL covers
+# writes made by other workers or directly in the database.
+# ==============================================
+import os
+import threading
+import time
+
+from sqlalchemy import text
+
+TEMPLATE_CATALOG_TTL_SECONDS = int(os.getenv("TEMPLATE_CATALOG_TTL_SECONDS", "120"))
+
+class TemplateCatalog:
+
+    def __init__(self, templates, assignments, notice_types):
+        self.templates = templates
+        self.assignments = assignments
+        self.notice_types = notice_types
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls, conn):
+        templates = {
+            r._mapping["TemplateID"]: dict(r._mapping)
+            for r in conn.execute(text("""
+                SELECT TemplateID, OrgID, Name, Category, Subject, Body,
+                       Version, CreatedAt, IsActive
+                FROM dbo.Templates
+                WHERE IsActive = 1
+            """)).fetchall()
+        }
+
+        assignments = {}
+        for r in conn.execute(text("""
+            SELECT AssignmentID, OrgID, AssignmentKey, TemplateID
+            FROM dbo.TemplateAssignments
+            WHERE IsActive = 1
+            ORDER BY AssignmentID ASC
+        """)).fetchall():
+            m = r._mapping
+            assignments.setdefault((m["OrgID"], m["AssignmentKey"]), m["TemplateID"])
+
+        notice_types = {
+            r._mapping["NoticeTypeID"]: dict(r._mapping)
+            for r in conn.execute(text("""
+                SELECT nt.NoticeTypeID, nt.OrgID, nt.Name, nt.TimebarDays,
+                       nt.ReminderOffsets, nt.TemplateID, nt.IsActive,
+                       COALESCE(nt.ReminderOffsets, os.DefaultReminderOffsets) AS ReminderOffsetsResolved
+                FROM dbo.NoticeTypes nt
+                LEFT JOIN dbo.OrgSettings os
+                    ON os.OrgID = nt.OrgID
+                WHERE nt.IsActive = 1
+            """)).fetchall()
+        }
+
+        return cls(templates, assignments, notice_types)
+
+    # ---- lookups ----
+
+    def active_templates(self):
+        return sorted(self.templates.values(), key=lambda t: (t["Name"] or "", t["TemplateID"]))
+
+    def template(self, template_id, org_id=None):
+        t = self.templates.get(int(template_id)) if template_id else None
+        if t is None or (org_id is not None and t["OrgID"] != org_id):
+            return None
+        return t
+
+    def assigned_template_id(self, key: str, org_id: int):
+        return self.assignments.get((org_id, key))
+
+    def notice_type(self, notice_type_id, org_id=None):
+        nt = self.notice_types.get(int(notice_type_id)) if notice_type_id else None
+        if nt is None or (org_id is not None and nt["OrgID"] != org_id):
+            return None
+        return nt
+
+    def notice_types_for_org(self, org_id: int):
+        rows = [nt for nt in self.notice_types.values() if nt["OrgID"] == org_id]
+        return sorted(rows, key=lambda nt: nt["Name"] or "")
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog(conn, ttl_seconds: int = TEMPLATE_CATALOG_TTL_SECONDS):
+    """Current catalog, (re)loaded on `conn` when missing or older than the TTL."""
+    global _catalog
+
+    catalog = _catalog
+    if catalog is not None and time.monotonic() - catalog.loaded_at < ttl_seconds:
+        return catalog
+
+    with _catalog_lock:
+        catalog = _catalog
+        if catalog is None or time.monotonic() - catalog.loaded_at >= ttl_seconds:
+            catalog = TemplateCatalog.load(conn)
+            _catalog = catalog
+    return catalog
+
+def invalidate_catalog(*_):
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
@@ -0,0 +1,177 @@
+# ==============================================
+# 🧩 template_engine.py — Compiled {{Token}} templates for notices
+# ==============================================
+# A template is parsed once into a flat tuple that alternates literal
+# text and token slots, so rendering is a single join instead of one
+# str.replace pass per context key. Compiled templates are cached by
+# (TemplateID, Version); templates.update_template bumps Version.
+# load_compiled() reads the current Version from dbo.Templates on every
+# call (the per-process template catalog can lag a save made by another
+# worker), so a saved template renders on the next request.
+# ==============================================
+import re
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+TOKEN_RE = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+
+# Tokens generate_notice_from_todo / bulk generation can fill
+KNOWN_TOKENS = (
+    "VesselName",
+    "ChartererName",
+    "VoyageEndDate",
+    "TimebarExpiryDate",
+    "NoticeTypeName",
+    "Today",
+    "CaseRef",
+)
+
+COMPILED_CACHE_SIZE = 512
+
+# ---------------- Compile / render ----------------
+
+class CompiledText:
+    """parts[0::2] are literals, parts[1::2] are token names; raw keeps the source spelling."""
+
+    __slots__ = ("parts", "raw", "tokens")
+
+    def __init__(self, source: str):
+        source = source or ""
+        parts, raw = [], []
+        pos = 0
+        for m in TOKEN_RE.finditer(source):
+            parts.append(source[pos:m.start()])
+            parts.append(m.group(1))
+            raw.append(m.group(0))
+            pos = m.end()
+        parts.append(source[pos:])
+
+        self.parts = tuple(parts)
+        self.raw = tuple(raw)
+        self.tokens = frozenset(parts[1::2])
+
+    def render(self, context: dict) -> str:
+        parts = self.parts
+        if len(parts) == 1:
+            return parts[0]
+
+        out = list(parts)
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            if name in context:
+                value = context[name]
+                out[i] = str(value or "")
+            else:
+                out[i] = self.raw[i // 2]  # leave unknown tokens visible
+        return "".join(out)
+
+class CompiledTemplate:
+
+    __slots__ = ("template_id", "version", "name", "subject", "body")
+
+    def __init__(self, subject: str, body: str, template_id=None, version=None, name=None):
+        self.template_id = template_id
+        self.version = version
+        self.name = name
+        self.subject = CompiledText(subject)
+        self.body = CompiledText(body)
+
+    @property
+    def tokens(self):
+        return self.subject.tokens | self.body.tokens
+
+    def render(self, context: dict):
+        return self.subject.render(context), self.body.render(context)
+
+# ---------------- Validation ----------------
+
+def validate_template(subject: str, body: str, known=KNOWN_TOKENS):
+    """
+    Save-time report: tokens we can't fill, and '{{' / '}}' that don't form a
+    valid token (typos like '{{Vessel Name}}' or a missing brace).
+    """
+    compiled = CompiledTemplate(subject, body)
+    unknown = sorted(compiled.tokens - set(known))
+
+    malformed = []
+    for text in (subject or "", body or ""):
+        stripped = TOKEN_RE.sub("", text)
+        for m in re.finditer(r"\{\{[^{}]{0,40}\}?\}?|\}\}", stripped):
+            malformed.append(m.group(0))
+
+    return {
+        "unknown_tokens": unknown,
+        "malformed": malformed,
+        "tokens": sorted(compiled.tokens),
+    }
+
+# ---------------- Cache ----------------
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def get_compiled(template_id: int, version, loader):
+    """
+    Compiled template for (TemplateID, Version). `loader()` is only called on a
+    miss and must return a mapping with Subject, Body (and optionally Name),
+    or None if the template doesn't exist.
+    """
+    key = (int(template_id), version)
+
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            return hit
+
+    row = loader()
+    if row is None:
+        return None
+
+    compiled = CompiledTemplate(
+        row.get("Subject"), row.get("Body"),
+        template_id=int(template_id), version=version, name=row.get("Name"),
+    )
+
+    with _cache_lock:
+        _cache[key] = compiled
+        _cache.move_to_end(key)
+        while len(_cache) > COMPILED_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return compiled
+
+def load_compiled(conn, template_id: int, org_id=None):
+    """
+    Compiled template at its current Version in dbo.Templates, or None when
+    it doesn't exist, is inactive or belongs to another org. One small
+    query per call; Subject / Body are only read on a cache miss.
+    """
+    row = conn.execute(text("""
+        SELECT Version, OrgID
+        FROM dbo.Templates
+        WHERE TemplateID = :id AND IsActive = 1
+    """), {"id": int(template_id)}).fetchone()
+
+    if row is None or (org_id is not None and row._mapping["OrgID"] != org_id):
+        return None
+
+    def loader():
+        full = conn.execute(text("""
+            SELECT Name, Subject, Body
+            FROM dbo.Templates
+            WHERE TemplateID = :id
+        """), {"id": int(template_id)}).fetchone()
+        return dict(full._mapping) if full else None
+
+    return get_compiled(template_id, row._mapping["Version"], loader)
+
+def invalidate_compiled(template_id=None):
+    with _cache_lock:
+        if template_id is None:
+            _cache.clear()
+            return
+        for key in [k for k in _cache if k[0] == int(template_id)]:
+            del _cache[key]
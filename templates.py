@@ -5,9 +5,16 @@
 from flask import Blueprint, request, jsonify
 from sqlalchemy import text
 
+from template_engine import validate_template, invalidate_compiled
+from template_catalog import invalidate_catalog
+
 
 templates_bp = Blueprint("templates_bp", __name__)
 
+# The editor reads straight from dbo.Templates: the template catalog is
+# per process, so under several gunicorn workers a cached body could be
+# up to a TTL behind a save made on another worker.
+
 
 # =========================================================
 # GET ALL TEMPLATES
@@ -86,6 +93,8 @@ def create_template():
         if not body:
             return jsonify({"success": False, "error": "Body required"}), 400
 
+        token_report = validate_template(subject, body)
+
         try:
 
             with get_db_connection() as conn:
@@ -106,9 +115,12 @@ def create_template():
 
                 conn.commit()
 
+            invalidate_catalog()
+
             return jsonify({
                 "success": True,
-                "TemplateID": int(row[0])
+                "TemplateID": int(row[0]),
+                "tokens": token_report
             })
 
         except Exception as e:
@@ -174,6 +186,13 @@ def update_template(template_id):
         if not sets:
             return jsonify({"success": False, "error": "Nothing to update"}), 400
 
+        # Compiled-template cache is keyed on (TemplateID, Version)
+        sets.append("Version = Version + 1")
+
+        token_report = None
+        if subject is not None or body is not None:
+            token_report = validate_template(subject, body)
+
         try:
 
             sql = f"""
@@ -191,7 +210,10 @@ def update_template(template_id):
             if rc == 0:
                 return jsonify({"success": False, "error": "Template not found"}), 404
 
-            return jsonify({"success": True})
+            invalidate_compiled(template_id)
+            invalidate_catalog()
+
+            return jsonify({"success": True, "tokens": token_report})
 
         except Exception as e:
 
@@ -225,7 +247,8 @@ def delete_template(template_id):
 
                 rc = conn.execute(text("""
                     UPDATE dbo.Templates
-                    SET IsActive = 0
+                    SET IsActive = 0,
+                        Version = Version + 1
                     WHERE TemplateID = :TemplateID
                     AND OrgID = :OrgID
                 """), {
@@ -238,6 +261,9 @@ def delete_template(template_id):
             if rc == 0:
                 return jsonify({"success": False, "error": "Template not found"}), 404
 
+            invalidate_compiled(template_id)
+            invalidate_catalog()
+
             return jsonify({"success": True})
 
         except Exception as e:
@@ -310,6 +336,8 @@ def clone_template(template_id):
 
                 conn.commit()
 
+            invalidate_catalog()
+
             return jsonify({
                 "success": True,
                 "TemplateID": int(row[0])
@@ -456,6 +484,8 @@ def update_template_assignment(assignment_id):
 
             conn.commit()
 
+        invalidate_catalog()
+
         return jsonify({"success": True})
 
     return inner()
\ No newline at end of file
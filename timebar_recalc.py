@@ -0,0 +1,318 @@
+# ==============================================
+# 🔁 timebar_recalc.py — Portfolio-wide bulk timebar recalc
+# ==============================================
+# Refreshes CaseNotices snapshots after a NoticeTypes.TimebarDays or
+# OrgSettings.DefaultReminderOffsets change, then re-runs the set-based
+# recalc for every affected case in batches on a worker pool.
+#
+# Progress is checkpointed in dbo.TimebarRecalcRuns (see sql/) so an
+# interrupted run resumes after the last fully-committed CaseID. Starting
+# or resuming claims the run with a conditional UPDATE, so only one
+# executor works on it; a RUNNING run can only be taken over once it has
+# not checkpointed for RUN_STALE_MINUTES (its process died).
+#
+#   flask --app app timebars recalc-all --org-id 1 [--notice-type-id 3]
+#   flask --app app timebars recalc-all --resume 42
+# ==============================================
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import click
+from flask import Blueprint, request, jsonify, session
+from sqlalchemy import text
+
+from utils import get_db_connection, login_required
+from timebars import commit_and_notify, recalc_cases_timebars, chunked, DEFAULT_REMINDER_OFFSETS
+from template_catalog import invalidate_catalog
+
+timebar_recalc_bp = Blueprint("timebar_recalc_bp", __name__, cli_group="timebars")
+
+DEFAULT_BATCH_SIZE = 250
+DEFAULT_WORKERS = 4
+RUN_STALE_MINUTES = 30
+
+class RecalcRunBusy(Exception):
+    pass
+
+# ---------------- Helpers ----------------
+
+def refresh_notice_snapshots(conn, org_id: int, notice_type_id=None):
+    """
+    Push current NoticeTypes.TimebarDays / resolved reminder offsets into
+    CaseNotices snapshots in one statement. Returns the number of rows changed.
+    """
+    sql = """
+        UPDATE cn
+        SET TimebarDaysSnapshot = nt.TimebarDays,
+            ReminderOffsetsSnapshot = src.Offsets,
+            UpdatedAt = SYSUTCDATETIME()
+        FROM dbo.CaseNotices cn
+        JOIN dbo.NoticeTypes nt
+            ON nt.NoticeTypeID = cn.NoticeTypeID
+        LEFT JOIN dbo.OrgSettings os
+            ON os.OrgID = nt.OrgID
+        CROSS APPLY (
+            SELECT COALESCE(nt.ReminderOffsets, os.DefaultReminderOffsets, :DefaultOffsets) AS Offsets
+        ) src
+        WHERE nt.OrgID = :OrgID
+          AND (
+                cn.TimebarDaysSnapshot IS NULL
+                OR cn.TimebarDaysSnapshot <> nt.TimebarDays
+                OR cn.ReminderOffsetsSnapshot IS NULL
+                OR cn.ReminderOffsetsSnapshot <> src.Offsets
+          )
+    """
+    params = {"OrgID": org_id, "DefaultOffsets": DEFAULT_REMINDER_OFFSETS}
+
+    if notice_type_id:
+        sql += " AND cn.NoticeTypeID = :NoticeTypeID"
+        params["NoticeTypeID"] = notice_type_id
+
+    return conn.execute(text(sql), params).rowcount
+
+def affected_case_ids(conn, org_id: int, notice_type_id=None, after_case_id: int = 0):
+    sql = """
+        SELECT DISTINCT cn.CaseID
+        FROM dbo.CaseNotices cn
+        JOIN dbo.NoticeTypes nt
+            ON nt.NoticeTypeID = cn.NoticeTypeID
+        WHERE nt.OrgID = :OrgID
+          AND cn.CaseID > :After
+    """
+    params = {"OrgID": org_id, "After": after_case_id or 0}
+
+    if notice_type_id:
+        sql += " AND cn.NoticeTypeID = :NoticeTypeID"
+        params["NoticeTypeID"] = notice_type_id
+
+    sql += " ORDER BY cn.CaseID ASC"
+
+    return [r[0] for r in conn.execute(text(sql), params).fetchall()]
+
+def load_run(conn, run_id: int):
+    row = conn.execute(text("""
+        SELECT RunID, OrgID, NoticeTypeID, Status, TotalCases, ProcessedCases,
+               LastCaseID, BatchSize, Workers, SnapshotsRefreshed, Error,
+               RequestedBy, CreatedAt, StartedAt, FinishedAt, UpdatedAt
+        FROM dbo.TimebarRecalcRuns
+        WHERE RunID = :RunID
+    """), {"RunID": run_id}).fetchone()
+    return dict(row._mapping) if row else None
+
+def create_run(org_id: int, notice_type_id=None, batch_size: int = DEFAULT_BATCH_SIZE,
+               workers: int = DEFAULT_WORKERS, requested_by=None):
+    with get_db_connection() as conn:
+        row = conn.execute(text("""
+            INSERT INTO dbo.TimebarRecalcRuns
+                (OrgID, NoticeTypeID, Status, TotalCases, ProcessedCases,
+                 LastCaseID, BatchSize, Workers, RequestedBy)
+            OUTPUT INSERTED.RunID
+            VALUES
+                (:OrgID, :NoticeTypeID, 'PENDING', 0, 0, 0, :BatchSize, :Workers, :RequestedBy)
+        """), {
+            "OrgID": org_id,
+            "NoticeTypeID": notice_type_id,
+            "BatchSize": batch_size,
+            "Workers": workers,
+            "RequestedBy": requested_by,
+        }).fetchone()
+        conn.commit()
+
+    return int(row[0])
+
+def _update_run(run_id: int, **fields):
+    sets = ", ".join(f"{k} = :{k}" for k in fields)
+    with get_db_connection() as conn:
+        conn.execute(text(f"""
+            UPDATE dbo.TimebarRecalcRuns
+            SET {sets}, UpdatedAt = SYSUTCDATETIME()
+            WHERE RunID = :RunID
+        """), {**fields, "RunID": run_id})
+        conn.commit()
+
+def claim_run(run_id: int):
+    """
+    Mark a run RUNNING if nobody is executing it: PENDING or FAILED, or
+    RUNNING without a checkpoint for RUN_STALE_MINUTES. Returns False otherwise.
+    """
+    with get_db_connection() as conn:
+        row = conn.execute(text("""
+            UPDATE dbo.TimebarRecalcRuns
+            SET Status = 'RUNNING',
+                Error = NULL,
+                StartedAt = COALESCE(StartedAt, SYSUTCDATETIME()),
+                UpdatedAt = SYSUTCDATETIME()
+            OUTPUT inserted.RunID
+            WHERE RunID = :RunID
+              AND (Status IN ('PENDING', 'FAILED')
+                   OR (Status = 'RUNNING'
+                       AND UpdatedAt < DATEADD(MINUTE, -:StaleMinutes, SYSUTCDATETIME())))
+        """), {"RunID": run_id, "StaleMinutes": RUN_STALE_MINUTES}).fetchone()
+        conn.commit()
+    return row is not None
+
+def _recalc_batch(case_ids, org_id: int):
+    with get_db_connection() as conn:
+        res = recalc_cases_timebars(conn, case_ids, org_id)
+        commit_and_notify(conn)
+    return res
+
+def execute_run(run_id: int, progress=None, claimed: bool = False):
+    """
+    Run (or resume) a bulk recalc. Batches go to a thread pool, each with its
+    own connection + transaction; the checkpoint only advances over a
+    contiguous prefix of committed batches so a resume never skips a case.
+    claimed=True when the caller already holds the run via claim_run().
+    """
+    with get_db_connection() as conn:
+        run = load_run(conn, run_id)
+
+    if not run:
+        raise ValueError(f"Recalc run {run_id} not found")
+
+    if run["Status"] == "COMPLETED":
+        return run
+
+    if not claimed:
+        if not claim_run(run_id):
+            raise RecalcRunBusy(f"Recalc run {run_id} is already running")
+        with get_db_connection() as conn:
+            run = load_run(conn, run_id)
+
+    org_id = run["OrgID"]
+    notice_type_id = run["NoticeTypeID"]
+    batch_size = int(run["BatchSize"] or DEFAULT_BATCH_SIZE)
+    workers = int(run["Workers"] or DEFAULT_WORKERS)
+    last_case_id = int(run["LastCaseID"] or 0)
+    processed = int(run["ProcessedCases"] or 0)
+
+    # A run follows a NoticeTypes / OrgSettings change — don't recalc against cached rows
+    invalidate_catalog()
+
+    try:
+        with get_db_connection() as conn:
+            if not run["SnapshotsRefreshed"]:
+                changed = refresh_notice_snapshots(conn, org_id, notice_type_id)
+                conn.commit()
+                if progress:
+                    progress(f"Refreshed {changed} notice snapshots")
+
+            remaining = affected_case_ids(conn, org_id, notice_type_id, last_case_id)
+
+        total = processed + len(remaining)
+        _update_run(run_id, SnapshotsRefreshed=1, TotalCases=total)
+
+        batches = list(chunked(remaining, batch_size))
+        done = [False] * len(batches)
+        next_checkpoint = 0
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_recalc_batch, batch, org_id): idx
+                for idx, batch in enumerate(batches)
+            }
+
+            for fut in as_completed(futures):
+                idx = futures[fut]
+                fut.result()
+
+                done[idx] = True
+                advanced = False
+                while next_checkpoint < len(batches) and done[next_checkpoint]:
+                    processed += len(batches[next_checkpoint])
+                    last_case_id = batches[next_checkpoint][-1]
+                    next_checkpoint += 1
+                    advanced = True
+
+                if advanced:
+                    _update_run(run_id, ProcessedCases=processed, LastCaseID=last_case_id)
+                    if progress:
+                        progress(f"{processed}/{total} cases")
+
+        _update_run(run_id, Status="COMPLETED", FinishedAt=datetime.utcnow())
+
+    except Exception as e:
+        print(f"❌ Timebar recalc run {run_id} failed:", e)
+        _update_run(run_id, Status="FAILED", Error=str(e)[:4000])
+        raise
+
+    with get_db_connection() as conn:
+        return load_run(conn, run_id)
+
+def start_run_in_background(run_id: int, claimed: bool = False):
+    def target():
+        try:
+            execute_run(run_id, claimed=claimed)
+        except Exception:
+            pass  # recorded on the run row
+
+    t = threading.Thread(target=target, name=f"timebar-recalc-{run_id}", daemon=True)
+    t.start()
+    return t
+
+# ---------------- Routes ----------------
+
+@timebar_recalc_bp.route("/api/timebars/recalc-runs", methods=["POST"])
+@login_required
+def create_recalc_run():
+    payload = request.get_json(silent=True) or {}
+
+    org_id = int(payload.get("OrgID", 1))
+    notice_type_id = payload.get("NoticeTypeID")
+    notice_type_id = int(notice_type_id) if notice_type_id else None
+    batch_size = max(1, min(1000, int(payload.get("BatchSize", DEFAULT_BATCH_SIZE))))
+    workers = max(1, min(16, int(payload.get("Workers", DEFAULT_WORKERS))))
+
+    run_id = create_run(org_id, notice_type_id, batch_size, workers, session.get("username"))
+    start_run_in_background(run_id)
+
+    return jsonify({"ok": True, "RunID": run_id}), 202
+
+@timebar_recalc_bp.route("/api/timebars/recalc-runs/<int:run_id>", methods=["GET"])
+@login_required
+def get_recalc_run(run_id):
+    with get_db_connection() as conn:
+        run = load_run(conn, run_id)
+
+    if not run:
+        return jsonify({"ok": False, "error": "Run not found"}), 404
+
+    return jsonify({"ok": True, "run": run})
+
+@timebar_recalc_bp.route("/api/timebars/recalc-runs/<int:run_id>/resume", methods=["POST"])
+@login_required
+def resume_recalc_run(run_id):
+    with get_db_connection() as conn:
+        run = load_run(conn, run_id)
+
+    if not run:
+        return jsonify({"ok": False, "error": "Run not found"}), 404
+
+    if run["Status"] == "COMPLETED":
+        return jsonify({"ok": False, "error": "Run already completed"}), 409
+
+    if not claim_run(run_id):
+        return jsonify({"ok": False, "error": "Run is already running"}), 409
+
+    start_run_in_background(run_id, claimed=True)
+    return jsonify({"ok": True, "RunID": run_id}), 202
+
+# ---------------- CLI ----------------
+
+@timebar_recalc_bp.cli.command("recalc-all")
+@click.option("--org-id", default=1, show_default=True, type=int)
+@click.option("--notice-type-id", default=None, type=int, help="Only cases carrying this notice type.")
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True, type=int)
+@click.option("--workers", default=DEFAULT_WORKERS, show_default=True, type=int)
+@click.option("--resume", "resume_run_id", default=None, type=int, help="Resume an existing RunID.")
+def recalc_all_command(org_id, notice_type_id, batch_size, workers, resume_run_id):
+    """Refresh snapshots and recalc timebars for every affected case."""
+    run_id = resume_run_id or create_run(org_id, notice_type_id, batch_size, workers, "cli")
+    click.echo(f"Timebar recalc run {run_id}")
+
+    try:
+        run = execute_run(run_id, progress=click.echo)
+    except RecalcRunBusy as e:
+        raise click.ClickException(str(e))
+    click.echo(f"✅ {run['Status']} — {run['ProcessedCases']}/{run['TotalCases']} cases")
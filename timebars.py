@@ -2,11 +2,20 @@
 # ⏳ timebars.py — Timebar Notices + Todos (Milestone 1)
 # ==============================================
 from flask import Blueprint, request, jsonify
-from sqlalchemy import text
+from sqlalchemy import text, bindparam, event
+from sqlalchemy.engine import Engine
 from datetime import timedelta, datetime
+import hashlib
+import threading
+import weakref
+
+from template_engine import CompiledTemplate, load_compiled
+from template_catalog import get_catalog
 
 timebars_bp = Blueprint("timebars_bp", __name__)
 
+DEFAULT_REMINDER_OFFSETS = "45,30,15,10,5,1"
+
 # ---------------- Helpers ----------------
 
 def parse_offsets(offset_str: str):
@@ -24,228 +33,779 @@ def parse_offsets(offset_str: str):
     return sorted(list(set(offsets)), reverse=True)
 
 def merge_template(subject: str, body: str, context: dict):
-    subject = subject or ""
-    body = body or ""
-
-    for key, value in context.items():
-        token = f"{{{{{key}}}}}"
-        subject = subject.replace(token, str(value or ""))
-        body = body.replace(token, str(value or ""))
-
-    return subject, body
-
-def upsert_missing_voyage_end_todo(conn, case_id: int, has_voyage_end: bool):
-    todo_type = "MISSING_VOYAGE_END_DATE"
-    title = "⚠ Voyage End Date is empty — timebar reminders can’t be scheduled"
+    return CompiledTemplate(subject, body).render(context)
+
+def build_notice_context(m, today=None):
+    """Token values for a todo row joined to its case + notice type."""
+    def as_date(d):
+        return d.date() if isinstance(d, datetime) else d
+
+    def fmt(d):
+        return d.strftime("%d %b %Y") if d else ""
+
+    return {
+        "VesselName": m.get("VesselName"),
+        "ChartererName": m.get("ChartererName"),
+        "VoyageEndDate": fmt(as_date(m.get("VoyageEndDate"))),
+        "TimebarExpiryDate": fmt(as_date(m.get("ExpiryDate"))),
+        "NoticeTypeName": m.get("NoticeTypeName"),
+        "Today": fmt(today or datetime.utcnow().date()),
+        "CaseRef": m.get("DeepBlueRef"),
+    }
+
+MISSING_VOYAGE_END_TYPE = "MISSING_VOYAGE_END_DATE"
+MISSING_VOYAGE_END_TITLE = "⚠ Voyage End Date is empty — timebar reminders can’t be scheduled"
+
+def upsert_missing_voyage_end_todos(conn, case_ids, has_voyage_end: bool):
+    todo_type = MISSING_VOYAGE_END_TYPE
+    title = MISSING_VOYAGE_END_TITLE
+    ids_param = bindparam("CaseIDs", expanding=True)
 
     if not has_voyage_end:
         conn.execute(text("""
-            IF NOT EXISTS (
-              SELECT 1 FROM dbo.CaseTodos
-              WHERE CaseID=:CaseID AND Type=:Type AND Status='OPEN'
-            )
             INSERT INTO dbo.CaseTodos (CaseID, Type, Title, Status, DueDate, MetaKey)
-            VALUES (:CaseID, :Type, :Title, 'OPEN', NULL, 'MISSING_VOYAGE_END_DATE');
-        """), {"CaseID": case_id, "Type": todo_type, "Title": title})
+            SELECT c.CaseID, :Type, :Title, 'OPEN', NULL, 'MISSING_VOYAGE_END_DATE'
+            FROM dbo.Cases c
+            WHERE c.CaseID IN :CaseIDs
+              AND NOT EXISTS (
+                SELECT 1 FROM dbo.CaseTodos t
+                WHERE t.CaseID=c.CaseID AND t.Type=:Type AND t.Status='OPEN'
+              );
+        """).bindparams(ids_param), {"CaseIDs": list(case_ids), "Type": todo_type, "Title": title})
     else:
         conn.execute(text("""
             UPDATE dbo.CaseTodos
             SET Status='DISMISSED', UpdatedAt=SYSUTCDATETIME()
-            WHERE CaseID=:CaseID AND Type=:Type AND Status='OPEN';
-        """), {"CaseID": case_id, "Type": todo_type})
+            WHERE CaseID IN :CaseIDs AND Type=:Type AND Status='OPEN';
+        """).bindparams(ids_param), {"CaseIDs": list(case_ids), "Type": todo_type})
+
+def upsert_missing_voyage_end_todo(conn, case_id: int, has_voyage_end: bool):
+    upsert_missing_voyage_end_todos(conn, [case_id], has_voyage_end)
 
-def recalc_case_timebars(conn, case_id: int, org_id: int, voyage_end_col: str = "VoyageEndDate"):
+def build_notice_schedule(voyage_end, timebar_days, offsets, notice_name, case_notice_id):
     """
-    Recalculate timebar expiry dates and reminder todos for a case.
-    Uses TemplateAssignments first, falling back to NoticeTypes.TemplateID.
+    Pure timebar maths for one notice: returns (expiry, reminders).
+    Each reminder is a dict with MetaKey, Offset, DueDate and Title.
     """
+    expiry = voyage_end + timedelta(days=int(timebar_days))
+
+    display_name = (
+        notice_name
+        if str(notice_name).lower().endswith("notice")
+        else f"{notice_name} Notice"
+    )
+
+    reminders = []
+    for off in parse_offsets(offsets):
+        reminders.append({
+            "MetaKey": f"TIMEBAR:{case_notice_id}:OFFSET:{off}",
+            "Offset": off,
+            "DueDate": expiry - timedelta(days=off),
+            "Title": (
+                f"Send {display_name} — {off} days before timebar "
+                f"(timebar expires {expiry.isoformat()})"
+            ),
+        })
+
+    return expiry, reminders
+
+def notice_fingerprint(voyage_end, timebar_days, offsets, enabled, template_id, notice_name):
+    """
+    Hash of everything a notice's expiry + reminders are derived from.
+    Stored in CaseNotices.InputFingerprint; an unchanged hash means recalc
+    has nothing to write for that notice.
+    """
+    raw = "|".join([
+        voyage_end.isoformat() if voyage_end else "",
+        str(timebar_days),
+        ",".join(str(o) for o in parse_offsets(offsets)),
+        "1" if enabled else "0",
+        str(template_id or ""),
+        str(notice_name or ""),
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+# SQL Server caps a statement at 2100 parameters
+MAX_SQL_PARAMS = 2000
+
+def chunked(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def insert_rows(conn, table: str, columns, rows):
+    """Multi-row INSERT ... VALUES, chunked to stay under the parameter cap."""
+    if not rows:
+        return
+
+    per_stmt = max(1, min(1000, MAX_SQL_PARAMS // len(columns)))
+    col_sql = ", ".join(columns)
+
+    for chunk in chunked(rows, per_stmt):
+        params = {}
+        values = []
+        for i, row in enumerate(chunk):
+            values.append("(" + ", ".join(f":{c}_{i}" for c in columns) + ")")
+            for c in columns:
+                params[f"{c}_{i}"] = row[c]
+
+        conn.execute(text(
+            f"INSERT INTO {table} ({col_sql}) VALUES {', '.join(values)}"
+        ), params)
+
+# Recalc results are queued on the connection and handed to listeners by
+# commit_and_notify() once the transaction has committed; a rollback (or
+# closing without commit) drops them.
+_recalc_listeners = []
+_pending_results = weakref.WeakKeyDictionary()  # Connection -> [result]
+_pending_lock = threading.Lock()
+
+def register_recalc_listener(fn):
+    """
+    Subscribe to recalc results. Listeners get the result dict including
+    result["reminders"] = {"upserted": [(TodoID, DueDate)], "dismissed": [TodoID]}
+    and result["changed_cases"] (cases whose notices were rewritten or cleared).
+    They run after commit, so they only ever see committed changes.
+    """
+    if fn not in _recalc_listeners:
+        _recalc_listeners.append(fn)
+    return fn
+
+def _notify_recalc_listeners(result):
+    for fn in list(_recalc_listeners):
+        try:
+            fn(result)
+        except Exception as e:
+            print("⚠️ Recalc listener failed:", e)
+
+def queue_recalc_result(conn, result):
+    """Hold a result for the listeners until conn commits (see commit_and_notify)."""
+    with _pending_lock:
+        _pending_results.setdefault(conn, []).append(result)
+
+def commit_and_notify(conn):
+    """conn.commit(), then pass the recalc results queued on conn to the listeners."""
+    conn.commit()
+    with _pending_lock:
+        results = _pending_results.pop(conn, [])
+    for result in results:
+        _notify_recalc_listeners(result)
+
+@event.listens_for(Engine, "rollback")
+def _drop_pending_results(conn):
+    with _pending_lock:
+        _pending_results.pop(conn, None)
+
+def recalc_cases_timebars(conn, case_ids, org_id: int, voyage_end_col: str = "VoyageEndDate",
+                          force: bool = False):
+    """Recalc a batch of cases in the caller's transaction; commit with commit_and_notify(conn)."""
+    result = _recalc_cases_timebars(conn, case_ids, org_id, voyage_end_col, force)
+    queue_recalc_result(conn, result)
+    return result
+
+def _recalc_cases_timebars(conn, case_ids, org_id, voyage_end_col, force):
+    """
+    Set-based recalc for a batch of cases (keep batches to a few hundred).
+    Computes schedules in Python, stages them in temp tables and applies
+    them with one UPDATE / MERGE per table instead of one round trip per
+    reminder. Open reminders for offsets no longer configured are dismissed.
+
+    Notices whose input fingerprint is unchanged are skipped unless force=True.
+    """
+    case_ids = sorted({int(c) for c in case_ids})
+    result = {
+        "ok": True,
+        "processed": [],
+        "not_found": [],
+        "missing_voyage_end": [],
+        "scheduled": {},
+        "skipped": 0,
+        "reminders": {"upserted": [], "dismissed": []},
+        "changed_cases": [],
+    }
+    if not case_ids:
+        return result
+
+    ids_param = bindparam("CaseIDs", expanding=True)
 
     # ------------------------------------------------
-    # 1️⃣ Get VoyageEndDate
+    # 1️⃣ Get VoyageEndDate for every case in the batch
     # ------------------------------------------------
-    row = conn.execute(text(f"""
+    rows = conn.execute(text(f"""
         SELECT CaseID, {voyage_end_col} AS VoyageEndDate
         FROM dbo.Cases
-        WHERE CaseID = :CaseID
-    """), {"CaseID": case_id}).fetchone()
+        WHERE CaseID IN :CaseIDs
+    """).bindparams(ids_param), {"CaseIDs": case_ids}).fetchall()
 
-    if not row:
-        return {"ok": False, "error": "Case not found"}
+    voyage_ends = {}
+    for r in rows:
+        voyage_end = r._mapping["VoyageEndDate"]
+        if isinstance(voyage_end, datetime):
+            voyage_end = voyage_end.date()
+        voyage_ends[r._mapping["CaseID"]] = voyage_end
 
-    voyage_end = row._mapping.get("VoyageEndDate")
-    has_voyage_end = voyage_end is not None
+    result["not_found"] = [c for c in case_ids if c not in voyage_ends]
+    result["processed"] = sorted(voyage_ends)
 
-    upsert_missing_voyage_end_todo(conn, case_id, has_voyage_end)
+    missing = [c for c, v in voyage_ends.items() if v is None]
+    present = [c for c, v in voyage_ends.items() if v is not None]
+    result["missing_voyage_end"] = sorted(missing)
+    result["changed_cases"] = sorted(missing + result["not_found"])  # deleted cases drop out of mirrors
 
-    if not has_voyage_end:
+    # ------------------------------------------------
+    # 2️⃣ Cases without VoyageEndDate: warn + clear
+    # ------------------------------------------------
+    if missing:
+        upsert_missing_voyage_end_todos(conn, missing, has_voyage_end=False)
 
-        conn.execute(text("""
+        dismissed = conn.execute(text("""
             UPDATE dbo.CaseTodos
             SET Status='DISMISSED', UpdatedAt=SYSUTCDATETIME()
-            WHERE CaseID=:CaseID
+            OUTPUT inserted.TodoID
+            WHERE CaseID IN :CaseIDs
               AND Type='TIMEBAR_REMINDER'
               AND Status='OPEN';
-        """), {"CaseID": case_id})
+        """).bindparams(ids_param), {"CaseIDs": missing}).fetchall()
+        result["reminders"]["dismissed"].extend(r[0] for r in dismissed)
 
         conn.execute(text("""
             UPDATE dbo.CaseNotices
             SET ExpiryDate = NULL,
+                InputFingerprint = NULL,
                 UpdatedAt = SYSUTCDATETIME()
-            WHERE CaseID=:CaseID;
-        """), {"CaseID": case_id})
+            WHERE CaseID IN :CaseIDs;
+        """).bindparams(ids_param), {"CaseIDs": missing})
 
-        return {"ok": True, "scheduled": 0, "reason": "VoyageEndDate missing"}
+    if not present:
+        return result
 
-    # Normalize datetime → date
-    if isinstance(voyage_end, datetime):
-        voyage_end = voyage_end.date()
+    upsert_missing_voyage_end_todos(conn, present, has_voyage_end=True)
 
     # ------------------------------------------------
-    # 2️⃣ Load case notices
+    # 3️⃣ Load notices + reminder template for the batch
     # ------------------------------------------------
+    assigned_template_id = get_catalog(conn).assigned_template_id("TIMEBAR_REMINDER", org_id)
+
     notices = conn.execute(text("""
         SELECT
             cn.CaseNoticeID,
+            cn.CaseID,
             cn.TimebarDaysSnapshot,
             cn.ReminderOffsetsSnapshot,
             cn.IsEnabled,
+            cn.InputFingerprint,
             nt.Name AS NoticeTypeName,
-
-            ta.TemplateID AS AssignedTemplateID,
             nt.TemplateID AS NoticeTypeTemplateID
-
         FROM dbo.CaseNotices cn
-
         JOIN dbo.NoticeTypes nt
             ON nt.NoticeTypeID = cn.NoticeTypeID
-
-        LEFT JOIN dbo.TemplateAssignments ta
-            ON ta.AssignmentKey = 'TIMEBAR_REMINDER'
-            AND ta.OrgID = :OrgID
-            AND ta.IsActive = 1
-
-        WHERE cn.CaseID = :CaseID
-    """), {
-        "CaseID": case_id,
-        "OrgID": org_id
-    }).fetchall()
-
-    scheduled = 0
+        WHERE cn.CaseID IN :CaseIDs
+    """).bindparams(ids_param), {"CaseIDs": present}).fetchall()
 
     # ------------------------------------------------
-    # 3️⃣ Process notices
+    # 4️⃣ Compute expiry + reminders in memory
     # ------------------------------------------------
-    for n in notices:
+    notice_rows = []
+    reminder_rows = []
 
+    for n in notices:
         m = n._mapping
-
-        case_notice_id = m["CaseNoticeID"]
+        case_id = m["CaseID"]
         enabled = bool(m["IsEnabled"])
-        notice_name = m["NoticeTypeName"]
-
-        template_id = (
-            m.get("AssignedTemplateID")
-            or m.get("NoticeTypeTemplateID")
+        template_id = assigned_template_id or m["NoticeTypeTemplateID"]
+
+        fingerprint = notice_fingerprint(
+            voyage_ends[case_id],
+            m["TimebarDaysSnapshot"],
+            m["ReminderOffsetsSnapshot"],
+            enabled,
+            template_id,
+            m["NoticeTypeName"],
         )
 
-        timebar_days = int(m["TimebarDaysSnapshot"])
-        offsets = parse_offsets(m["ReminderOffsetsSnapshot"])
+        if not force and fingerprint == m["InputFingerprint"]:
+            result["skipped"] += 1
+            continue
 
-        # Disable reminders if notice disabled
         if not enabled:
-
-            conn.execute(text("""
-                UPDATE dbo.CaseTodos
-                SET Status='DISMISSED',
-                    UpdatedAt=SYSUTCDATETIME()
-                WHERE CaseID=:CaseID
-                  AND Type='TIMEBAR_REMINDER'
-                  AND RelatedEntityType='CaseNotice'
-                  AND RelatedEntityID=:CaseNoticeID
-                  AND Status='OPEN';
-            """), {
+            notice_rows.append({
+                "CaseNoticeID": m["CaseNoticeID"],
                 "CaseID": case_id,
-                "CaseNoticeID": case_notice_id
+                "IsEnabled": 0,
+                "ExpiryDate": None,
+                "Fingerprint": fingerprint,
             })
-
             continue
 
-        # ------------------------------------------------
-        # 4️⃣ Calculate expiry
-        # ------------------------------------------------
-        expiry = voyage_end + timedelta(days=timebar_days)
+        expiry, reminders = build_notice_schedule(
+            voyage_ends[case_id],
+            m["TimebarDaysSnapshot"],
+            m["ReminderOffsetsSnapshot"],
+            m["NoticeTypeName"],
+            m["CaseNoticeID"],
+        )
 
-        conn.execute(text("""
-            UPDATE dbo.CaseNotices
-            SET ExpiryDate=:ExpiryDate,
-                UpdatedAt=SYSUTCDATETIME()
-            WHERE CaseNoticeID=:CaseNoticeID
-        """), {
+        notice_rows.append({
+            "CaseNoticeID": m["CaseNoticeID"],
+            "CaseID": case_id,
+            "IsEnabled": 1,
             "ExpiryDate": expiry,
-            "CaseNoticeID": case_notice_id
+            "Fingerprint": fingerprint,
         })
 
-        # ------------------------------------------------
-        # 5️⃣ Create / update reminder todos
-        # ------------------------------------------------
-        for off in offsets:
+        for r in reminders:
+            reminder_rows.append({
+                "CaseID": case_id,
+                "CaseNoticeID": m["CaseNoticeID"],
+                "MetaKey": r["MetaKey"],
+                "Title": r["Title"],
+                "DueDate": r["DueDate"],
+                "TemplateID": template_id,
+            })
 
-            due = expiry - timedelta(days=off)
+    if not notice_rows:
+        return result
 
-            display_name = (
-                notice_name
-                if str(notice_name).lower().endswith("notice")
-                else f"{notice_name} Notice"
-            )
+    result["changed_cases"] = sorted(set(result["changed_cases"]) | {r["CaseID"] for r in notice_rows})
 
-            title = (
-                f"Send {display_name} — {off} days before timebar "
-                f"(timebar expires {expiry.isoformat()})"
-            )
+    # ------------------------------------------------
+    # 5️⃣ Stage + apply set-based
+    # ------------------------------------------------
+    conn.execute(text("""
+        DROP TABLE IF EXISTS #tb_notices;
+        DROP TABLE IF EXISTS #tb_reminders;
+
+        CREATE TABLE #tb_notices (
+            CaseNoticeID INT NOT NULL PRIMARY KEY,
+            CaseID INT NOT NULL,
+            IsEnabled BIT NOT NULL,
+            ExpiryDate DATE NULL,
+            Fingerprint CHAR(64) NOT NULL
+        );
+
+        CREATE TABLE #tb_reminders (
+            CaseID INT NOT NULL,
+            CaseNoticeID INT NOT NULL,
+            MetaKey NVARCHAR(200) NOT NULL,
+            Title NVARCHAR(500) NOT NULL,
+            DueDate DATE NOT NULL,
+            TemplateID INT NULL,
+            PRIMARY KEY (CaseID, MetaKey)
+        );
+    """))
+
+    insert_rows(conn, "#tb_notices",
+                ["CaseNoticeID", "CaseID", "IsEnabled", "ExpiryDate", "Fingerprint"], notice_rows)
+    insert_rows(conn, "#tb_reminders",
+                ["CaseID", "CaseNoticeID", "MetaKey", "Title", "DueDate", "TemplateID"],
+                reminder_rows)
+
+    conn.execute(text("""
+        UPDATE cn
+        SET ExpiryDate = CASE WHEN tn.IsEnabled = 1 THEN tn.ExpiryDate ELSE cn.ExpiryDate END,
+            InputFingerprint = tn.Fingerprint,
+            UpdatedAt = SYSUTCDATETIME()
+        FROM dbo.CaseNotices cn
+        JOIN #tb_notices tn
+            ON tn.CaseNoticeID = cn.CaseNoticeID;
+    """))
+
+    # Disabled notices + offsets no longer in the snapshot
+    dismissed = conn.execute(text("""
+        UPDATE t
+        SET Status='DISMISSED',
+            UpdatedAt=SYSUTCDATETIME()
+        OUTPUT inserted.TodoID
+        FROM dbo.CaseTodos t
+        JOIN #tb_notices tn
+            ON t.RelatedEntityType = 'CaseNotice'
+           AND t.RelatedEntityID = tn.CaseNoticeID
+           AND t.CaseID = tn.CaseID
+        WHERE t.Type = 'TIMEBAR_REMINDER'
+          AND t.Status = 'OPEN'
+          AND (
+                tn.IsEnabled = 0
+                OR NOT EXISTS (
+                    SELECT 1 FROM #tb_reminders r
+                    WHERE r.CaseID = t.CaseID AND r.MetaKey = t.MetaKey
+                )
+          );
+    """)).fetchall()
+    result["reminders"]["dismissed"].extend(r[0] for r in dismissed)
+
+    merged = conn.execute(text("""
+        MERGE dbo.CaseTodos AS t
+        USING #tb_reminders AS r
+            ON t.CaseID = r.CaseID
+           AND t.Type = 'TIMEBAR_REMINDER'
+           AND t.MetaKey = r.MetaKey
+        WHEN MATCHED THEN
+            UPDATE SET NotifiedAt = CASE WHEN t.DueDate = r.DueDate THEN t.NotifiedAt END,
+                       DueDate = r.DueDate,
+                       Title = r.Title,
+                       TemplateID = r.TemplateID,
+                       Status = 'OPEN',
+                       UpdatedAt = SYSUTCDATETIME()
+        WHEN NOT MATCHED BY TARGET THEN
+            INSERT (CaseID, Type, Title, DueDate, Status,
+                    RelatedEntityType, RelatedEntityID,
+                    TemplateID, MetaKey)
+            VALUES (r.CaseID, 'TIMEBAR_REMINDER', r.Title, r.DueDate, 'OPEN',
+                    'CaseNotice', r.CaseNoticeID,
+                    r.TemplateID, r.MetaKey)
+        OUTPUT $action AS MergeAction, inserted.CaseID, inserted.TodoID, inserted.DueDate;
+    """)).fetchall()
+
+    for row in merged:
+        m = row._mapping
+        result["reminders"]["upserted"].append((m["TodoID"], m["DueDate"]))
+        if m["MergeAction"] == "INSERT":
+            cid = m["CaseID"]
+            result["scheduled"][cid] = result["scheduled"].get(cid, 0) + 1
+
+    conn.execute(text("""
+        DROP TABLE IF EXISTS #tb_notices;
+        DROP TABLE IF EXISTS #tb_reminders;
+    """))
+
+    return result
+
+def recalc_case_timebars(conn, case_id: int, org_id: int, voyage_end_col: str = "VoyageEndDate",
+                         force: bool = False):
+    """
+    Recalculate timebar expiry dates and reminder todos for a case.
+    Uses TemplateAssignments first, falling back to NoticeTypes.TemplateID.
+    """
+    res = recalc_cases_timebars(conn, [case_id], org_id, voyage_end_col, force=force)
 
-            meta = f"TIMEBAR:{case_notice_id}:OFFSET:{off}"
+    if res["not_found"]:
+        return {"ok": False, "error": "Case not found"}
 
-            updated = conn.execute(text("""
-                UPDATE dbo.CaseTodos
-                SET DueDate=:DueDate,
-                    Title=:Title,
-                    TemplateID=:TemplateID,
-                    Status='OPEN',
-                    UpdatedAt=SYSUTCDATETIME()
-                WHERE CaseID=:CaseID
-                  AND Type='TIMEBAR_REMINDER'
-                  AND MetaKey=:MetaKey
-            """), {
-                "DueDate": due,
-                "Title": title,
-                "TemplateID": template_id,
-                "CaseID": case_id,
-                "MetaKey": meta
-            }).rowcount
+    if res["missing_voyage_end"]:
+        return {"ok": True, "scheduled": 0, "reason": "VoyageEndDate missing"}
 
-            if updated == 0:
+    return {
+        "ok": True,
+        "scheduled": res["scheduled"].get(int(case_id), 0),
+        "skipped": res["skipped"],
+    }
+
+def parse_date(value):
+    """Accept date / datetime / 'YYYY-MM-DD[...]' strings; None for blanks."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if hasattr(value, "isoformat") and not isinstance(value, str):
+        return value
+    return datetime.fromisoformat(str(value).strip()[:10]).date()
+
+def _is_int(value):
+    if isinstance(value, bool):
+        return False
+    try:
+        int(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def validate_simulation_specs(specs):
+    """
+    Shape-check simulate specs before any query. Returns None, or
+    {"error", "index"[, "notice"]} for the first bad spec / notice override.
+    """
+    for i, sp in enumerate(specs):
+        if not isinstance(sp, dict):
+            return {"error": "Each case spec must be an object", "index": i}
+        if sp.get("CaseID") is not None and not _is_int(sp["CaseID"]):
+            return {"error": "CaseID must be an integer", "index": i}
+
+        notices = sp.get("Notices")
+        if notices is None:
+            continue
+        if not isinstance(notices, list):
+            return {"error": "Notices must be a list", "index": i}
+
+        for j, n in enumerate(notices):
+            if not isinstance(n, dict):
+                return {"error": "Each notice override must be an object", "index": i, "notice": j}
+            for key in ("CaseNoticeID", "NoticeTypeID", "TimebarDays"):
+                if n.get(key) is not None and not _is_int(n[key]):
+                    return {"error": f"{key} must be an integer", "index": i, "notice": j}
+            if n.get("TimebarDays") is not None and int(n["TimebarDays"]) < 0:
+                return {"error": "TimebarDays must not be negative", "index": i, "notice": j}
+            if n.get("ReminderOffsets") is not None and not isinstance(n["ReminderOffsets"], (str, int)):
+                return {"error": "ReminderOffsets must be a comma-separated string", "index": i, "notice": j}
+    return None
+
+def simulate_timebars(conn, specs, org_id: int):
+    """
+    Read-only what-if: compute expiry + reminder schedules for a batch of
+    specs without touching CaseNotices / CaseTodos. Each spec is a dict:
 
-                conn.execute(text("""
-                    INSERT INTO dbo.CaseTodos
-                        (CaseID, Type, Title, DueDate, Status,
-                         RelatedEntityType, RelatedEntityID,
-                         TemplateID, MetaKey)
-                    VALUES
-                        (:CaseID, 'TIMEBAR_REMINDER', :Title, :DueDate,
-                         'OPEN', 'CaseNotice', :CaseNoticeID,
-                         :TemplateID, :MetaKey)
-                """), {
-                    "CaseID": case_id,
-                    "Title": title,
-                    "DueDate": due,
-                    "CaseNoticeID": case_notice_id,
-                    "TemplateID": template_id,
-                    "MetaKey": meta
+      CaseID         optional — start from the case's stored VoyageEndDate + notices
+      VoyageEndDate  optional override (null = simulate a cleared date)
+      Notices        optional list of
+                       {CaseNoticeID, IsEnabled?, TimebarDays?, ReminderOffsets?}  override existing
+                       {NoticeTypeID, IsEnabled?, TimebarDays?, ReminderOffsets?}  add / re-add a type
+
+    Case data is read in at most two queries per call, however many specs;
+    notice types and assignments come from the template catalog.
+    """
+    ids_param = bindparam("IDs", expanding=True)
+
+    case_ids = sorted({int(sp["CaseID"]) for sp in specs if sp.get("CaseID")})
+    type_ids = sorted({
+        int(n["NoticeTypeID"])
+        for sp in specs for n in (sp.get("Notices") or [])
+        if n.get("NoticeTypeID") and not n.get("CaseNoticeID")
+    })
+
+    cases, case_notices, notice_types = {}, {}, {}
+
+    if case_ids:
+        for r in conn.execute(text("""
+            SELECT CaseID, VoyageEndDate
+            FROM dbo.Cases
+            WHERE CaseID IN :IDs
+        """).bindparams(ids_param), {"IDs": case_ids}).fetchall():
+            cases[r._mapping["CaseID"]] = parse_date(r._mapping["VoyageEndDate"])
+
+        for r in conn.execute(text("""
+            SELECT cn.CaseNoticeID, cn.CaseID, cn.NoticeTypeID, cn.IsEnabled,
+                   cn.TimebarDaysSnapshot, cn.ReminderOffsetsSnapshot,
+                   nt.Name AS NoticeTypeName, nt.TemplateID AS NoticeTypeTemplateID
+            FROM dbo.CaseNotices cn
+            JOIN dbo.NoticeTypes nt ON nt.NoticeTypeID = cn.NoticeTypeID
+            WHERE cn.CaseID IN :IDs
+        """).bindparams(ids_param), {"IDs": case_ids}).fetchall():
+            case_notices.setdefault(r._mapping["CaseID"], []).append(dict(r._mapping))
+
+    catalog = get_catalog(conn)
+    for type_id in type_ids:
+        nt = catalog.notice_type(type_id, org_id)
+        if nt:
+            notice_types[type_id] = nt
+
+    assigned_template_id = catalog.assigned_template_id("TIMEBAR_REMINDER", org_id)
+
+    results = []
+
+    for sp in specs:
+        case_id = int(sp["CaseID"]) if sp.get("CaseID") else None
+        warnings = []
+
+        if case_id is not None and case_id not in cases:
+            results.append({"CaseID": case_id, "ok": False, "error": "Case not found"})
+            continue
+
+        voyage_end = cases.get(case_id) if case_id is not None else None
+        if "VoyageEndDate" in sp:
+            try:
+                voyage_end = parse_date(sp["VoyageEndDate"])
+            except ValueError:
+                results.append({"CaseID": case_id, "ok": False, "error": "Invalid VoyageEndDate"})
+                continue
+
+        # Working set keyed by CaseNoticeID (existing) or "new:<type>" (hypothetical)
+        working = {}
+        for cn in case_notices.get(case_id, []):
+            working[cn["CaseNoticeID"]] = {
+                "CaseNoticeID": cn["CaseNoticeID"],
+                "NoticeTypeID": cn["NoticeTypeID"],
+                "NoticeTypeName": cn["NoticeTypeName"],
+                "IsEnabled": bool(cn["IsEnabled"]),
+                "TimebarDays": cn["TimebarDaysSnapshot"],
+                "ReminderOffsets": cn["ReminderOffsetsSnapshot"],
+                "TemplateID": assigned_template_id or cn["NoticeTypeTemplateID"],
+            }
+
+        for n in sp.get("Notices") or []:
+            if n.get("CaseNoticeID"):
+                target = working.get(int(n["CaseNoticeID"]))
+                if not target:
+                    warnings.append(f"CaseNotice {n['CaseNoticeID']} not on case")
+                    continue
+            elif n.get("NoticeTypeID"):
+                nt = notice_types.get(int(n["NoticeTypeID"]))
+                if not nt:
+                    warnings.append(f"NoticeType {n['NoticeTypeID']} not found")
+                    continue
+                # Re-adding an attached type refreshes its snapshot, like add_notice_to_case
+                target = next(
+                    (w for w in working.values() if w["NoticeTypeID"] == nt["NoticeTypeID"]),
+                    None
+                )
+                if target is None:
+                    target = working.setdefault(f"new:{nt['NoticeTypeID']}", {
+                        "CaseNoticeID": None,
+                        "NoticeTypeID": nt["NoticeTypeID"],
+                        "NoticeTypeName": nt["Name"],
+                        "IsEnabled": True,
+                    })
+                target.update({
+                    "TimebarDays": nt["TimebarDays"],
+                    "ReminderOffsets": nt["ReminderOffsetsResolved"] or DEFAULT_REMINDER_OFFSETS,
+                    "TemplateID": assigned_template_id or nt["TemplateID"],
                 })
+            else:
+                warnings.append("Notice needs CaseNoticeID or NoticeTypeID")
+                continue
+
+            if "IsEnabled" in n:
+                target["IsEnabled"] = bool(n["IsEnabled"])
+            if n.get("TimebarDays") is not None:
+                target["TimebarDays"] = int(n["TimebarDays"])
+            if n.get("ReminderOffsets") is not None:
+                target["ReminderOffsets"] = str(n["ReminderOffsets"])
+
+        notices_out = []
+        for key, w in working.items():
+            out = dict(w, ExpiryDate=None, Reminders=[])
+            if voyage_end is not None and w["IsEnabled"]:
+                expiry, reminders = build_notice_schedule(
+                    voyage_end,
+                    w["TimebarDays"],
+                    w["ReminderOffsets"],
+                    w["NoticeTypeName"],
+                    w["CaseNoticeID"] or key,
+                )
+                out["ExpiryDate"] = expiry
+                out["Reminders"] = reminders
+            notices_out.append(out)
+
+        notices_out.sort(key=lambda x: str(x["NoticeTypeName"]))
+
+        if voyage_end is None:
+            warnings.append("VoyageEndDate missing — no reminders can be scheduled")
+
+        results.append({
+            "CaseID": case_id,
+            "ok": True,
+            "VoyageEndDate": voyage_end,
+            "Notices": notices_out,
+            "Warnings": warnings,
+        })
 
-                scheduled += 1
+    return results
 
-    return {"ok": True, "scheduled": scheduled}
+ATTACH_RECALC_BATCH = 500
+
+def resolve_case_filter(conn, case_filter: dict):
+    """
+    Ledger-style filter -> SQL. Keys must be dbo.Cases columns; values match by
+    equality (None = IS NULL, list = IN). Returns (where_sql, params, expanding).
+    An empty filter is an error — "every case" is attach_notice_type(all_cases=True).
+    """
+    if not case_filter:
+        raise ValueError("Filter must name at least one Cases column")
+
+    columns = {
+        r[0] for r in conn.execute(text("""
+            SELECT COLUMN_NAME
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = 'dbo' AND TABLE_NAME = 'Cases'
+        """)).fetchall()
+    }
+
+    unknown = sorted(k for k in case_filter if k not in columns)
+    if unknown:
+        raise ValueError(f"Unknown Cases column(s): {', '.join(unknown)}")
+
+    clauses, params, expanding = [], {}, []
+    for i, (col, value) in enumerate(sorted(case_filter.items())):
+        if value is None:
+            clauses.append(f"c.[{col}] IS NULL")
+        elif isinstance(value, (list, tuple)):
+            clauses.append(f"c.[{col}] IN :F{i}")
+            params[f"F{i}"] = list(value)
+            expanding.append(f"F{i}")
+        else:
+            clauses.append(f"c.[{col}] = :F{i}")
+            params[f"F{i}"] = value
+
+    return " AND ".join(clauses), params, expanding
+
+def attach_notice_type(conn, notice_type: dict, case_ids=None, case_filter=None, all_cases: bool = False):
+    """
+    Attach (or refresh) one notice type on many cases: stage the target cases,
+    upsert every CaseNotice with one MERGE, then recalc in batches. Runs in the
+    caller's transaction.
+    """
+    offsets = notice_type["ReminderOffsetsResolved"] or DEFAULT_REMINDER_OFFSETS
+
+    conn.execute(text("""
+        DROP TABLE IF EXISTS #attach_cases;
+        CREATE TABLE #attach_cases (CaseID INT PRIMARY KEY);
+    """))
+
+    missing = []
+    if case_ids is not None:
+        requested = sorted({int(c) for c in case_ids})
+        insert_rows(conn, "#attach_cases", ["CaseID"], [{"CaseID": c} for c in requested])
+        gone = conn.execute(text("""
+            DELETE a
+            OUTPUT deleted.CaseID
+            FROM #attach_cases a
+            WHERE NOT EXISTS (SELECT 1 FROM dbo.Cases c WHERE c.CaseID = a.CaseID)
+        """)).fetchall()
+        missing = sorted(r[0] for r in gone)
+    else:
+        if all_cases:
+            where_sql, params, expanding = "1 = 1", {}, []
+        else:
+            where_sql, params, expanding = resolve_case_filter(conn, case_filter)
+        stmt = text(f"""
+            INSERT INTO #attach_cases (CaseID)
+            SELECT c.CaseID
+            FROM dbo.Cases c
+            WHERE {where_sql}
+        """)
+        if expanding:
+            stmt = stmt.bindparams(*[bindparam(k, expanding=True) for k in expanding])
+        conn.execute(stmt, params)
+
+    actions = conn.execute(text("""
+        MERGE dbo.CaseNotices AS tgt
+        USING #attach_cases AS src
+            ON tgt.CaseID = src.CaseID
+           AND tgt.NoticeTypeID = :NoticeTypeID
+        WHEN MATCHED THEN
+            UPDATE SET TimebarDaysSnapshot = :Days,
+                       ReminderOffsetsSnapshot = :Offsets,
+                       UpdatedAt = SYSUTCDATETIME()
+        WHEN NOT MATCHED BY TARGET THEN
+            INSERT (CaseID, NoticeTypeID, TimebarDaysSnapshot, ReminderOffsetsSnapshot, IsEnabled)
+            VALUES (src.CaseID, :NoticeTypeID, :Days, :Offsets, 1)
+        OUTPUT $action, inserted.CaseID;
+    """), {
+        "NoticeTypeID": notice_type["NoticeTypeID"],
+        "Days": int(notice_type["TimebarDays"]),
+        "Offsets": offsets,
+    }).fetchall()
+
+    conn.execute(text("DROP TABLE IF EXISTS #attach_cases;"))
+
+    attached = sorted({r[1] for r in actions})
+    summary = {
+        "ok": True,
+        "NoticeTypeID": notice_type["NoticeTypeID"],
+        "cases": len(attached),
+        "inserted": sum(1 for r in actions if r[0] == "INSERT"),
+        "updated": sum(1 for r in actions if r[0] == "UPDATE"),
+        "not_found": missing,
+        "missing_voyage_end": [],
+        "scheduled": 0,
+        "skipped": 0,
+    }
+
+    for batch in chunked(attached, ATTACH_RECALC_BATCH):
+        res = recalc_cases_timebars(conn, batch, notice_type["OrgID"])
+        summary["missing_voyage_end"].extend(res["missing_voyage_end"])
+        summary["scheduled"] += sum(res["scheduled"].values())
+        summary["skipped"] += res["skipped"]
+
+    return summary
 
 # ---------------- Routes ----------------
 
@@ -257,13 +817,10 @@ def get_notice_types():
     def inner():
         org_id = int(request.args.get("org_id", 1))
         with get_db_connection() as conn:
-            rows = conn.execute(text("""
-                SELECT NoticeTypeID, OrgID, Name, TimebarDays, ReminderOffsets, TemplateID, IsActive
-                FROM dbo.NoticeTypes
-                WHERE OrgID=:OrgID AND IsActive=1
-                ORDER BY Name ASC
-            """), {"OrgID": org_id}).fetchall()
-        return jsonify([dict(r._mapping) for r in rows])
+            rows = get_catalog(conn).notice_types_for_org(org_id)
+
+        fields = ("NoticeTypeID", "OrgID", "Name", "TimebarDays", "ReminderOffsets", "TemplateID", "IsActive")
+        return jsonify([{k: nt[k] for k in fields} for nt in rows])
 
     return inner()
 
@@ -286,31 +843,13 @@ def add_notice_to_case(case_id):
         with get_db_connection() as conn:
 
             # 🔎 1️⃣ Load NoticeType defaults
-            nt = conn.execute(text("""
-                SELECT NoticeTypeID,
-                       Name,
-                       TimebarDays,
-                       COALESCE(
-                           ReminderOffsets,
-                           (SELECT DefaultReminderOffsets
-                            FROM dbo.OrgSettings
-                            WHERE OrgID=:OrgID)
-                       ) AS ReminderOffsetsResolved
-                FROM dbo.NoticeTypes
-                WHERE NoticeTypeID=:NoticeTypeID
-                  AND OrgID=:OrgID
-                  AND IsActive=1
-            """), {
-                "NoticeTypeID": notice_type_id,
-                "OrgID": org_id
-            }).fetchone()
+            m = get_catalog(conn).notice_type(notice_type_id, org_id)
 
-            if not nt:
+            if not m:
                 return jsonify({"ok": False, "error": "NoticeType not found"}), 404
 
-            m = nt._mapping
             timebar_days = int(m["TimebarDays"])
-            offsets = m["ReminderOffsetsResolved"] or "45,30,15,10,5,1"
+            offsets = m["ReminderOffsetsResolved"] or DEFAULT_REMINDER_OFFSETS
 
             # 🔁 2️⃣ Insert or update CaseNotice (idempotent)
             existing = conn.execute(text("""
@@ -357,7 +896,66 @@ def add_notice_to_case(case_id):
                 voyage_end_col="VoyageEndDate"
             )
 
-            conn.commit()
+            commit_and_notify(conn)
+
+        return jsonify(result)
+
+    return inner()
+
+@timebars_bp.route("/api/timebars/notices/attach", methods=["POST"])
+def attach_notice_to_cases():
+    """
+    POST /api/timebars/notices/attach
+      {"NoticeTypeID": 3, "CaseIDs": [1, 2, 3]}
+      {"NoticeTypeID": 3, "Filter": {"ClaimStatus": "Open", "CharterersName": ["A", "B"]}}
+      {"NoticeTypeID": 3, "AllCases": true}
+    Bulk version of POST /api/timebars/cases/<id>/notices.
+    """
+    from app import get_db_connection, login_required
+
+    @login_required
+    def inner():
+        payload = request.get_json(force=True) or {}
+
+        org_id = int(payload.get("OrgID", 1))
+        notice_type_id = payload.get("NoticeTypeID")
+        case_ids = payload.get("CaseIDs")
+        case_filter = payload.get("Filter")
+
+        if not notice_type_id:
+            return jsonify({"ok": False, "error": "NoticeTypeID is required"}), 400
+
+        all_cases = payload.get("AllCases") is True
+
+        targets = sum([case_ids is not None, case_filter is not None, all_cases])
+        if targets == 0:
+            return jsonify({"ok": False, "error": "CaseIDs, Filter or AllCases is required"}), 400
+        if targets > 1:
+            return jsonify({"ok": False, "error": "Send only one of CaseIDs, Filter or AllCases"}), 400
+
+        if case_ids is not None and not isinstance(case_ids, list):
+            return jsonify({"ok": False, "error": "CaseIDs must be a list"}), 400
+
+        if case_filter is not None and (not isinstance(case_filter, dict) or not case_filter):
+            return jsonify({"ok": False, "error": "Filter must be a non-empty object"}), 400
+
+        with get_db_connection() as conn:
+            nt = get_catalog(conn).notice_type(int(notice_type_id), org_id)
+
+            if not nt:
+                return jsonify({"ok": False, "error": "NoticeType not found"}), 404
+
+            try:
+                result = attach_notice_type(
+                    conn, nt,
+                    case_ids=case_ids,
+                    case_filter=case_filter,
+                    all_cases=all_cases,
+                )
+            except ValueError as e:
+                return jsonify({"ok": False, "error": str(e)}), 400
+
+            commit_and_notify(conn)
 
         return jsonify(result)
 
@@ -371,49 +969,240 @@ def recalc_case(case_id):
     def inner():
         payload = request.get_json(force=True) or {}
         org_id = int(payload.get("OrgID", 1))
+        force = bool(payload.get("Force", False))
 
         # 🔒 lock down column name
         voyage_end_col = "VoyageEndDate"
 
         with get_db_connection() as conn:
-            result = recalc_case_timebars(conn, case_id, org_id, voyage_end_col)
-            conn.commit()
+            result = recalc_case_timebars(conn, case_id, org_id, voyage_end_col, force=force)
+            commit_and_notify(conn)
 
         return jsonify(result)
 
     return inner()
 
+@timebars_bp.route("/api/timebars/simulate", methods=["POST"])
+def simulate_case_timebars():
+    from app import get_db_connection, login_required
+
+    @login_required
+    def inner():
+        payload = request.get_json(force=True) or {}
+        org_id = int(payload.get("OrgID", 1))
+
+        # Single spec at the top level, or a batch under "Cases"
+        specs = payload.get("Cases")
+        if specs is None:
+            specs = [payload]
+
+        if not isinstance(specs, list) or len(specs) > 500:
+            return jsonify({"ok": False, "error": "Cases must be a list of at most 500 items"}), 400
+
+        invalid = validate_simulation_specs(specs)
+        if invalid:
+            return jsonify({"ok": False, **invalid}), 400
+
+        with get_db_connection() as conn:
+            results = simulate_timebars(conn, specs, org_id)
+            conn.rollback()  # read-only
+
+        for r in results:
+            if r.get("VoyageEndDate"):
+                r["VoyageEndDate"] = r["VoyageEndDate"].isoformat()
+            for n in r.get("Notices", []):
+                if n["ExpiryDate"]:
+                    n["ExpiryDate"] = n["ExpiryDate"].isoformat()
+                for rem in n["Reminders"]:
+                    rem["DueDate"] = rem["DueDate"].isoformat()
+
+        if "Cases" not in payload:
+            single = results[0]
+            if not single["ok"]:
+                return jsonify(single), 404 if single["error"] == "Case not found" else 400
+            return jsonify(single)
+
+        return jsonify({"ok": True, "cases": results})
+
+    return inner()
+
+def _encode_todo_cursor(row):
+    due = row["DueDate"]
+    if due is None:
+        return f"n:{row['TodoID']}"
+    return f"d:{parse_date(due).isoformat()}:{row['TodoID']}"
+
+def _decode_todo_cursor(cursor):
+    parts = cursor.split(":")
+    if parts[0] == "n" and len(parts) == 2:
+        return None, int(parts[1])
+    if parts[0] == "d" and len(parts) == 3:
+        return parse_date(parts[1]), int(parts[2])
+    raise ValueError("bad cursor")
+
 @timebars_bp.route("/api/todos", methods=["GET"])
 def get_todos():
+    """
+    GET /api/todos?status=OPEN&type=&case_id=&due_from=&due_to=&limit=100&cursor=
+    Ordered by DueDate (NULLs last) then TodoID. Without limit / cursor the
+    response is the full list, as before; with either it is one keyset page,
+    {"ok", "items", "next_cursor"}.
+    """
     from app import get_db_connection, login_required
 
     @login_required
     def inner():
         status = (request.args.get("status") or "OPEN").upper()
-        due_before = request.args.get("due_before")
         todo_type = request.args.get("type")
+        case_id = request.args.get("case_id", type=int)
+        paged = "limit" in request.args or "cursor" in request.args
+        limit = max(1, min(500, request.args.get("limit", 100, type=int)))
 
-        sql = """
-          SELECT TodoID, CaseID, Type, Title, DueDate, Status, RelatedEntityType, RelatedEntityID, TemplateID, MetaKey
+        try:
+            due_from = parse_date(request.args.get("due_from"))
+            due_to = parse_date(request.args.get("due_to") or request.args.get("due_before"))
+            after = _decode_todo_cursor(request.args["cursor"]) if request.args.get("cursor") else None
+        except ValueError:
+            return jsonify({"ok": False, "error": "Invalid due_from / due_to / cursor"}), 400
+
+        sql = f"""
+          SELECT {"TOP (:Limit)" if paged else ""}
+                 TodoID, CaseID, Type, Title, DueDate, Status, RelatedEntityType, RelatedEntityID, TemplateID, MetaKey
           FROM dbo.CaseTodos
           WHERE Status = :Status
         """
         params = {"Status": status}
+        if paged:
+            params["Limit"] = limit + 1
 
         if todo_type:
             sql += " AND Type = :Type"
             params["Type"] = todo_type
 
-        if due_before:
-            sql += " AND DueDate <= :DueBefore"
-            params["DueBefore"] = due_before
+        if case_id:
+            sql += " AND CaseID = :CaseID"
+            params["CaseID"] = case_id
+
+        if due_from:
+            sql += " AND DueDate >= :DueFrom"
+            params["DueFrom"] = due_from
+
+        if due_to:
+            sql += " AND DueDate <= :DueTo"
+            params["DueTo"] = due_to
+
+        if after:
+            after_due, after_id = after
+            if after_due is None:
+                sql += " AND DueDate IS NULL AND TodoID > :AfterID"
+            else:
+                sql += """
+                  AND (DueDate > :AfterDue
+                       OR (DueDate = :AfterDue AND TodoID > :AfterID)
+                       OR DueDate IS NULL)
+                """
+                params["AfterDue"] = after_due
+            params["AfterID"] = after_id
+
+        sql += " ORDER BY CASE WHEN DueDate IS NULL THEN 1 ELSE 0 END, DueDate ASC, TodoID ASC"
+
+        with get_db_connection() as conn:
+            rows = [dict(r._mapping) for r in conn.execute(text(sql), params).fetchall()]
+
+        if not paged:
+            return jsonify(rows)
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        return jsonify({
+            "ok": True,
+            "items": rows,
+            "next_cursor": _encode_todo_cursor(rows[-1]) if has_more else None,
+        })
+
+    return inner()
+
+# (case_id, type, today) -> (expires_at, payload); cleared on todo writes + recalc
+TODO_COUNTS_TTL_SECONDS = 30
+_todo_counts_cache = {}
+
+def invalidate_todo_counts(*_):
+    _todo_counts_cache.clear()
+
+register_recalc_listener(invalidate_todo_counts)
+
+@timebars_bp.route("/api/todos/counts", methods=["GET"])
+def get_todo_counts():
+    """
+    Open todo counts (overdue, due today, due in the next 7 days, next due date)
+    overall and per Type, from one GROUPING SETS query. Cached briefly.
+    """
+    from app import get_db_connection, login_required
+    from datetime import date
+
+    @login_required
+    def inner():
+        case_id = request.args.get("case_id", type=int)
+        todo_type = request.args.get("type")
+        today = date.today()
+
+        key = (case_id, todo_type, today)
+        hit = _todo_counts_cache.get(key)
+        if hit and hit[0] > datetime.utcnow():
+            return jsonify(hit[1])
+
+        sql = """
+            SELECT
+                Type,
+                GROUPING(Type) AS IsTotal,
+                COUNT_BIG(*) AS OpenCount,
+                SUM(CASE WHEN DueDate < :Today THEN 1 ELSE 0 END) AS Overdue,
+                SUM(CASE WHEN DueDate = :Today THEN 1 ELSE 0 END) AS DueToday,
+                SUM(CASE WHEN DueDate >= :Today AND DueDate < :WeekEnd THEN 1 ELSE 0 END) AS DueThisWeek,
+                SUM(CASE WHEN DueDate IS NULL THEN 1 ELSE 0 END) AS NoDueDate,
+                MIN(CASE WHEN DueDate >= :Today THEN DueDate END) AS NextDue
+            FROM dbo.CaseTodos
+            WHERE Status = 'OPEN'
+        """
+        params = {"Today": today, "WeekEnd": today + timedelta(days=7)}
+
+        if case_id:
+            sql += " AND CaseID = :CaseID"
+            params["CaseID"] = case_id
+
+        if todo_type:
+            sql += " AND Type = :Type"
+            params["Type"] = todo_type
 
-        sql += " ORDER BY CASE WHEN DueDate IS NULL THEN 1 ELSE 0 END, DueDate ASC"
+        sql += " GROUP BY GROUPING SETS ((Type), ())"
 
         with get_db_connection() as conn:
             rows = conn.execute(text(sql), params).fetchall()
 
-        return jsonify([dict(r._mapping) for r in rows])
+        def counts(m):
+            return {
+                "open": int(m["OpenCount"] or 0),
+                "overdue": int(m["Overdue"] or 0),
+                "due_today": int(m["DueToday"] or 0),
+                "due_this_week": int(m["DueThisWeek"] or 0),
+                "no_due_date": int(m["NoDueDate"] or 0),
+                "next_due": parse_date(m["NextDue"]).isoformat() if m["NextDue"] else None,
+            }
+
+        empty = {"open": 0, "overdue": 0, "due_today": 0, "due_this_week": 0, "no_due_date": 0, "next_due": None}
+        payload = {"ok": True, "today": today.isoformat(), "total": empty, "by_type": {}}
+
+        for r in rows:
+            m = r._mapping
+            if m["IsTotal"]:
+                payload["total"] = counts(m)
+            else:
+                payload["by_type"][m["Type"]] = counts(m)
+
+        _todo_counts_cache[key] = (datetime.utcnow() + timedelta(seconds=TODO_COUNTS_TTL_SECONDS), payload)
+
+        return jsonify(payload)
 
     return inner()
 
@@ -482,7 +1271,7 @@ def get_case_todos(case_id):
                 ON u.UserID = t.CompletedByUserID
             WHERE t.CaseID = :CaseID
             AND t.Status IN ({status_in})
-            AND t.Type IN ('TIMEBAR_REMINDER', 'MISSING_VOYAGE_END_DATE')
+            AND t.Type IN ('TIMEBAR_REMINDER', 'MISSING_VOYAGE_END_DATE', 'DATA_QUALITY')
             ORDER BY
             CASE WHEN t.DueDate IS NULL THEN 1 ELSE 0 END,
             t.DueDate ASC,
@@ -526,7 +1315,7 @@ def update_case_notice(case_notice_id):
             if row:
                 recalc_case_timebars(conn, row._mapping["CaseID"], row._mapping["OrgID"], "VoyageEndDate")
 
-            conn.commit()
+            commit_and_notify(conn)
 
         return jsonify({"ok": True})
 
@@ -550,13 +1339,14 @@ def delete_case_notice(case_notice_id):
             case_id = row._mapping["CaseID"] if row else None
 
             # Dismiss related todos
-            conn.execute(text("""
+            dismissed = conn.execute(text("""
                 UPDATE dbo.CaseTodos
                 SET Status='DISMISSED', UpdatedAt=SYSUTCDATETIME()
+                OUTPUT inserted.TodoID
                 WHERE RelatedEntityType='CaseNotice'
                   AND RelatedEntityID=:ID
                   AND Status='OPEN'
-            """), {"ID": case_notice_id})
+            """), {"ID": case_notice_id}).fetchall()
 
             # Delete notice
             conn.execute(text("""
@@ -568,7 +1358,13 @@ def delete_case_notice(case_notice_id):
             if case_id:
                 recalc_case_timebars(conn, case_id, org_id=1, voyage_end_col="VoyageEndDate")
 
-            conn.commit()
+                # The deleted notice isn't part of the recalc result
+                queue_recalc_result(conn, {
+                    "changed_cases": [case_id],
+                    "reminders": {"upserted": [], "dismissed": [r[0] for r in dismissed]},
+                })
+
+            commit_and_notify(conn)
 
         return jsonify({"ok": True})
 
@@ -603,37 +1399,170 @@ def update_case_todo(todo_id):
 
         with get_db_connection() as conn:
             if status == "DONE":
-                conn.execute(text("""
+                updated = conn.execute(text("""
                     UPDATE dbo.CaseTodos
                     SET Status='DONE',
                         CompletedAt=SYSUTCDATETIME(),
                         CompletedByUserID=:UserID,
                         CompletionNote=:Note,
                         UpdatedAt=SYSUTCDATETIME()
+                    OUTPUT inserted.TodoID, inserted.Status, inserted.Type, inserted.DueDate, inserted.NotifiedAt
                     WHERE TodoID=:TodoID;
-                """), {"TodoID": todo_id, "UserID": user_id, "Note": note})
+                """), {"TodoID": todo_id, "UserID": user_id, "Note": note}).fetchall()
             else:
-                conn.execute(text("""
+                updated = conn.execute(text("""
                     UPDATE dbo.CaseTodos
                     SET Status=:Status,
                         CompletedAt=NULL,
                         CompletedByUserID=NULL,
                         CompletionNote=NULL,
                         UpdatedAt=SYSUTCDATETIME()
+                    OUTPUT inserted.TodoID, inserted.Status, inserted.Type, inserted.DueDate, inserted.NotifiedAt
                     WHERE TodoID=:TodoID;
-                """), {"TodoID": todo_id, "Status": status})
+                """), {"TodoID": todo_id, "Status": status}).fetchall()
 
             conn.commit()
 
+        # Re-opened reminders go back on the scheduler, closed ones drop out;
+        # also clears the counts cache
+        _notify_recalc_listeners(todo_status_changes(updated))
+
         return jsonify({"ok": True})
 
     return inner()
 
+def todo_status_changes(rows):
+    """
+    Recalc-listener result for todos whose Status was just set. rows: OUTPUT
+    (TodoID, Status, Type, DueDate, NotifiedAt). Open, un-notified reminders
+    are (re)scheduled; everything else is dismissed.
+    """
+    upserted, dismissed = [], []
+    for todo_id, status, todo_type, due_date, notified_at in rows:
+        if status == "OPEN" and todo_type == "TIMEBAR_REMINDER" and notified_at is None:
+            upserted.append((todo_id, due_date))
+        else:
+            dismissed.append(todo_id)
+    return {"changed_cases": [], "reminders": {"upserted": upserted, "dismissed": dismissed}}
+
+MAX_BULK_TODOS = 5000
+
+@timebars_bp.route("/api/timebars/todos", methods=["PATCH"])
+def bulk_update_case_todos():
+    """
+    PATCH /api/timebars/todos
+      {"Items": [{"TodoID": 1, "Status": "DONE", "CompletionNote": "..."}, ...]}
+      {"TodoIDs": [1, 2, 3], "Status": "DISMISSED"}
+    Same rules as the single-todo PATCH, applied in one UPDATE; returns one
+    result per item ({"TodoID", "ok", "error"}), including items whose
+    TodoID is missing or not an integer.
+    """
+    from app import get_db_connection, login_required
+    from flask import session
+
+    @login_required
+    def inner():
+        payload = request.get_json(silent=True) or {}
+
+        items = payload.get("Items")
+        if items is None and payload.get("TodoIDs") is not None:
+            items = [
+                {"TodoID": tid, "Status": payload.get("Status"), "CompletionNote": payload.get("CompletionNote")}
+                for tid in payload["TodoIDs"]
+            ]
+
+        if not isinstance(items, list) or not items:
+            return jsonify({"ok": False, "error": "Items or TodoIDs required"}), 400
+
+        if len(items) > MAX_BULK_TODOS:
+            return jsonify({"ok": False, "error": f"At most {MAX_BULK_TODOS} todos per request"}), 400
+
+        results = {}
+        updates = {}
+        invalid = []
+
+        for index, item in enumerate(items):
+            raw_id = item.get("TodoID") if isinstance(item, dict) else None
+            try:
+                todo_id = int(raw_id)
+            except (TypeError, ValueError):
+                invalid.append({"TodoID": raw_id, "index": index, "ok": False, "error": "Invalid TodoID"})
+                continue
+
+            raw_status = item.get("Status", item.get("status", ""))
+            status = str(raw_status or "").upper().strip()
+
+            if status not in ("OPEN", "DONE", "DISMISSED"):
+                results[todo_id] = {"TodoID": todo_id, "ok": False, "error": f"Invalid Status: {raw_status}"}
+                updates.pop(todo_id, None)
+                continue
+
+            note = item.get("CompletionNote", item.get("completionNote"))
+            updates[todo_id] = {
+                "TodoID": todo_id,
+                "Status": status,
+                "Note": note if status == "DONE" else None,
+            }
+            results.pop(todo_id, None)
+
+        user_id = session.get("user_id")
+        if not user_id and any(u["Status"] == "DONE" for u in updates.values()):
+            return jsonify({"ok": False, "error": "No user_id in session. Please log out and log back in."}), 401
+
+        updated = []
+        if updates:
+            with get_db_connection() as conn:
+                conn.execute(text("""
+                    DROP TABLE IF EXISTS #todo_updates;
+                    CREATE TABLE #todo_updates (
+                        TodoID INT PRIMARY KEY,
+                        Status VARCHAR(20) NOT NULL,
+                        Note NVARCHAR(MAX) NULL
+                    );
+                """))
+
+                insert_rows(conn, "#todo_updates", ["TodoID", "Status", "Note"], list(updates.values()))
+
+                updated = conn.execute(text("""
+                    UPDATE t
+                    SET Status = u.Status,
+                        CompletedAt = CASE WHEN u.Status = 'DONE' THEN SYSUTCDATETIME() END,
+                        CompletedByUserID = CASE WHEN u.Status = 'DONE' THEN :UserID END,
+                        CompletionNote = CASE WHEN u.Status = 'DONE' THEN u.Note END,
+                        UpdatedAt = SYSUTCDATETIME()
+                    OUTPUT inserted.TodoID, inserted.Status, inserted.Type,
+                           inserted.DueDate, inserted.NotifiedAt
+                    FROM dbo.CaseTodos t
+                    JOIN #todo_updates u
+                        ON u.TodoID = t.TodoID;
+
+                    DROP TABLE IF EXISTS #todo_updates;
+                """), {"UserID": user_id}).fetchall()
+
+                conn.commit()
+
+        for todo_id, status, *_ in updated:
+            results[todo_id] = {"TodoID": todo_id, "ok": True, "Status": status}
+
+        for todo_id in updates:
+            results.setdefault(todo_id, {"TodoID": todo_id, "ok": False, "error": "Todo not found"})
+
+        # Same scheduler / counts-cache updates as the single-todo PATCH
+        if updated:
+            _notify_recalc_listeners(todo_status_changes(updated))
+
+        return jsonify({
+            "ok": True,
+            "updated": len(updated),
+            "failed": len(invalid) + sum(1 for r in results.values() if not r["ok"]),
+            "results": invalid + [results[k] for k in sorted(results)],
+        })
+
+    return inner()
+
 @timebars_bp.route("/api/timebars/todos/<int:todo_id>/generate", methods=["GET"])
 def generate_notice_from_todo(todo_id):
     from app import get_db_connection, login_required
-    from flask import session
-    from datetime import datetime
 
     @login_required
     def inner():
@@ -646,11 +1575,10 @@ def generate_notice_from_todo(todo_id):
                 SELECT
                     t.TodoID,
                     t.CaseID,
-                    t.TemplateID AS TodoTemplateID,
+                    COALESCE(t.TemplateID, nt.TemplateID) AS TemplateID,
                     cn.CaseNoticeID,
                     cn.ExpiryDate,
                     nt.Name AS NoticeTypeName,
-                    nt.TemplateID AS NoticeTypeTemplateID,
                     c.VesselName,
                     c.CharterersName AS ChartererName,
                     c.VoyageEndDate,
@@ -671,7 +1599,7 @@ def generate_notice_from_todo(todo_id):
             m = todo._mapping
 
             # 2️⃣ Determine template (Todo first, then NoticeType fallback)
-            template_id = m.get("TodoTemplateID") or m.get("NoticeTypeTemplateID")
+            template_id = m.get("TemplateID")
 
             if not template_id:
                 return jsonify({
@@ -679,51 +1607,14 @@ def generate_notice_from_todo(todo_id):
                     "error": "No template linked (Todo.TemplateID and NoticeType.TemplateID are both NULL)"
                 }), 400
 
-            # 3️⃣ Load Template
-            template = conn.execute(text("""
-                SELECT TemplateID, Name, Subject, Body
-                FROM dbo.Templates
-                WHERE TemplateID = :TemplateID
-                  AND OrgID = :OrgID
-                  AND IsActive = 1
-            """), {
-                "TemplateID": int(template_id),
-                "OrgID": org_id
-            }).fetchone()
+            # 3️⃣ Compiled template at its current Version (parsed once per TemplateID + Version)
+            compiled = load_compiled(conn, template_id, org_id)
 
-            if not template:
+            if not compiled:
                 return jsonify({"ok": False, "error": "Template not found"}), 404
 
-            t = template._mapping
-
-            # 4️⃣ Normalize date/datetime safely
-            expiry = m.get("ExpiryDate")
-            voyage_end = m.get("VoyageEndDate")
-
-            expiry_date = expiry.date() if isinstance(expiry, datetime) else expiry
-            voyage_end_date = voyage_end.date() if isinstance(voyage_end, datetime) else voyage_end
-
-            # 5️⃣ Pretty date formatter
-            def fmt(d):
-                return d.strftime("%d %b %Y") if d else ""
-
-            # 6️⃣ Merge context
-            context = {
-                "VesselName": m.get("VesselName"),
-                "ChartererName": m.get("ChartererName"),
-                "VoyageEndDate": fmt(voyage_end_date),
-                "TimebarExpiryDate": fmt(expiry_date),
-                "NoticeTypeName": m.get("NoticeTypeName"),
-                "Today": fmt(datetime.utcnow().date()),
-                "CaseRef": m.get("DeepBlueRef"),
-            }
-
-            # 7️⃣ Merge template tokens
-            subject, body = merge_template(
-                t.get("Subject"),
-                t.get("Body"),
-                context
-            )
+        # 4️⃣ Render in one pass
+        subject, body = compiled.render(build_notice_context(m))
 
         return jsonify({
             "ok": True,
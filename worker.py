@@ -0,0 +1,34 @@
+# ==============================================
+# 🧰 worker.py — Background job worker
+# ==============================================
+# Runs queued jobs (see jobs.py) outside the web process:
+#
+#   python worker.py                       all kinds, one thread
+#   python worker.py --concurrency 4
+#   python worker.py --kind cp.parse --kind email.run_rule
+#
+# Equivalent to `flask --app app jobs work`. Importing app registers every
+# job handler and, unless CASE_OUTBOX_WORKER=0, starts the case outbox
+# drainer in this process too.
+# ==============================================
+import argparse
+
+import app  # noqa: F401  (registers job handlers, starts the outbox drainer)
+from jobs import run_workers, worker_loop
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued background jobs.")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--kind", dest="kinds", action="append", help="Only run these job kinds.")
+    parser.add_argument("--poll", type=float, default=2.0, help="Seconds between polls when idle.")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty.")
+    args = parser.parse_args()
+
+    print(f"🧰 Job worker — {', '.join(args.kinds or []) or 'all kinds'} × {args.concurrency}")
+    if args.once:
+        worker_loop(args.kinds, args.poll, once=True)
+    else:
+        run_workers(args.concurrency, args.kinds, args.poll)
+
+if __name__ == "__main__":
+    main()